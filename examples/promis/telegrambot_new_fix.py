@@ -8,7 +8,6 @@ from telegram.ext import Application, CommandHandler, MessageHandler, filters, C
 from pathlib import Path
 from langda import langda_solve
 from promis_execute_new import promis_execution, set_path
-from problog import get_evaluatable
 
 
 from datetime import datetime, timedelta
@@ -95,12 +94,12 @@ query(relative_offset(_,_)).
 """
     while(True):
         try:
-            special_model = langda_solve("double_dc", danger_rules_string, model_name, 
+            special_model, problog_result = langda_solve(rule_string=danger_rules_string, agent_type="double_dc", model_name=model_name,
                         prefix="telegram_bot", langda_ext=msg_dict, 
-                        load=False)
-
-            special_model = special_model.strip("'")
-            special_result = get_evaluatable().create_from(special_model).evaluate()
+                        load=False, final_evaluation="always", return_result=True)
+            if problog_result is None or not problog_result.ok:
+                raise ValueError(f"Evaluation failed: {problog_result.error if problog_result else 'no result'}")
+            special_result = problog_result.as_dict()
             pattern = r"(\w+)\(\s*(-?\d+\.\d+),\s*(-?\d+\.\d+)\s*\)"
             result_list = []
             for key in special_result:
@@ -134,11 +133,13 @@ query(fly(_)).
 """
     
     # 使用传入的msg_dict而不是硬编码
-    special_model = langda_solve("single_dc", danger_rules_string, model_name, 
+    special_model, problog_result = langda_solve(rule_string=danger_rules_string, agent_type="single_dc", model_name=model_name,
                 prefix="telegram_bot_fly", langda_ext=msg_dict,
-                load=False)
-    special_model = special_model.strip("'")
-    special_result = get_evaluatable().create_from(special_model).evaluate()
+                load=False, final_evaluation="always", return_result=True)
+    if problog_result is None or not problog_result.ok:
+        logger.error(f"Could not evaluate the path: {problog_result.error if problog_result else 'no result'}")
+        return None
+    special_result = problog_result.as_dict()
     
     key = next(iter(special_result))  # 提取唯一键
 
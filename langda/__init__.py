@@ -9,7 +9,7 @@ from .agent import (
 from typing import Literal, TypedDict, Unpack
 from pathlib import Path
 from .utils.test_tools import _problog_test
-from .utils import invoke_agent
+from .utils import invoke_agent, evaluate_batch, ProblogResult
 from .logger import setup_logging
 
 import logging
@@ -19,6 +19,8 @@ __all__ = [
     'langda_solve',
     'invoke_agent',
     '_problog_test',
+    'evaluate_batch',
+    'ProblogResult',
 
     # As type:
     'LangdaAgentSingleSimple',
@@ -48,12 +50,29 @@ class SolveOverrides(TypedDict, total=False):
     log_path: str
     config: dict
     api_key: str
+    hash_digest_size: int
+    problog_backend: str
+    problog_timeout: float
+    anytime_evaluation: bool
+    final_evaluation: Literal["reuse", "always", "skip"]
+    static_validation: bool
+    incremental_evaluation: bool
+    local_formatter: bool
+    structured_output: bool
+    hedge_requests: bool
+    metrics_path: str
+    analysis_token_budget: int
+    prefix_cache_layout: bool
+    agent_max_iterations: int
+    agent_max_execution_time: float
+    tool_quotas: dict[str, int]
+    return_result: bool
 
 
 def langda_solve(
     rule_string: str,
     **overrides: Unpack[SolveOverrides]
-) -> str:
+) -> str | tuple[str, ProblogResult | None]:
     """
     Create a Langda agent of the specified type.
     Args:
@@ -73,10 +92,45 @@ def langda_solve(
             1. you could use langda(LLM:"/* Mark */"). to accept dynamic prompt words as 'port'
             2. Then you could give all the dynamic prompts in form of {"Mark":"your real prompt",...}
             3. The agent will check all the ports and replace with corresponding prompts
+        hash_digest_size: blake2b digest size in bytes of the langda HASH, the HASH has twice as many characters. Default as 4.
+        problog_backend: inference backend of the problog tests. Default as None (problog default):
+            - "sdd", "sddx", "ddnnf" (or "dsharp"), "bdd", "forward" (fsdd), "kbest", "approximate" (sampling)
+            - "auto": pick a backend from program statistics and fall back to the next one on timeout
+        problog_timeout: time budget of one problog evaluation in seconds. Default as 120.
+        anytime_evaluation: when exact inference does not finish in half of problog_timeout, use the rest for
+            [lower, upper] probability bounds (k-best) or sample estimates (programs with evidence). Default as False.
+        final_evaluation: problog evaluation of the final code. Default as "reuse":
+            - reuse: reuse the result of evaluate_node when the final code is byte-identical to the evaluated one
+            - always: always evaluate again; skip: no final evaluation (throughput mode)
+        static_validation: check syntax, probability annotations, undefined predicates and unsafe negations
+            of the generated code before the problog test, inference is skipped if an error is found. Default as True.
+        incremental_evaluation: between rounds, reuse the results of queries that only depend on unchanged clauses,
+            only queries reaching a changed clause in the predicate dependency graph are grounded again. Default as False.
+        local_formatter: double-chain agents map the generated code onto the HASHes by aligning it with the template and
+            only call the second (formatting) chain when the alignment is ambiguous. Default as True.
+        structured_output: ask the provider for structured output (tool calling) with a schema per HASH for the code
+            and report blocks of generate, regenerate and evaluate, falls back to free text if it fails. Default as False.
+        hedge_requests: send a duplicate of slow generate/regenerate calls to the secondary provider/model configured
+            in AgentSettings (HEDGE_MODEL, HEDGE_PROVIDER), the first answer wins. Default as False.
+        metrics_path: export the metrics of the run (wall time, tokens, cache hits and retries of every node, LLM call,
+            tool call, problog evaluation and database operation) to this file, Prometheus text for *.prom, JSONL
+            otherwise. They are always in final_result["metrics"]. Default as None.
+        analysis_token_budget: the history of the evaluate rounds offered to regeneration (get_report_tool) keeps only
+            the latest report per HASH and deduplicated analyses, newest first within this many tokens. Default as 4000.
+        prefix_cache_layout: lay out every prompt as the shared system prompt and syntax notes, the static instructions
+            of the prompt type and the per-run content last, so the provider's prefix cache can be hit. Default as False.
+        agent_max_iterations: tool-calling turns of a generate/regenerate call; when they run out the model is asked
+            once more, without tools, for its final answer. Default as 15.
+        agent_max_execution_time: seconds of the tool-calling loop, handled like agent_max_iterations. Default as None.
+        tool_quotas: calls per tool and generate/regenerate call, e.g. {"search_tool": 2}; further calls tell the
+            model to answer with what it has. Default as {}.
+        return_result: also return the ProblogResult of the final code (None if final_evaluation is "skip"),
+            so its probabilities can be read without evaluating the code again. Default as False.
 
     Returns:
-        The executable files created from rules_string
+        The executable files created from rules_string, with return_result as (code, ProblogResult)
     """
+    return_result = overrides.pop("return_result", False)
     try:
         safe_overrides = {k: v for k, v in overrides.items() if v is not None}
         cfgs = AgentConfig(
@@ -93,6 +147,9 @@ def langda_solve(
         agent_class = agent_map[cfgs.agent_type]
         agent:LangdaAgentProtocol = agent_class(cfgs)
         result = agent.call_langda_workflow()
+        if return_result:
+            evaluation = result.get("problog_result")
+            return result.get("final_result", ""), ProblogResult.from_bytes(evaluation) if evaluation else None
         return result.get("final_result", "")
     finally:
         logger.info(f"\n### ================================= Finished langda_solve with {cfgs.agent_type} ================================= ###\nAll heils to Langda!")
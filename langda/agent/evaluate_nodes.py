@@ -5,8 +5,12 @@ from ..utils import (
     _replace_placeholder, 
     invoke_agent,
     _parse_simple_dictonary,
-    problog_test_tool,
+    problog_result_tool,
+    ProblogResult,
+    _program_digest,
     _deep2normal,
+    validate_program,
+    compact_test_analysis,
 )
 from .state import BasicState, TaskStatus
 from ..config import paths
@@ -14,6 +18,8 @@ from ..config import paths
 import logging
 logger = logging.getLogger(__name__)
 
+_STATIC_FAILURE = "% Static validation failed, inference skipped:\n"
+
 class EvaluateNodes:
     """
     The nodes that are used for testing results
@@ -25,14 +31,20 @@ class EvaluateNodes:
         logger.info("\n### ====================== processing evaluate_node ====================== ###")
         state["status"] = TaskStatus.TEST
         test_result:str = ""
+        tested_code:str = ""
+        evaluation:ProblogResult = None
         constructed_code = _replace_placeholder(state["prompt_template"],state["temp_full_codes"])
         raw_prompt_template = _replace_placeholder(state["prompt_template"], state["fest_codes"], state["placeholder"])
         # problog_test_tool:
         if state["has_query"]: # need to do a test first
-            test_result = problog_test_tool(constructed_code,state["prefix"],timeout=120)
+            tested_code = constructed_code
+            evaluation = EvaluateNodes._test_code(state, tested_code)
+            test_result = evaluation.render()
             paths.save_as_file(test_result, "result", f"steps/{state['prefix']}/#test_results", mode="a",save_dir=state["save_dir"])
         elif state["query_ext"]:
-            test_result = problog_test_tool(_deep2normal(constructed_code, state["query_ext"]),state["prefix"],timeout=120)
+            tested_code = _deep2normal(constructed_code, state["query_ext"])
+            evaluation = EvaluateNodes._test_code(state, tested_code)
+            test_result = evaluation.render()
             paths.save_as_file(test_result, "result", f"steps/{state['prefix']}/#test_results", mode="a",save_dir=state["save_dir"])
         else:
             logger.warning("Warning, evaluate without test result. Maybe you should set query_ext first.")
@@ -43,6 +55,7 @@ class EvaluateNodes:
         input={
             "prompt_template": test_prompt_template,
             "test_analysis":[], #### Changed for test!!!
+            "expected_hashes":[_parse_simple_dictonary(code)[0] for code in state["generated_codes"]],
         }
         evaluated_result, formatted_prompt, evaluated_middle_result = invoke_agent(
             agent_type=state["agent_type"]["evaluate"], 
@@ -50,7 +63,9 @@ class EvaluateNodes:
             tools=state["tools"], 
             prompt_type="evaluate", 
             input=input, 
-            config=state["config"])
+            config=state["config"],
+            structured_output=state.get("structured_output", False),
+            prefix_cache_layout=state.get("prefix_cache_layout", False))
 
         paths.save_as_file(formatted_prompt,"prompt",f"steps/{state['prefix']}/formatted_evalprompt_{state['iter_count']}",save_dir=state["save_dir"])
         paths.save_as_file(evaluated_result, "result",f"steps/{state['prefix']}/#eval_result_{state['iter_count']}",save_dir=state["save_dir"])
@@ -79,22 +94,52 @@ class EvaluateNodes:
                     origin_fest_codes[i][key] = value_new
                 iter += 1
 
-        test_analysis:List[str] = state["test_analysis"]
-        test_analysis.append(evaluated_middle_result)
+        # keep only the latest report per HASH and the analysis lines later rounds do not repeat
+        test_analysis:List = compact_test_analysis(state["test_analysis"] + [{
+            "round": state["iter_count"],
+            "analysis": evaluated_middle_result,
+            "reports": {hash_value: report for block in evaluated_codes for hash_value, report in block.items()},
+        }])
 
+        # only inference results may be reused by summary_node, a static validation failure is no final evaluation
+        inferred = evaluation is not None and not (evaluation.error or "").startswith(_STATIC_FAILURE)
+        last_eval = {
+            "last_eval_hash":_program_digest(tested_code) if tested_code and inferred else "",
+            "last_eval_result":evaluation.to_bytes() if inferred else b"",
+        }
         if evaluated_codes:
             return {
                 "fest_codes":origin_fest_codes,
                 "langda_reqs":langda_reqs,
                 "test_analysis":test_analysis,
+                **last_eval,
             }
         else:
             logger.warning(f"evaluate_node: Generated report no found...")
             return {
                 "fest_codes":origin_fest_codes,
                 "langda_reqs":langda_reqs,
+                "test_analysis":test_analysis,
+                **last_eval,
             }
 
+    @staticmethod
+    def _test_code(state:BasicState, tested_code:str) -> ProblogResult:
+        """
+        Static pre-validation first, the problog inference only runs if it found no error.
+        Warnings are appended to the inference result.
+        """
+        if not state.get("static_validation", True):
+            return problog_result_tool(tested_code,state["prefix"],timeout=state.get("problog_timeout", 120),backend=state.get("problog_backend"),anytime=state.get("anytime_evaluation", False),incremental=state.get("incremental_evaluation", False))
+        report = validate_program(tested_code)
+        if not report.ok:
+            logger.info(f"evaluate_node: static validation failed, inference skipped:\n{report.format()}")
+            return ProblogResult.failure(_STATIC_FAILURE + report.format())
+        test_result = problog_result_tool(tested_code,state["prefix"],timeout=state.get("problog_timeout", 120),backend=state.get("problog_backend"),anytime=state.get("anytime_evaluation", False),incremental=state.get("incremental_evaluation", False))
+        if report.issues:
+            test_result = test_result._replace(warnings="% Static validation warnings:\n" + report.format())
+        return test_result
+
     @staticmethod
     def _decide_next_eval(state:BasicState):
         logger.info("processing _decide_next_eval... #current round:",state["iter_count"])
@@ -6,11 +6,15 @@ from ..utils import (
     _replace_placeholder, 
     integrated_code_parser,
     _parse_simple_dictonary,
-    problog_test_tool,
+    _legacy_langda_hash,
+    problog_result_tool,
+    ProblogResult,
+    _program_digest,
     _list_to_dict,
 )
 from .state import BasicState, TaskStatus
 from ..database import DictDB
+from ..metrics import record
 from typing import List, Any, Type, Tuple
 from pathlib import Path
 from ..config import paths
@@ -47,7 +51,8 @@ class GeneralNodes:
         fest_codes:List[dict] = []      # {"hash1":"code1","hash2":"code2",...}
         langda_dicts:List[LangdaDict] = []
 
-        raw_prompt_template, lann_dicts, raw_langda_dicts, has_query = integrated_code_parser(state["rule_string"], state["placeholder"])
+        raw_prompt_template, lann_dicts, raw_langda_dicts, has_query = integrated_code_parser(
+            state["rule_string"], state["placeholder"], state.get("hash_digest_size", 4))
 
         with DictDB(db_path=state["save_dir"], db_prefix=f"{state['prefix']}") as langdaDB:
             logger.info(f"items from database: {langdaDB.get_all_items()}")
@@ -58,6 +63,7 @@ class GeneralNodes:
                 will be determined according to the previous mark tag. Later, when the code is run but not updated, 
                 it can be ensured that the previous code content is automatically extracted from the database.
                 """
+                legacy_langda = dict(langda) # before langda_ext, for databases written before the blake2b HASH
                 if state["langda_ext"]: # If has "dynamic content": for example /* Secure */, parse the content
                     langda_ext_dict = state["langda_ext"]
                     llm_content = langda["LLM"]
@@ -84,6 +90,8 @@ class GeneralNodes:
                     langda_dicts.append(langda)
                 elif langda["FUP"].lower() == "false" or state["load"]:
                     code = langdaDB.get_item(langda["HASH"])
+                    if not code and langdaDB.migrate_key(_legacy_langda_hash(legacy_langda), langda["HASH"]):
+                        code = langdaDB.get_item(langda["HASH"])
                     fest_codes.append({langda["HASH"]:code})
                     if not code: 
                         langda_dicts.append(langda)
@@ -117,7 +125,18 @@ class GeneralNodes:
             final_code = _replace_placeholder(state["prompt_template"],state["fest_codes"], state["placeholder"])
             sync_dict = _list_to_dict(state["fest_codes"])
         # ================== THIS IS ONLY FOR TESTING ================== #
-        result_new = problog_test_tool(final_code,state["prefix"],timeout = 120)
+        final_evaluation = state.get("final_evaluation", "reuse")
+        evaluation:ProblogResult = None
+        if final_evaluation == "skip":
+            result_new = "Final evaluation skipped."
+        else:
+            if final_evaluation == "reuse" and state.get("last_eval_result") and state.get("last_eval_hash") == _program_digest(final_code):
+                logger.info("Final code is identical to the last evaluated program, reusing its result")
+                record("problog", "final_reuse", cache_hit=True)
+                evaluation = ProblogResult.from_bytes(state["last_eval_result"])
+            else:
+                evaluation = problog_result_tool(final_code,state["prefix"],timeout = state.get("problog_timeout", 120),backend=state.get("problog_backend"),anytime=state.get("anytime_evaluation", False),incremental=state.get("incremental_evaluation", False))
+            result_new = evaluation.render(limit=None) # the result file gets every query
         logger.info(f"*** final result: ***\n{result_new}")
 
         # Don't delete! Database part!
@@ -140,6 +159,7 @@ class GeneralNodes:
                 "final_result":final_code,
                 "running_time":running_time,
                 "iter_count":state["iter_count"],
+                "problog_result":evaluation.to_bytes() if evaluation is not None else b"", # ProblogResult.from_bytes
             }
         }
 
@@ -26,6 +26,7 @@ class GenerateNodes:
         new_iter_count = state["iter_count"] + 1
 
         targeted_codes:List[dict] = []
+        expected_hashes = [key for key, value in map(_parse_simple_dictonary, state["fest_codes"]) if not value]
         raw_prompt_template = _replace_placeholder(state["prompt_template"], state["fest_codes"], state["placeholder"])
 
         if new_iter_count == 1:  # first round
@@ -34,6 +35,7 @@ class GenerateNodes:
             input={
                 "prompt_template": prompt_template,
                 "test_analysis": [], # analysis
+                "expected_hashes": expected_hashes, # stop streaming once all of them arrived
             }
         elif new_iter_count > 1:
             prompt_type = "regenerate"
@@ -44,6 +46,7 @@ class GenerateNodes:
                 "prompt_template": prompt_template,   # code with <langda>
                 # "constructed_code": constructed_code, # full code
                 "test_analysis": state["test_analysis"], # analysis
+                "expected_hashes": expected_hashes, # stop streaming once all of them arrived
             }
             
         else:
@@ -56,7 +59,15 @@ class GenerateNodes:
             tools=state["tools"], 
             prompt_type=prompt_type, 
             input=input, 
-            config=state["config"])
+            config=state["config"],
+            local_format=state.get("local_formatter", True),
+            structured_output=state.get("structured_output", False),
+            hedge=state.get("hedge_requests", False),
+            analysis_budget=state.get("analysis_token_budget", 4000),
+            prefix_cache_layout=state.get("prefix_cache_layout", False),
+            max_iterations=state.get("agent_max_iterations", 15),
+            max_execution_time=state.get("agent_max_execution_time"),
+            tool_quotas=state.get("tool_quotas"))
  
         paths.save_as_file(formatted_prompt,"prompt",f"steps/{state['prefix']}/formatted_gnrtprompt_{state['iter_count']}",save_dir=state["save_dir"])
         paths.save_as_file(generated_result,"result",f"steps/{state['prefix']}/#gnrt_result_{state['iter_count']}",save_dir=state["save_dir"])
@@ -2,7 +2,7 @@ import time
 import json
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from typing import Optional, Any, Literal, Dict
 
 from .state import BasicState
@@ -12,6 +12,8 @@ from .general_nodes import GeneralNodes
 from pathlib import Path
 from uuid import uuid4
 from ..config import paths
+from ..utils import resolve_backend
+from ..metrics import collect_metrics, metered
 
 DEFAULT_CONFIGURABLE = {
     "thread_id": lambda: str(uuid4()),
@@ -38,6 +40,22 @@ class AgentConfig(BaseModel):
     query_ext: str = ""
     log_path: str = "langda_run.log"
     api_key: Optional[str] = None
+    hash_digest_size: int = Field(default=4, ge=1, le=32) # blake2b digest bytes of a langda HASH (2 hex chars each)
+    problog_backend: Optional[str] = None # "sdd", "sddx", "ddnnf", "bdd", "forward", "approximate", "auto", None as problog default
+    problog_timeout: float = Field(default=120, gt=0) # seconds per problog evaluation
+    anytime_evaluation: bool = False # on timeout, report probability bounds or sample estimates
+    final_evaluation: Literal["reuse", "always", "skip"] = "reuse" # "skip" for throughput mode
+    static_validation: bool = True # skip the problog test if static checks find an error
+    incremental_evaluation: bool = False # reuse results of queries whose dependencies did not change
+    local_formatter: bool = True # format double-chain code locally, second chain only if ambiguous
+    structured_output: bool = False # schema per HASH through the provider's structured output
+    hedge_requests: bool = False # hedge slow generate calls with the secondary model of AgentSettings
+    metrics_path: Optional[str] = None # export the run metrics, Prometheus text for *.prom, JSONL otherwise
+    analysis_token_budget: int = Field(default=4000, gt=0) # cap of the compacted test_analysis for get_report_tool
+    prefix_cache_layout: bool = False # prompt layout that maximizes the provider's prefix cache hits
+    agent_max_iterations: int = Field(default=15, gt=0) # tool-calling turns of generate/regenerate before a final answer is forced
+    agent_max_execution_time: Optional[float] = Field(default=None, gt=0) # seconds of the tool-calling loop, None for no limit
+    tool_quotas: Dict[str, int] = Field(default_factory=dict) # calls per tool and generate call, e.g. {"search_tool": 2}
 
     # Session configuration
     """ Metadata and configurable settings, shape like:
@@ -59,6 +77,12 @@ class AgentConfig(BaseModel):
     """
     config: dict[str, Any] = Field(default_factory=dict)
 
+    @field_validator("problog_backend")
+    @classmethod
+    def _check_backend_(cls, value:Optional[str]) -> Optional[str]:
+        resolve_backend(value)
+        return value
+
     @model_validator(mode="after")
     def _ensure_config_(self)-> "AgentConfig":
         cfg:dict = self.config.get("configurable", {})
@@ -84,6 +108,8 @@ class LangdaAgentBase:
         self.state.update(cfgs.model_dump())
         # Initialize test analysis with syntax notes
         self.state["test_analysis"] = []
+        self.state["last_eval_hash"] = ""
+        self.state["last_eval_result"] = b""
         with open(Path(__file__).parent.parent / "prompts"/ "Problog_Syntax.txt", "r") as f_s:
             self.state["test_analysis"].append(f_s.read())
         
@@ -100,10 +126,10 @@ class LangdaAgentBase:
 
         workflow = StateGraph(BasicState)
         workflow.set_entry_point("init_node")
-        workflow.add_node("init_node", GeneralNodes.init_node)
-        workflow.add_node("generate_node", GenerateNodes.generate_node)
-        workflow.add_node("summary_node", GeneralNodes.summary_node)
-        workflow.add_node("evaluate_node", EvaluateNodes.evaluate_node)
+        workflow.add_node("init_node", metered("node", "init_node")(GeneralNodes.init_node))
+        workflow.add_node("generate_node", metered("node", "generate_node")(GenerateNodes.generate_node))
+        workflow.add_node("summary_node", metered("node", "summary_node")(GeneralNodes.summary_node))
+        workflow.add_node("evaluate_node", metered("node", "evaluate_node")(EvaluateNodes.evaluate_node))
         # Add conditional edges from init_node
         workflow.add_conditional_edges("init_node", GeneralNodes._decide_next_init, 
             {
@@ -136,7 +162,11 @@ class LangdaAgentBase:
         langda_workflow = self._create_workflow(workflow_type)
         
         langda_agent = langda_workflow.compile(checkpointer=self.checkpointer)
-        self.state = langda_agent.invoke(self.state, config=self.state["config"])
+        with collect_metrics(self.state["config"]["configurable"]["thread_id"]) as metrics:
+            self.state = langda_agent.invoke(self.state, config=self.state["config"])
+        self.state["final_result"]["metrics"] = metrics.to_dict()
+        if self.cfgs.metrics_path:
+            metrics.export(self.cfgs.metrics_path)
         
         graph_name = f"langda_agent_{workflow_type}"
         _draw_mermaid_png(langda_agent, graph_name)
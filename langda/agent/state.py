@@ -30,6 +30,22 @@ class BasicState(TypedDict):
     load:bool    # load from previous snapshots
     langda_ext: dict # User-provided context
     query_ext:str # Dynamic content
+    hash_digest_size: int # digest size of langda HASHes in bytes
+    problog_backend: str # inference backend of problog_test_tool
+    problog_timeout: float # time budget of one problog evaluation in seconds
+    anytime_evaluation: bool # bounds or sample estimates instead of a timeout error
+    final_evaluation: str # "reuse", "always" or "skip" the problog evaluation in summary_node
+    static_validation: bool # static checks before the problog test in evaluate_node
+    incremental_evaluation: bool # re-evaluate only the queries that depend on changed clauses
+    local_formatter: bool # skip the second chain of double-chain generation when the code aligns with the template
+    structured_output: bool # provider-native structured output for code and report blocks
+    hedge_requests: bool # duplicate slow generate calls to the secondary model
+    metrics_path: str # file the run metrics are exported to
+    analysis_token_budget: int # tokens of the test_analysis returned by get_report_tool
+    prefix_cache_layout: bool # static prompt parts first, per-run content last
+    agent_max_iterations: int # tool-calling turns before a final answer is forced
+    agent_max_execution_time: float # seconds of the tool-calling loop
+    tool_quotas: dict # calls per tool name
 
     # Prompting static parameters:
     tools: list # list of available tools
@@ -50,7 +66,9 @@ class BasicState(TypedDict):
     temp_full_codes: list # New code generated
     generated_codes: list # New code generated (does not include fest code)
     final_result: dict # Final result
-    test_analysis: list # Reports
+    test_analysis: list # syntax notes and the compacted evaluate rounds {"round", "analysis", "reports"}
+    last_eval_hash: str # digest of the program last evaluated by problog_test_tool
+    last_eval_result: bytes # ProblogResult of that evaluation, serialized
 
 @runtime_checkable
 class LangdaAgentProtocol(Protocol):
@@ -5,6 +5,7 @@ from typing import Optional, List, Dict, Any
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from .config import paths
+from .metrics import metered
 
 import logging
 logger = logging.getLogger(__name__)
@@ -86,6 +87,7 @@ class DictDB:
             logger.error(f"Failed to create table: {e}")
             raise RuntimeError(f"Failed to create table: {e}")
 
+    @metered("db")
     def add_or_update(self, hash_value: str, content: Dict[str, str]) -> str:
         """
         Add a new dictionary entry or update if already exists.
@@ -119,6 +121,7 @@ class DictDB:
             raise RuntimeError(f"Failed to add/update entry with hash {hash_value}: {e}")
         return hash_value
 
+    @metered("db")
     def get_item(self, hash_value: str) -> Optional[Dict[str, str]]:
         """
         Retrieve a dictionary by its hash value.
@@ -137,6 +140,7 @@ class DictDB:
         # Convert JSON string back to dictionary
         return row[0]
 
+    @metered("db")
     def get_all_items(self) -> Dict[str, Dict[str, str]]:
         """
         Get all dictionaries stored in the database.
@@ -154,6 +158,7 @@ class DictDB:
         
         return result
 
+    @metered("db")
     def list_all_hashes(self) -> List[str]:
         """
         List all hash values in the database.
@@ -166,6 +171,7 @@ class DictDB:
         rows = cursor.fetchall()
         return [row[0] for row in rows]
 
+    @metered("db")
     def remove(self, hash_value: str) -> bool:
         """
         Remove a dictionary entry by hash value.
@@ -186,6 +192,42 @@ class DictDB:
             logger.debug(f"Hash not found for removal: {hash_value}")
             return False
 
+    @metered("db")
+    def migrate_key(self, old_hash: str, new_hash: str) -> bool:
+        """
+        Move the entry stored under old_hash to new_hash, e.g. after the HASH scheme changed.
+        An existing entry under new_hash is never overwritten.
+        
+        args:
+            old_hash: The hash value the entry is currently stored under
+            new_hash: The hash value the entry should be stored under
+            
+        returns:
+            bool: True if migrated, False if old_hash was not found or new_hash already exists
+        """
+        if old_hash == new_hash or self.get_item(new_hash) is not None:
+            return False
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE langda_dict SET hash = ? WHERE hash = ?", (new_hash, old_hash))
+        self.conn.commit()
+        if cursor.rowcount > 0:
+            logger.info(f"Migrated hash: {old_hash} -> {new_hash}")
+            return True
+        return False
+
+    def migrate_keys(self, hash_mapping: Dict[str, str]) -> int:
+        """
+        Migrate several entries at once, see migrate_key.
+        
+        args:
+            hash_mapping: Dictionary of {old_hash: new_hash}
+
+        returns:
+            int: Number of entries migrated
+        """
+        return sum(self.migrate_key(old_hash, new_hash) for old_hash, new_hash in hash_mapping.items())
+
+    @metered("db")
     def sync_with_dict(self, dict_data: Dict[str, Dict[str, str]]) -> Dict[str, int]:
         """
         Synchronize the database with the provided dictionary.
@@ -244,6 +286,7 @@ class DictDB:
 
         return stats
 
+    @metered("db")
     def cleanup(self, valid_hashes: List[str]) -> int:
         """
         Delete all entries whose hash values are not in the provided valid_hashes list.
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import functools
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import logging
+logger = logging.getLogger(__name__)
+
+# kinds of events: "node", "llm", "tool", "problog", "db", "retry"
+_SUMMED = ("wall_seconds", "prompt_tokens", "completion_tokens", "cached_tokens")
+
+class MetricsCollector:
+    """
+    Events of one langda_solve run: wall time, tokens, cache hits, retries and errors of every node,
+    LLM call, tool call, problog evaluation and database operation. Thread-safe, the collector of the
+    current run is found through a context variable, see collect_metrics.
+    """
+
+    def __init__(self, run_id:str = ""):
+        self.run_id = run_id
+        self.events:List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def record(self, kind:str, name:str, **fields:Any) -> None:
+        event = {"kind": kind, "name": name, "time": round(time.time(), 3), **fields}
+        with self._lock:
+            self.events.append(event)
+
+    def count(self, kind:str) -> int:
+        with self._lock:
+            return sum(event["kind"] == kind for event in self.events)
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """{kind: {name: totals}} with count, errors, cache_hits, the summed fields and the max wall time"""
+        with self._lock:
+            events = list(self.events)
+        summary:Dict[str, Dict[str, Dict[str, float]]] = {}
+        for event in events:
+            totals = summary.setdefault(event["kind"], {}).setdefault(event["name"], {
+                "count": 0, "errors": 0, "cache_hits": 0, "max_wall_seconds": 0.0, **{field: 0 for field in _SUMMED}})
+            totals["count"] += 1
+            totals["errors"] += int(bool(event.get("error")))
+            totals["cache_hits"] += int(bool(event.get("cache_hit")))
+            for field in _SUMMED:
+                totals[field] += event.get(field) or 0
+            totals["max_wall_seconds"] = max(totals["max_wall_seconds"], event.get("wall_seconds") or 0.0)
+        for names in summary.values():
+            for totals in names.values():
+                totals["wall_seconds"] = round(totals["wall_seconds"], 3)
+                if totals["prompt_tokens"]: # share of the prompt tokens served from the provider's prefix cache
+                    totals["cached_ratio"] = round(totals["cached_tokens"] / totals["prompt_tokens"], 4)
+        return summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            events = list(self.events)
+        return {"run_id": self.run_id, "summary": self.summary(), "events": events}
+
+    def export_jsonl(self, path:str | Path) -> None:
+        """Append one line per event, tagged with the run id"""
+        with self._lock:
+            events = list(self.events)
+        with open(path, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps({"run_id": self.run_id, **event}, ensure_ascii=False, default=str) + "\n")
+
+    def export_prometheus(self, path:str | Path) -> None:
+        """Write the summary in the Prometheus text format, e.g. for the node_exporter textfile collector"""
+        metrics = {
+            "langda_calls_total": ("counter", "count"),
+            "langda_errors_total": ("counter", "errors"),
+            "langda_cache_hits_total": ("counter", "cache_hits"),
+            "langda_wall_seconds_total": ("counter", "wall_seconds"),
+            "langda_wall_seconds_max": ("gauge", "max_wall_seconds"),
+            "langda_prompt_tokens_total": ("counter", "prompt_tokens"),
+            "langda_completion_tokens_total": ("counter", "completion_tokens"),
+            "langda_cached_tokens_total": ("counter", "cached_tokens"),
+        }
+        summary = self.summary()
+        lines = []
+        for metric, (metric_type, field) in metrics.items():
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for kind, names in sorted(summary.items()):
+                for name, totals in sorted(names.items()):
+                    label = name.replace("\\", "\\\\").replace('"', '\\"')
+                    lines.append(f'{metric}{{kind="{kind}",name="{label}"}} {totals[field]}')
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path) # readers never see a half-written file
+
+    def export(self, path:str | Path) -> None:
+        """Prometheus text for *.prom files, JSONL otherwise"""
+        try:
+            if str(path).endswith(".prom"):
+                self.export_prometheus(path)
+            else:
+                self.export_jsonl(path)
+        except OSError as e:
+            logger.error(f"Could not export metrics to {path}: {e}")
+
+_current:ContextVar[Optional[MetricsCollector]] = ContextVar("langda_metrics", default=None)
+
+def current_metrics() -> Optional[MetricsCollector]:
+    """The collector of the current run, None outside of collect_metrics"""
+    return _current.get()
+
+@contextmanager
+def collect_metrics(run_id:str = "") -> Iterator[MetricsCollector]:
+    collector = MetricsCollector(run_id)
+    token = _current.set(collector)
+    try:
+        yield collector
+    finally:
+        _current.reset(token)
+
+def record(kind:str, name:str, **fields:Any) -> None:
+    """Record an event in the current collector, nothing outside of a run"""
+    collector = _current.get()
+    if collector is not None:
+        collector.record(kind, name, **fields)
+
+@contextmanager
+def timed(kind:str, name:str) -> Iterator[Dict[str, Any]]:
+    """
+    Record the wall time of the block as an event, with the fields set in the yielded dict.
+    An exception is recorded as the error of the event.
+    """
+    fields:Dict[str, Any] = {}
+    start = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        fields.setdefault("error", f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        record(kind, name, wall_seconds=round(time.perf_counter() - start, 4), **fields)
+
+def metered(kind:str, name:Optional[str] = None):
+    """Decorator form of timed, the name defaults to the function name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with timed(kind, name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def llm_usage(response) -> Dict[str, int]:
+    """prompt, completion and cached prompt tokens of an LLMResult, from the message usage or the provider's token_usage"""
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                usage["prompt_tokens"] += metadata.get("input_tokens", 0)
+                usage["completion_tokens"] += metadata.get("output_tokens", 0)
+                usage["cached_tokens"] += (metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+    if not usage["cached_tokens"]: # not every integration maps the cached tokens into usage_metadata
+        usage["cached_tokens"] = _cached_from_token_usage(response)
+    if usage["prompt_tokens"] or usage["completion_tokens"]:
+        return usage
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    usage["prompt_tokens"] = token_usage.get("prompt_tokens", 0) or 0
+    usage["completion_tokens"] = token_usage.get("completion_tokens", 0) or 0
+    usage["cached_tokens"] = _cached_from_token_usage(response)
+    return usage
+
+def _cached_from_token_usage(response) -> int:
+    """Cached prompt tokens of the raw provider usage: OpenAI prompt_tokens_details, DeepSeek prompt_cache_hit_tokens"""
+    usages = [(response.llm_output or {}).get("token_usage") or {}]
+    usages += [getattr(getattr(generation, "message", None), "response_metadata", {}).get("token_usage") or {}
+               for generations in response.generations for generation in generations]
+    for token_usage in usages:
+        cached = ((token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+                  or token_usage.get("prompt_cache_hit_tokens", 0))
+        if cached:
+            return cached
+    return 0
+
+class MetricsCallback(BaseCallbackHandler):
+    """Record every LLM call of a model in a collector"""
+
+    def __init__(self, collector:MetricsCollector, model_name:str, layout:str = "default"):
+        self.collector = collector
+        self.model_name = model_name
+        self.layout = layout # prompt layout, to compare the prefix cache hits of the layouts
+        self._starts:Dict[UUID, tuple] = {}
+
+    def on_chat_model_start(self, serialized:Dict[str, Any], messages, *, run_id:UUID, **kwargs:Any) -> None:
+        self._starts[run_id] = (time.perf_counter(), self.model_name)
+
+    def on_llm_end(self, response, *, run_id:UUID, **kwargs:Any) -> None:
+        start, name = self._starts.pop(run_id, (None, self.model_name))
+        wall = round(time.perf_counter() - start, 4) if start is not None else None
+        usage = llm_usage(response)
+        self.collector.record("llm", name, wall_seconds=wall, cache_hit=usage["cached_tokens"] > 0, layout=self.layout, **usage)
+
+    def on_llm_error(self, error:BaseException, *, run_id:UUID, **kwargs:Any) -> None:
+        start, name = self._starts.pop(run_id, (None, self.model_name))
+        wall = round(time.perf_counter() - start, 4) if start is not None else None
+        self.collector.record("llm", name, wall_seconds=wall, error=f"{type(error).__name__}: {error}")
+
+class ToolMetricsCallback(BaseCallbackHandler):
+    """
+    Record every tool call of an agent in a collector. Tools only see the callbacks of the run config,
+    not those of the chat model's constructor (MetricsCallback), so this one is passed to the agent's invoke.
+    """
+
+    def __init__(self, collector:MetricsCollector):
+        self.collector = collector
+        self._starts:Dict[UUID, tuple] = {}
+
+    def on_tool_start(self, serialized:Dict[str, Any], input_str:str, *, run_id:UUID, **kwargs:Any) -> None:
+        self._starts[run_id] = (time.perf_counter(), (serialized or {}).get("name", "tool"))
+
+    def on_tool_end(self, output:Any, *, run_id:UUID, **kwargs:Any) -> None:
+        start, name = self._starts.pop(run_id, (None, "tool"))
+        self.collector.record("tool", name, wall_seconds=round(time.perf_counter() - start, 4) if start is not None else None)
+
+    def on_tool_error(self, error:BaseException, *, run_id:UUID, **kwargs:Any) -> None:
+        start, name = self._starts.pop(run_id, (None, "tool"))
+        self.collector.record("tool", name, wall_seconds=round(time.perf_counter() - start, 4) if start is not None else None,
+                              error=f"{type(error).__name__}: {error}")
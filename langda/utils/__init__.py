@@ -1,30 +1,51 @@
 # utils/__init__.py
 import inspect
-from typing import Union, List, Literal
+from typing import Union, List, Literal, Optional
 from langchain.tools import BaseTool, Tool
-from .models import LangdaAgentExecutor
+from .models import LangdaAgentExecutor, local_format_stats
 from .parser_v2 import integrated_code_parser, LangdaDict
 from .format_tools import (
     _ordinal,
     _list_to_dict, 
     _expand_nested_list,
     _replace_placeholder, 
+    CompiledTemplate,
+    compile_template,
     _find_all_blocks, 
     _compute_short_md5, 
+    _compute_short_hash,
+    _legacy_langda_hash,
     _compute_random_md5, 
     _parse_simple_dictonary, 
     _langda_list_to_dict,
     _deep2normal,
 )
 from .agent_tools import TOOL_REGISTRY
-from .test_tools import with_timeout, _problog_test
+from .test_tools import with_timeout, _problog_result, _problog_anytime, _program_digest
+from .problog_result import ProblogResult
+from .eval_pool import ProblogEvaluatorPool, get_evaluator_pool
+from .limits import EvaluationLimits, EvaluationUsage
+from .circuit_cache import CircuitCache, get_circuit_cache, program_key
+from .backends import resolve_backend, get_backend_selector
+from .batch_eval import evaluate_batch
+from .static_check import ValidationReport, validate_program
+from .incremental import get_incremental_evaluator
+from ..metrics import timed
+from .history import compact_test_analysis, render_test_analysis
+from .cassette import CassetteChatModel
+from .retry import RetrySettings, CircuitOpenError
+from .rate_limit import RateLimitSettings, rate_limiter_stats
+from .hedging import hedge_stats
 __all__ = [
     'LangdaDict',
     'invoke_agent',
+    'local_format_stats',
     'get_tools',
     '_ordinal',
     '_list_to_dict',
     '_compute_short_md5',
+    '_compute_short_hash',
+    '_legacy_langda_hash',
     '_compute_random_md5',
     '_langda_list_to_dict',
     '_expand_nested_list',
@@ -32,7 +53,33 @@ __all__ = [
     'integrated_code_parser',
     '_find_all_blocks',
     '_replace_placeholder',
+    'CompiledTemplate',
+    'compile_template',
     'with_timeout',
+    '_program_digest',
+    'ProblogEvaluatorPool',
+    'get_evaluator_pool',
+    'EvaluationLimits',
+    'EvaluationUsage',
+    'CircuitCache',
+    'get_circuit_cache',
+    'program_key',
+    'resolve_backend',
+    'get_backend_selector',
+    'evaluate_batch',
+    'ValidationReport',
+    'validate_program',
+    'get_incremental_evaluator',
+    'RetrySettings',
+    'CircuitOpenError',
+    'RateLimitSettings',
+    'rate_limiter_stats',
+    'hedge_stats',
+    'compact_test_analysis',
+    'render_test_analysis',
+    'CassetteChatModel',
+    'ProblogResult',
+    'problog_result_tool',
     'problog_test_tool',
     '_deep2normal',
 ]
@@ -40,14 +87,59 @@ __all__ = [
 import logging
 logger = logging.getLogger(__name__)
 
-def problog_test_tool(model, file_basename,timeout=120):
-    try:
-        return with_timeout(_problog_test,file_basename,timeout, model)
-    except Exception as e:
-        logger.error(f"Error in problog_test_tool: {e}")
-        return f"ERROR: {str(e)}"
+def problog_result_tool(model, file_basename, timeout=120, backend=None, anytime=False, incremental=False) -> ProblogResult:
+    """
+    Evaluate the model in the shared evaluator process pool, safe to call from any thread.
+    Errors and timeouts are returned as failed results, see ProblogResult.
+    args:
+        backend: problog inference backend, see resolve_backend. "auto" picks one from program
+                 statistics and falls back to the next one on timeout, None for the problog default.
+        anytime: exact inference gets half of the timeout, if it does not finish the rest is used
+                 for probability bounds or sample estimates instead of a bare timeout error.
+        incremental: reuse the results of queries whose predicate dependencies did not change since an
+                     earlier evaluation, only the other queries are grounded and evaluated.
+    """
+    with timed("problog", backend or "default") as event:
+        try:
+            backend = resolve_backend(backend)
+            exact_timeout = timeout / 2 if anytime else timeout
+            affinity = program_key(model) # same worker for the same program, so its circuit cache is hit
+            plan = get_incremental_evaluator().plan(model, backend) if incremental else None
+            queries = [plan.queries[idx] for idx in plan.pending] if plan is not None else None
+            try:
+                if plan is not None:
+                    event["reused_queries"] = len(plan.cached)
+                if plan is not None and not plan.pending:
+                    event["cache_hit"] = True
+                    return get_incremental_evaluator().merge(plan)
+                if backend == "auto":
+                    result = get_backend_selector().run(get_evaluator_pool(), model, exact_timeout, queries)
+                else:
+                    result = get_evaluator_pool().run(_problog_result, model, backend, queries, timeout=exact_timeout, affinity=affinity)
+                return get_incremental_evaluator().merge(plan, result) if plan is not None else result
+            except TimeoutError:
+                if not anytime:
+                    raise
+                logger.warning(f"Exact inference timed out after {exact_timeout} seconds, switching to anytime evaluation")
+                remaining = timeout - exact_timeout
+                # keep a margin for grounding and worker respawn, the pool timeout stays the hard limit
+                return get_evaluator_pool().run(_problog_anytime, model, remaining * 0.8, timeout=remaining, affinity=affinity)
+        except TimeoutError:
+            logger.error(f"Function timed out while processing file: {file_basename}")
+            event["error"] = "timeout"
+            return ProblogResult.failure(f"ERROR: Execution timed out after {timeout} seconds")
+        except Exception as e:
+            logger.error(f"Error in problog_test_tool: {e}")
+            event["error"] = f"{type(e).__name__}: {e}"
+            return ProblogResult.failure(f"ERROR: {str(e)}")
+
+def problog_test_tool(model, file_basename, timeout=120, backend=None, anytime=False, incremental=False) -> str:
+    """
+    problog_result_tool rendered as text for prompts, at most 20 queries are listed.
+    """
+    return problog_result_tool(model, file_basename, timeout, backend, anytime, incremental).render()
 
-def invoke_agent(agent_type:Literal["simple","doublechain"], model_name:str, tools:List[str], prompt_type:Literal["evaluate", "generate", "regenerate"], input:dict, config:dict) -> tuple[str,str]:
+def invoke_agent(agent_type:Literal["simple","doublechain"], model_name:str, tools:List[str], prompt_type:Literal["evaluate", "generate", "regenerate"], input:dict, config:dict, local_format:bool=True, structured_output:bool=False, hedge:bool=False, analysis_budget:int=4000, prefix_cache_layout:bool=False, max_iterations:int=15, max_execution_time:Optional[float]=None, tool_quotas:Optional[dict]=None) -> tuple[str,str]:
     """
     Returns the corresponding LangdaAgentExecutor instance or its react version based on the parameters passed in when calling.
     Args:
@@ -55,19 +147,29 @@ def invoke_agent(agent_type:Literal["simple","doublechain"], model_name:str, too
         prompt_type: One of ["evaluate", "generate", "regenerate"]
         input: dictonary to fill all the placeholders in prompt
         config: configs of agent for example: {"configurable": {"thread_id": "2"}}
+        local_format: double-chain only, format the code locally and skip the second chain when possible
+        structured_output: ask for the code/report blocks through provider-native structured output
+        hedge: generate/regenerate only, duplicate slow calls to the secondary model of AgentSettings.hedge
+        analysis_budget: token budget of the compacted test_analysis returned by get_report_tool
+        prefix_cache_layout: static system prompt, syntax notes and instructions first, the per-run content last
+        max_iterations, max_execution_time: budget of the tool-calling loop, a final answer is forced when it runs out
+        tool_quotas: calls per tool name and invocation
     """
-    executor = LangdaAgentExecutor(model_name=model_name,tools=get_tools(tools, input["test_analysis"]))
+    executor = LangdaAgentExecutor(model_name=model_name,tools=get_tools(tools, input["test_analysis"], analysis_budget),local_format=local_format,structured_output=structured_output,prefix_cache_layout=prefix_cache_layout,max_iterations=max_iterations,max_execution_time=max_execution_time,tool_quotas=tool_quotas or {})
 
+    if hedge and prompt_type in ("generate", "regenerate"):
+        return executor.invoke_hedged(agent_type, prompt_type, input, config)
     if agent_type == "simple":
         return executor.invoke_simple_agent(prompt_type,input,config)
     elif agent_type == "doublechain":
         return executor.invoke_doublechain_agent(prompt_type,input,config)
 
-def get_tools(tool_list: List[str], test_analysis:List[str]) -> List[BaseTool]:
+def get_tools(tool_list: List[str], test_analysis:List[str|dict], analysis_budget:int=4000) -> List[BaseTool]:
     """
     Get tool instances based on the list of tool names.
     args:
         tool_list: List of tool names to load, currently we have "search_tool", "retriever_tool", "problog_test_tool"
+        test_analysis: syntax notes and the evaluate rounds, compacted to analysis_budget tokens for get_report_tool
     returns:
         List of instantiated tool objects
     """
@@ -75,7 +177,7 @@ def get_tools(tool_list: List[str], test_analysis:List[str]) -> List[BaseTool]:
     if test_analysis: # This is a independent tool, it's only job is to offer the syntax rules and REPORTS from previous rounds.
         get_report_tool = Tool(
             name="get_report_tool",
-            func=lambda _: "\n\n".join(test_analysis),
+            func=lambda _: render_test_analysis(test_analysis, analysis_budget),
             description="Get a historical analysis report to help you regenerate your code. This tool receives a single string 'learn from history' as input.",
         )
         tools.append(get_report_tool)
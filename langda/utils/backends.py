@@ -0,0 +1,175 @@
+import time
+import threading
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional
+
+from problog import get_evaluatable
+from problog.program import PrologString
+from problog.logic import Clause, AnnotatedDisjunction, Not, Term, Or, And
+
+from .circuit_cache import program_key
+from .eval_pool import ProblogEvaluatorPool, WorkerError, get_evaluator_pool
+from .test_tools import _problog_result
+from .problog_result import ProblogResult
+
+import logging
+logger = logging.getLogger(__name__)
+
+EXACT_BACKENDS = ("sdd", "sddx", "ddnnf", "bdd", "fsdd", "fbdd")
+APPROX_BACKENDS = ("kbest", "sample")
+BACKEND_ALIASES = {
+    "default": None,
+    "dsharp": "ddnnf",
+    "nnf": "ddnnf",
+    "forward": "fsdd",
+    "approximate": "sample",
+}
+
+def resolve_backend(name:Optional[str]) -> Optional[str]:
+    """
+    Map a user facing backend name to the name _problog_result understands, "auto" is kept as it is.
+    """
+    if name is None or name == "auto":
+        return name
+    name = name.lower()
+    name = BACKEND_ALIASES.get(name, name)
+    if name is not None and name not in EXACT_BACKENDS + APPROX_BACKENDS:
+        raise ValueError(f"Unknown problog backend '{name}', expected one of "
+                         f"{['auto', *EXACT_BACKENDS, *APPROX_BACKENDS, *BACKEND_ALIASES]}")
+    return name
+
+_PROBE_TIMEOUT = 30 # seconds, the probe program is trivial
+
+def _probe_backend(name:str) -> None:
+    """Compile and evaluate a trivial program with the backend, raises if its compiler is missing"""
+    get_evaluatable(name).create_from(PrologString("0.5::a. query(a).")).evaluate()
+
+@lru_cache(maxsize=None)
+def backend_available(name:str) -> bool:
+    """
+    Whether the compiler behind a backend is installed (e.g. PySDD for sdd), checked once per process.
+    The probe runs in the evaluator pool, under its timeout and resource limits.
+    """
+    if name == "sample":
+        return True
+    try:
+        get_evaluator_pool().run(_probe_backend, name, timeout=_PROBE_TIMEOUT)
+        return True
+    except (WorkerError, TimeoutError) as e:
+        logger.debug(f"problog backend '{name}' is not available: {e}")
+        return False
+
+class ProgramStats(NamedTuple):
+    """Cheap statistics of the program text, no grounding involved"""
+    clauses: int
+    probabilistic: int # probabilistic facts, rules and annotated disjunction heads
+    negations: int
+    recursive: int # predicates that call themselves directly
+
+def _walk_body(body) -> tuple[List[tuple], int]:
+    """Signatures of the predicates called in a clause body and the number of negations"""
+    stack, called, negations = [body], [], 0
+    while stack:
+        term = stack.pop()
+        if isinstance(term, (And, Or)):
+            stack.extend((term.op1, term.op2))
+        elif isinstance(term, Not):
+            negations += 1
+            stack.append(term.args[0])
+        elif isinstance(term, Term):
+            called.append(term.signature)
+    return called, negations
+
+def _disjuncts(term) -> List[Term]:
+    """The heads of an annotated disjunction written as `p1::a; p2::b`, or the term itself"""
+    return term.to_list() if isinstance(term, Or) else [term]
+
+def program_stats(model:str) -> Optional[ProgramStats]:
+    """Parse the program and count its clauses, None if it does not parse"""
+    clauses = probabilistic = negations = recursive = 0
+    try:
+        for clause in PrologString(model):
+            clauses += 1
+            if isinstance(clause, AnnotatedDisjunction):
+                heads, body = clause.heads, clause.body
+            elif isinstance(clause, Clause):
+                heads, body = _disjuncts(clause.head), clause.body
+            else:
+                heads, body = _disjuncts(clause), None
+            probabilistic += sum(head.probability is not None for head in heads)
+            if body is not None:
+                called, body_negations = _walk_body(body)
+                negations += body_negations
+                recursive += any(head.signature in called for head in heads)
+    except Exception as e:
+        logger.debug(f"program_stats: could not parse program: {e}")
+        return None
+    return ProgramStats(clauses, probabilistic, negations, recursive)
+
+def rank_backends(stats:Optional[ProgramStats]) -> List[str]:
+    """
+    Order the available backends for a program, exact compilers first and the sampler as last resort.
+    Small programs go to sdd (or dsharp), recursive ones prefer sdd which handles cycles without a
+    separate cycle-breaking step, many probabilistic choices favour forward compilation.
+    """
+    if stats is None or stats.probabilistic <= 30:
+        preferred = ["sdd", "ddnnf", "sddx", "bdd"]
+    elif stats.recursive:
+        preferred = ["sdd", "fsdd", "ddnnf"]
+    else:
+        preferred = ["fsdd", "sddx", "sdd", "ddnnf"]
+    ranked = [name for name in preferred if backend_available(name)][:2]
+    return ranked + ["sample"]
+
+class BackendSelector:
+    """
+    Auto mode of problog_test_tool: try the ranked backends, each exact backend gets half of the
+    remaining time budget and the next one takes over on timeout or error. The backend that returned
+    a result is recorded per program, so later evaluations of the same program start with it.
+    """
+
+    def __init__(self):
+        self.winners:Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def candidates(self, model:str) -> List[str]:
+        ranked = rank_backends(program_stats(model))
+        winner = self.winners.get(program_key(model))
+        if winner is not None:
+            ranked = [winner] + [name for name in ranked if name != winner]
+        return ranked
+
+    def record(self, model:str, backend:str) -> None:
+        with self._lock:
+            self.winners[program_key(model)] = backend
+
+    def run(self, pool:ProblogEvaluatorPool, model:str, timeout:float = 120, queries:Optional[List[Term]] = None) -> ProblogResult:
+        deadline = time.monotonic() + timeout
+        candidates = self.candidates(model)
+        affinity = program_key(model)
+        error_result = None
+        for idx, backend in enumerate(candidates):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            budget = remaining if idx == len(candidates) - 1 else remaining / 2
+            try:
+                result = pool.run(_problog_result, model, backend, queries, timeout=budget, affinity=affinity)
+            except TimeoutError:
+                logger.warning(f"problog backend '{backend}' timed out after {budget:.1f} seconds, falling back")
+                continue
+            if not result.ok: # _problog_result does not raise
+                logger.warning(f"problog backend '{backend}' failed, trying the next one")
+                error_result = result
+                continue
+            logger.info(f"problog backend '{backend}' finished the program")
+            self.record(model, backend)
+            return result
+        if error_result is not None:
+            return error_result
+        raise TimeoutError(f"Execution timed out after {timeout} seconds")
+
+_backend_selector = BackendSelector()
+
+def get_backend_selector() -> BackendSelector:
+    return _backend_selector
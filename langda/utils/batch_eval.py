@@ -0,0 +1,88 @@
+from typing import Dict, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+from problog.logic import Term
+
+from .circuit_cache import get_circuit_cache
+from .eval_pool import ProblogEvaluatorPool, get_evaluator_pool
+
+import logging
+logger = logging.getLogger(__name__)
+
+AtomLike = Union[str, Term]
+EvidenceRow = Mapping[AtomLike, bool]
+
+def _to_term(atom:AtomLike) -> Term:
+    return atom if isinstance(atom, Term) else Term.from_string(atom.strip().rstrip("."))
+
+def _evaluate_rows(model:str, backend:Optional[str], queries:Optional[List[str]],
+                   evidence_atoms:List[str], rows:List[Dict[str, bool]]) -> tuple[List[str], np.ndarray]:
+    """
+    Compile the program once (through the circuit cache of this process) and evaluate every evidence row.
+    Atoms are passed as strings so that shards can be sent to worker processes.
+    returns:
+        the query names in column order and an array of shape (len(rows), queries), NaN where a row failed
+    """
+    query_terms = [Term.from_string(query) for query in queries] if queries is not None else None
+    atom_terms = {atom: Term.from_string(atom) for atom in evidence_atoms}
+    compiled, _ = get_circuit_cache().compile(model, backend, queries=query_terms, evidence=list(atom_terms.values()))
+    columns = [str(query) for query in query_terms] if query_terms is not None else [str(name) for name, _ in compiled.ground.queries()]
+    probabilities = np.full((len(rows), len(columns)), np.nan)
+    # passing evidence replaces the evidence/1 of the program, so it is merged in explicitly (0 marks the open atoms)
+    program_evidence = {name: value > 0 for name, _, value in compiled.circuit.evidence_all() if value != 0}
+    for idx, row in enumerate(rows):
+        try:
+            results = compiled.circuit.evaluate(evidence={**program_evidence, **{atom_terms[atom]: value for atom, value in row.items()}})
+        except Exception as e:
+            logger.warning(f"evaluate_batch: row {idx} failed: {type(e).__name__}: {e}")
+            continue
+        by_name = {str(key): value for key, value in results.items()}
+        probabilities[idx] = [by_name.get(column, np.nan) for column in columns]
+    return columns, probabilities
+
+def evaluate_batch(
+        model:str,
+        evidence_batch:Optional[Sequence[EvidenceRow]] = None,
+        queries:Optional[Sequence[AtomLike]] = None,
+        backend:Optional[str] = None,
+        shards:int = 1,
+        pool:Optional[ProblogEvaluatorPool] = None,
+        timeout:float = 120,
+        return_queries:bool = False,
+    ) -> Union[np.ndarray, tuple[List[str], np.ndarray]]:
+    """
+    Compile a program once and evaluate it for a batch of evidence assignments.
+    Atoms that appear in any row are grounded as open evidence, so one circuit serves the whole batch;
+    an atom missing from a row is not observed in that row. The program's own evidence/1 holds in every row,
+    a row that sets the same atom overrides it.
+    args:
+        model: the problog program
+        evidence_batch: one {atom: bool} mapping per row, atoms as Term or string like "burglary" or "p(1)".
+                        None evaluates the program once with its own evidence.
+        queries: the queries (columns) to evaluate instead of the query/1 facts of the program
+        backend: problog evaluatable name, None for the default
+        shards: > 1 splits the batch over that many evaluator worker processes, each compiles once
+        pool: evaluator pool for sharding, default as the shared pool
+        timeout: seconds per shard in the worker processes
+        return_queries: also return the query names of the columns
+    returns:
+        float array of shape (batch, queries), NaN for rows whose evaluation failed
+    """
+    rows = [{str(_to_term(atom)): bool(value) for atom, value in row.items()} for row in (evidence_batch or [{}])]
+    evidence_atoms = sorted({atom for row in rows for atom in row})
+    query_names = [str(_to_term(query)) for query in queries] if queries is not None else None
+
+    if shards <= 1 or len(rows) <= 1:
+        columns, probabilities = _evaluate_rows(model, backend, query_names, evidence_atoms, rows)
+    else:
+        pool = pool or get_evaluator_pool()
+        size = -(-len(rows) // shards) # ceil
+        futures = [pool.submit(_evaluate_rows, model, backend, query_names, evidence_atoms, rows[start:start + size], timeout=timeout)
+                   for start in range(0, len(rows), size)]
+        parts = [future.result() for future in futures]
+        columns = parts[0][0]
+        probabilities = np.concatenate([part for _, part in parts], axis=0)
+
+    if return_queries:
+        return columns, probabilities
+    return probabilities
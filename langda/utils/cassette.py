@@ -0,0 +1,135 @@
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional, Sequence
+
+from pydantic import BaseModel, PrivateAttr
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, AIMessage, ToolMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatResult, ChatGeneration
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+import logging
+logger = logging.getLogger(__name__)
+
+class CassetteConfig(BaseModel):
+    path: str = "langda_cassette.jsonl" # cassette file, "cassette:<path>" as model_name overrides it
+    mode: Literal["replay", "record", "auto"] = "replay" # auto: replay what is recorded, record the rest
+    model: str = "deepseek-chat" # real model that answers while recording
+    latency: float = 0.0 # synthetic seconds per replayed call
+    recorded_latency: bool = False # sleep as long as the recorded call took instead
+
+class CassetteMiss(LookupError):
+    """A prompt that is not on the cassette, replaying cannot continue"""
+    retryable = False
+
+def _message_key(message:BaseMessage) -> Dict[str, Any]:
+    """What identifies a message of a request. Tool results are left out, so tools that need the network
+    (search) may fail while replaying without changing the keys of the following requests."""
+    key:Dict[str, Any] = {"type": message.type}
+    if isinstance(message, ToolMessage):
+        key["tool"] = message.name
+        return key
+    key["content"] = message.content
+    if isinstance(message, AIMessage) and message.tool_calls:
+        key["tool_calls"] = [{"name": call["name"], "args": call["args"]} for call in message.tool_calls]
+    return key
+
+def prompt_key(messages:Sequence[BaseMessage], tools:Optional[List[dict]] = None) -> str:
+    """Hash of a request: the messages and the names of the bound tools"""
+    payload = {"messages": [_message_key(message) for message in messages],
+               "tools": sorted(tool.get("function", {}).get("name", "") for tool in tools or [])}
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"), digest_size=16).hexdigest()
+
+class Cassette:
+    """
+    Request/response pairs in a JSONL file, one line per call. A request recorded several times (e.g. retries)
+    is answered with its recordings in order, the last one repeats.
+    """
+
+    def __init__(self, path:str | Path):
+        self.path = Path(path)
+        self._entries:Dict[str, List[dict]] = {}
+        self._played:Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["key"], []).append(entry)
+        logger.info(f"Cassette {self.path}: {sum(map(len, self._entries.values()))} recorded calls")
+
+    def play(self, key:str) -> Optional[dict]:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            idx = self._played.get(key, 0)
+            self._played[key] = idx + 1
+            return entries[min(idx, len(entries) - 1)]
+
+    def record(self, key:str, message:AIMessage, seconds:float) -> None:
+        entry = {"key": key, "message": message_to_dict(message), "seconds": round(seconds, 3)}
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            self._played[key] = len(self._entries[key])
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+_cassettes:Dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+def get_cassette(path:str | Path) -> Cassette:
+    """One shared Cassette per file, so the replay order holds across the calls of a process"""
+    with _cassettes_lock:
+        key = str(Path(path).resolve())
+        if key not in _cassettes:
+            _cassettes[key] = Cassette(path)
+        return _cassettes[key]
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Chat model stand-in that records the answers of a real model to a cassette and replays them offline,
+    keyed by the hash of the request. Tool calls are recorded and replayed like any answer, so tool-calling
+    agents (AgentExecutor) and structured output work while replaying.
+    """
+    cassette_path: str
+    mode: Literal["replay", "record", "auto"] = "replay"
+    latency: float = 0.0
+    recorded_latency: bool = False
+    inner: Optional[BaseChatModel] = None # the real model, needed to record
+    _cassette: Cassette = PrivateAttr()
+
+    def model_post_init(self, __context:Any) -> None:
+        self._cassette = get_cassette(self.cassette_path)
+
+    @property
+    def _llm_type(self) -> str:
+        return "langda-cassette"
+
+    def bind_tools(self, tools:Sequence[Any], **kwargs:Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _generate(self, messages:List[BaseMessage], stop:Optional[List[str]] = None, run_manager=None, **kwargs:Any) -> ChatResult:
+        key = prompt_key(messages, kwargs.get("tools"))
+        entry = self._cassette.play(key) if self.mode != "record" else None
+        if entry is not None:
+            delay = entry.get("seconds", 0.0) if self.recorded_latency else self.latency
+            if delay:
+                time.sleep(delay)
+            message = messages_from_dict([entry["message"]])[0]
+            return ChatResult(generations=[ChatGeneration(message=message)])
+        if self.mode == "replay" or self.inner is None:
+            raise CassetteMiss(f"Request {key} is not on the cassette {self.cassette_path}, record it first (CASSETTE_MODE=record/auto)")
+        recorder = self.inner
+        tools, tool_choice = kwargs.pop("tools", None), kwargs.pop("tool_choice", None)
+        if tools: # bound through the real model, which knows its provider's tool format
+            recorder = self.inner.bind_tools(tools, **({"tool_choice": tool_choice} if tool_choice else {}))
+        start = time.perf_counter()
+        message = recorder.invoke(messages, stop=stop, **kwargs)
+        self._cassette.record(key, message, time.perf_counter() - start)
+        return ChatResult(generations=[ChatGeneration(message=message)])
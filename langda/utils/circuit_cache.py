@@ -0,0 +1,182 @@
+import re
+import pickle
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from problog import get_evaluatable
+from problog.program import PrologString
+from problog.engine import DefaultEngine
+from problog.formula import LogicFormula
+from problog.logic import Term
+
+from .limits import record_sizes
+
+import logging
+logger = logging.getLogger(__name__)
+
+class CircuitCacheConfig(BaseSettings):
+    """
+    Circuit cache configurations, supports environment variable overrides (also seen by evaluator workers).
+    """
+    max_entries: int = Field(default=32, description="Number of compiled programs kept in memory per process")
+    disk_dir: Optional[Path] = Field(default=None, description="Optional directory for the on-disk pickle store")
+    model_config = SettingsConfigDict(
+        env_prefix="LANGDA_CIRCUIT_CACHE_",
+        env_file=".env",
+        extra="ignore",
+    )
+
+class CompiledProgram(NamedTuple):
+    """A ground program and the circuit compiled from it"""
+    key: str
+    ground: LogicFormula
+    circuit: Any # problog Evaluatable, e.g. DDNNF or SDD
+
+# quoted atoms and strings and character codes like 0'% (kept verbatim), runs of whitespace and comments
+_PROGRAM_TOKEN = re.compile(
+    r"(?P<quoted>'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|0'(?:\\.|''|.))"
+    r"|(?P<gap>(?:\s+|%[^\n]*|/\*.*?\*/)+)",
+    re.DOTALL,
+)
+
+def _canonical_program(model:str) -> str:
+    """
+    Program text with comments removed and each run of whitespace and comments collapsed (to a line break
+    if it contains one, otherwise to a space), so formatting-only changes share a key.
+    Quoted atoms, strings and character codes are kept verbatim, a `%` or `/*` in them is not a comment.
+    """
+    parts:List[str] = []
+    pos = 0
+    for match in _PROGRAM_TOKEN.finditer(model):
+        parts.append(model[pos:match.start()])
+        pos = match.end()
+        if match.lastgroup == "quoted":
+            parts.append(match.group())
+        else:
+            parts.append("\n" if "\n" in match.group() else " ")
+    parts.append(model[pos:])
+    return "".join(parts).strip()
+
+def program_key(model:str, backend:Optional[str] = None, queries:Optional[Iterable[Term]] = None, evidence:Optional[Iterable[Term]] = None) -> str:
+    """
+    Canonical hash of the program text, the backend and the grounded query/evidence atoms.
+    """
+    parts = [
+        _canonical_program(model),
+        backend or "default",
+        "|".join(sorted(map(str, queries))) if queries is not None else "*",
+        "|".join(sorted(map(str, evidence))) if evidence is not None else "*",
+    ]
+    return hashlib.blake2b("\x00".join(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+def ground_program(model:str, queries:Optional[List[Term]] = None, evidence:Optional[List[Term]] = None) -> LogicFormula:
+    """
+    Ground the program for its own queries (or the given ones). Evidence atoms given here are grounded
+    in addition to the evidence of the program, with an open value that is set when evaluating.
+    """
+    engine = DefaultEngine()
+    db = engine.prepare(PrologString(model))
+    ground_evidence = None
+    if evidence is not None:
+        ground_evidence = engine.query(db, Term("evidence", None, None)) + engine.query(db, Term("evidence", None))
+        declared = {ev[0] for ev in ground_evidence}
+        ground_evidence += [(atom, Term("none")) for atom in evidence if atom not in declared]
+    return engine.ground_all(db, queries=queries, evidence=ground_evidence)
+
+class CircuitCache:
+    """
+    LRU cache of ground programs and compiled circuits keyed by program_key, with an optional
+    on-disk pickle store. Circuits that cannot be pickled (e.g. SDD) are only kept in memory.
+    Evidence values are applied at evaluation time, so a cached circuit is reused for any evidence.
+    """
+
+    def __init__(self, max_entries:int = 32, disk_dir:Optional[Path] = None):
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries:"OrderedDict[str, CompiledProgram]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats:Dict[str, int] = {"hits": 0, "disk_hits": 0, "misses": 0}
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def _disk_path(self, key:str) -> Optional[Path]:
+        return self.disk_dir / f"{key}.pkl" if self.disk_dir else None
+
+    def get(self, key:str) -> Optional[CompiledProgram]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry
+        path = self._disk_path(key)
+        if path is not None and path.exists():
+            try:
+                with open(path, "rb") as f:
+                    entry = pickle.load(f)
+                self.put(entry, to_disk=False)
+                self.stats["disk_hits"] += 1
+                return entry
+            except Exception as e:
+                logger.warning(f"CircuitCache: could not load {path}: {e}")
+        return None
+
+    def put(self, entry:CompiledProgram, to_disk:bool = True) -> None:
+        with self._lock:
+            self._entries[entry.key] = entry
+            self._entries.move_to_end(entry.key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        path = self._disk_path(entry.key)
+        if to_disk and path is not None:
+            try:
+                with open(path, "wb") as f:
+                    pickle.dump(entry, f)
+            except Exception as e:
+                path.unlink(missing_ok=True)
+                logger.debug(f"CircuitCache: circuit for {entry.key} is not picklable, memory only: {e}")
+
+    def compile(self, model:str, backend:Optional[str] = None, queries:Optional[List[Term]] = None, evidence:Optional[List[Term]] = None) -> Tuple[CompiledProgram, bool]:
+        """
+        Return the compiled program (from cache if possible) and whether it was a cache hit.
+        args:
+            backend: problog evaluatable name, e.g. "sdd", "ddnnf", None for the default
+            queries: queries to ground instead of the query/1 facts of the program
+            evidence: extra evidence atoms whose values are given when evaluating
+        """
+        key = program_key(model, backend, queries, evidence)
+        entry = self.get(key)
+        if entry is not None:
+            record_sizes(entry.ground, entry.circuit)
+            return entry, True
+        self.stats["misses"] += 1
+        ground = ground_program(model, queries, evidence)
+        record_sizes(ground)
+        circuit = get_evaluatable(backend).create_from(ground)
+        record_sizes(circuit=circuit)
+        entry = CompiledProgram(key, ground, circuit)
+        self.put(entry)
+        return entry, False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+_circuit_cache:Optional[CircuitCache] = None
+_circuit_cache_lock = threading.Lock()
+
+def get_circuit_cache() -> CircuitCache:
+    """
+    The per-process circuit cache, configured from CircuitCacheConfig on first use.
+    """
+    global _circuit_cache
+    with _circuit_cache_lock:
+        if _circuit_cache is None:
+            config = CircuitCacheConfig()
+            _circuit_cache = CircuitCache(config.max_entries, config.disk_dir)
+        return _circuit_cache
@@ -0,0 +1,292 @@
+import os
+import hashlib
+import time
+import queue
+import atexit
+import threading
+import traceback
+import multiprocessing as mp
+import multiprocessing.spawn
+import logging.handlers
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Optional
+
+from .limits import EvaluationLimits, EvaluationUsage, enforce_limits
+
+import logging
+logger = logging.getLogger(__name__)
+
+# ======================================================================== #
+#                           Worker process side                            #
+# ======================================================================== #
+
+class _PipeLogHandler(logging.handlers.QueueHandler):
+    """QueueHandler that sends the prepared (formatted, picklable) records through a pipe"""
+    def enqueue(self, record:logging.LogRecord) -> None:
+        self.queue.send(record)
+
+def _worker_main(conn, log_conn, log_level:int) -> None:
+    """
+    Main loop of an evaluator process: receive (func, args, kwargs, limits), send back (ok, payload, usage).
+    Every job runs under its resource limits, see enforce_limits. problog is imported once when the worker
+    starts, not per job.
+    Log records go to the parent through log_conn, so they end up in the handlers of setup_logging.
+    """
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(_PipeLogHandler(log_conn))
+    root.setLevel(log_level)
+
+    import problog  # noqa: F401  pre-import, the first evaluation should not pay for it
+    from problog import get_evaluatable  # noqa: F401
+    conn.send("ready")
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None: # shutdown
+            break
+        func, args, kwargs, limits = job
+        with enforce_limits(limits) as report:
+            try:
+                ok, payload = True, func(*args, **kwargs)
+            except BaseException as e:
+                # exceptions are not always picklable, send the formatted error instead
+                ok, payload = False, f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+        conn.send((ok, payload, report["usage"]))
+
+class WorkerError(RuntimeError):
+    """A job raised inside the worker process, or the worker process died"""
+
+_WORKER_NAME = "langda-eval-worker"
+_prepare_lock = threading.Lock()
+
+def _install_worker_preparation() -> None:
+    """
+    Leave the caller's __main__ module out of the preparation data of the evaluator workers (spawn and
+    forkserver children re-import it before they run). Workers only run langda functions, so a script without
+    an `if __name__ == "__main__":` guard must not be executed again (with its LLM calls) in every worker.
+    Installed once for the process; other processes, told apart by their name, are prepared as before.
+    """
+    with _prepare_lock:
+        get_preparation_data = multiprocessing.spawn.get_preparation_data
+        if getattr(get_preparation_data, "_langda", False):
+            return
+        def worker_preparation_data(name):
+            data = get_preparation_data(name)
+            if name.startswith(_WORKER_NAME):
+                data.pop("init_main_from_path", None)
+                data.pop("init_main_from_name", None)
+            return data
+        worker_preparation_data._langda = True
+        multiprocessing.spawn.get_preparation_data = worker_preparation_data
+
+def _forward_logs(log_conn) -> None:
+    """Hand the log records of one worker to the loggers of the parent process, until the worker exits"""
+    with log_conn:
+        while True:
+            try:
+                record = log_conn.recv()
+            except (EOFError, OSError):
+                return
+            except Exception as e: # a record that was cut off when the worker got killed
+                logger.debug(f"Dropped a log record of an evaluator worker: {e}")
+                return
+            logging.getLogger(record.name).handle(record)
+
+# ======================================================================== #
+#                             Parent side                                  #
+# ======================================================================== #
+
+class _WorkerSlot:
+    """One worker process, its job queue and the thread in the parent that feeds it jobs"""
+
+    def __init__(self, pool:"ProblogEvaluatorPool", index:int):
+        self.pool = pool
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.respawns = 0
+        self.busy = False
+        self.jobs:"queue.Queue[Optional[tuple]]" = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name=f"langda-eval-{index}", daemon=True)
+
+    def _spawn(self) -> None:
+        """Start the worker and wait until its imports are done, so job timeouts do not include start-up"""
+        parent_conn, child_conn = self.pool._ctx.Pipe()
+        log_reader, log_writer = self.pool._ctx.Pipe(duplex=False)
+        log_level = logging.getLogger().getEffectiveLevel()
+        self.process = self.pool._ctx.Process(
+            target=_worker_main, args=(child_conn, log_writer, log_level), name=f"{_WORKER_NAME}-{self.index}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        log_writer.close()
+        threading.Thread(target=_forward_logs, args=(log_reader,), name=f"langda-eval-logs-{self.index}", daemon=True).start()
+        self.conn = parent_conn
+        deadline = time.monotonic() + self.pool.startup_timeout
+        while not self.conn.poll(0.1):
+            if not self.process.is_alive(): # fail fast, e.g. an import error in the worker
+                raise EOFError(f"worker exited during start-up (exitcode={self.process.exitcode})")
+            if time.monotonic() > deadline:
+                raise EOFError(f"worker did not start within {self.pool.startup_timeout} seconds")
+        if self.conn.recv() != "ready":
+            raise EOFError("worker did not report ready")
+
+    def _kill(self) -> None:
+        """Hard-kill the worker, this also interrupts C-level knowledge compilation"""
+        if self.process is not None and self.process.is_alive():
+            self.process.kill()
+        if self.process is not None:
+            self.process.join(timeout=5)
+        if self.conn is not None:
+            self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def _run(self) -> None:
+        while True:
+            self.busy = False
+            job = self.jobs.get()
+            self.busy = True
+            if job is None: # shutdown
+                if self.process is not None and self.process.is_alive():
+                    try:
+                        self.conn.send(None)
+                    except (OSError, BrokenPipeError):
+                        pass
+                self._kill()
+                return
+            future, func, args, kwargs, timeout = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if self.process is None or not self.process.is_alive():
+                    self._spawn()
+                self.conn.send((func, args, kwargs, self.pool.limits))
+                if not self.conn.poll(timeout):
+                    logger.error(f"Evaluator worker {self.index} timed out after {timeout} seconds, respawning")
+                    self._kill()
+                    self.respawns += 1
+                    future.set_exception(TimeoutError(f"Execution timed out after {timeout} seconds"))
+                    continue
+                ok, payload, usage = self.conn.recv()
+            except (EOFError, OSError, BrokenPipeError) as e:
+                exitcode = self.process.exitcode if self.process is not None else None
+                logger.error(f"Evaluator worker {self.index} died (exitcode={exitcode}): {e}")
+                self._kill()
+                self.respawns += 1
+                future.set_exception(WorkerError(f"Evaluator worker died (exitcode={exitcode})"))
+                continue
+            except BaseException as e:
+                # e.g. a job that cannot be pickled, the state of the pipe is unknown so start over
+                logger.error(f"Evaluator worker {self.index} failed to run a job: {type(e).__name__}: {e}")
+                self._kill()
+                future.set_exception(e)
+                continue
+            future.usage = usage
+            self.pool.usage_history.append(usage)
+            logger.info(f"Evaluator worker {self.index}: {getattr(func, '__name__', func)} used {usage}")
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(WorkerError(payload))
+
+class ProblogEvaluatorPool:
+    """
+    A pool of worker processes for ProbLog evaluations.
+    Unlike the SIGALRM based with_timeout, it works from any thread, enforces timeouts by
+    killing and respawning the worker (which also stops C-level knowledge compilation)
+    and runs concurrent submissions in parallel.
+    Every worker has its own queue. Jobs with the same `affinity` key always run on the same worker,
+    so per-process caches (the circuit cache) are hit again; other jobs go to the least loaded worker.
+    A worker that is killed for a timeout loses its caches.
+    Each job runs under the resource limits of the pool, its EvaluationUsage is kept in usage_history
+    and set as `usage` on the future.
+    args:
+        max_workers: number of worker processes, default as min(4, cpu_count)
+        start_method: multiprocessing start method, default as "forkserver" where available, otherwise "spawn"
+        startup_timeout: seconds a new worker may take for its imports, not counted in job timeouts
+        limits: memory, CPU time and recursion limits per job, default from EvaluationLimits (environment)
+    """
+
+    def __init__(self, max_workers:Optional[int] = None, start_method:Optional[str] = None, startup_timeout:float = 120,
+                 limits:Optional[EvaluationLimits] = None):
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        self._ctx = mp.get_context(start_method)
+        _install_worker_preparation()
+        if start_method == "forkserver":
+            # workers fork from a server that already imported problog and the evaluation functions,
+            # "__main__" is left out of the preload so the caller's script is not executed again
+            self._ctx.set_forkserver_preload(["problog", "langda.utils.test_tools"])
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.startup_timeout = startup_timeout
+        self.limits = limits if limits is not None else EvaluationLimits()
+        self.usage_history:Deque[EvaluationUsage] = deque(maxlen=1000)
+        self._closed = False
+        self._slots = [_WorkerSlot(self, idx) for idx in range(self.max_workers)]
+        for slot in self._slots:
+            slot.thread.start()
+
+    def _pick_slot(self, affinity:Optional[str]) -> _WorkerSlot:
+        if affinity is not None:
+            digest = hashlib.blake2b(affinity.encode("utf-8"), digest_size=8).digest()
+            return self._slots[int.from_bytes(digest, "big") % len(self._slots)]
+        return min(self._slots, key=lambda slot: slot.jobs.qsize() + slot.busy)
+
+    def submit(self, func:Callable, *args, timeout:float = 120, affinity:Optional[str] = None, **kwargs) -> Future:
+        """
+        Schedule func(*args, **kwargs) in a worker process, func must be picklable (module-level).
+        The future raises TimeoutError after `timeout` seconds of execution and WorkerError on failures.
+        args:
+            affinity: jobs with the same key run on the same worker, e.g. the program_key of a model
+        """
+        if self._closed:
+            raise RuntimeError("ProblogEvaluatorPool is shut down")
+        future:Future = Future()
+        self._pick_slot(affinity).jobs.put((future, func, args, kwargs, timeout))
+        return future
+
+    def run(self, func:Callable, *args, timeout:float = 120, affinity:Optional[str] = None, **kwargs) -> Any:
+        """Submit and wait for the result"""
+        return self.submit(func, *args, timeout=timeout, affinity=affinity, **kwargs).result()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(slot.jobs.qsize() for slot in self._slots)
+
+    @property
+    def respawns(self) -> int:
+        return sum(slot.respawns for slot in self._slots)
+
+    def shutdown(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        for slot in self._slots:
+            slot.jobs.put(None)
+        for slot in self._slots:
+            slot.thread.join(timeout=10)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+_shared_pool:Optional[ProblogEvaluatorPool] = None
+_shared_pool_lock = threading.Lock()
+
+def get_evaluator_pool(max_workers:Optional[int] = None) -> ProblogEvaluatorPool:
+    """
+    The process-wide evaluator pool, created on first use. max_workers only applies to its creation.
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ProblogEvaluatorPool(max_workers)
+            atexit.register(_shared_pool.shutdown)
+        return _shared_pool
@@ -2,7 +2,9 @@ import re
 import json
 import uuid
 import hashlib
-from typing import Literal, List, Union, Tuple, Dict, Any
+import functools
+import threading
+from typing import Literal, List, Union, Tuple, Dict, Any, Optional
 
 import logging
 logger = logging.getLogger(__name__)
@@ -64,6 +66,47 @@ def _compute_short_md5(len:int, content:Union[str,dict], upper:bool = False) ->
     return hash_str.upper() if upper else hash_str
 
 
+def _canonical_content(content:Union[str,dict]) -> str:
+    """
+    Canonical serialization used for hashing: sorted keys, compact separators and
+    normalized whitespace in the LLM requirement, so reformatting does not change the HASH.
+    """
+    if isinstance(content, dict):
+        normalized = {
+            key: " ".join(value.split()) if key == "LLM" and isinstance(value, str) else value
+            for key, value in content.items()
+        }
+        return json.dumps(normalized, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    elif isinstance(content, str):
+        return content
+    logger.error("_canonical_content: the input should be string or dictonary")
+    raise TypeError("_canonical_content: the input should be string or dictonary")
+
+@functools.lru_cache(maxsize=4096)
+def _blake2b_hexdigest(canonical:str, digest_size:int) -> str:
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=digest_size).hexdigest()
+
+def _compute_short_hash(len:int, content:Union[str,dict], upper:bool = False, digest_size:Optional[int] = None) -> str:
+    """
+    Computes a short blake2b hash of the canonical serialization of content with specified length.
+    Results are memoized in-process. Converts to uppercase if upper=True.
+    args:
+        digest_size: blake2b digest size in bytes, default as the smallest size that gives `len` hex characters
+    """
+    if digest_size is None:
+        digest_size = max(1, (len + 1) // 2)
+    if not 1 <= digest_size <= 64:
+        raise ValueError(f"_compute_short_hash: digest_size should be within [1, 64], got {digest_size}")
+    hash_str = _blake2b_hexdigest(_canonical_content(content), digest_size)[:len]
+    return hash_str.upper() if upper else hash_str
+
+def _legacy_langda_hash(langda:dict) -> str:
+    """
+    The 8-character MD5 HASH that earlier versions stored in DictDB for this langda term, for migrating old keys.
+    """
+    legacy_content = {key: langda.get(key) or None for key in ("HEAD", "LOT", "NET", "LLM")}
+    return _compute_short_md5(8, legacy_content, upper=True)
+
 def _compute_random_md5(len:int, upper:bool = False) -> str:
     """
     Generates a random MD5-style hash string by taking a UUID and slicing the hex.
@@ -86,31 +129,205 @@ def _ordinal(n:int) -> str:
         suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
     return str(n) + suffix
 
+_PROBLOG_TOKEN = re.compile(r":-|\w+|[^\w\s]")
+
 def _tokenize_problog(s:str) -> List[tuple]:
     # Tokenize Prolog code into units
-    pattern = r":-|\w+|[^\w\s]"
-    return [(m.group(), m.start(), m.end()) for m in re.finditer(pattern, s)]
+    return [(m.group(), m.start(), m.end()) for m in _PROBLOG_TOKEN.finditer(s)]
+
+def _tail_text(s:Union[str,List[str]], width:int) -> Tuple[str, bool]:
+    """
+    Return at least the last `width` characters of s (a string or a list of pieces that are
+    joined together) and whether this tail reaches the beginning of s.
+    """
+    if isinstance(s, str):
+        start = max(0, len(s) - width)
+        return s[start:], start == 0
+    parts = []
+    size = 0
+    idx = len(s)
+    while idx > 0 and size < width:
+        idx -= 1
+        parts.append(s[idx])
+        size += len(s[idx])
+    return "".join(reversed(parts)), idx == 0
+
+def _suffix_token_texts(s:Union[str,List[str]], count:int) -> List[str]:
+    """
+    Return the texts of the last `count` tokens of s, tokenizing only a bounded tail window.
+    The window grows geometrically until it holds enough tokens. The first token of a
+    window may be cut in half by the window start, so it is discarded unless the window
+    reaches the beginning of s; every following token is identical to full tokenization.
+    """
+    if count <= 0:
+        return []
+    width = max(64, count * 8)
+    while True:
+        tail, complete = _tail_text(s, width)
+        texts = [m.group() for m in _PROBLOG_TOKEN.finditer(tail)]
+        if complete or len(texts) > count:
+            return texts[-count:]
+        width *= 2
+
+def _kmp_failure(texts:List[str]) -> List[int]:
+    """KMP failure function: length of the longest proper prefix of texts[:i+1] that is also its suffix"""
+    fail = [0] * len(texts)
+    k = 0
+    for i in range(1, len(texts)):
+        while k and texts[i] != texts[k]:
+            k = fail[k - 1]
+        if texts[i] == texts[k]:
+            k += 1
+        fail[i] = k
+    return fail
+
+def _longest_overlap(texts1:List[str], texts2:List[str]) -> int:
+    """
+    Length k of the longest suffix of texts1 that equals the prefix of texts2 (KMP, linear time).
+    """
+    if not texts1 or not texts2:
+        return 0
+    fail = _kmp_failure(texts2)
+    # run texts1 through the automaton, the final state is the overlap
+    k = 0
+    for text in texts1:
+        if k == len(texts2):
+            k = fail[k - 1]
+        while k and text != texts2[k]:
+            k = fail[k - 1]
+        if text == texts2[k]:
+            k += 1
+    return k
+
+def _find_token_runs(texts:List[str], pattern:List[str], start:int = 0) -> List[int]:
+    """
+    Indices of all occurrences of pattern in texts[start:] (KMP, linear time).
+    """
+    if not pattern:
+        return []
+    fail = _kmp_failure(pattern)
+    found = []
+    k = 0
+    for i in range(start, len(texts)):
+        while k and texts[i] != pattern[k]:
+            k = fail[k - 1]
+        if texts[i] == pattern[k]:
+            k += 1
+        if k == len(pattern):
+            found.append(i - k + 1)
+            k = fail[k - 1]
+    return found
+
+def _overlap_cut(s1:Union[str,List[str]], tokens2:List[tuple]) -> int:
+    """
+    Index in s2 (tokenized as tokens2) where the part that does not overlap with the end of s1 starts.
+    """
+    if not tokens2:
+        return 0
+    texts2 = [t for t, _, _ in tokens2]
+    k = _longest_overlap(_suffix_token_texts(s1, len(texts2)), texts2)
+    return tokens2[k-1][2] if k else 0
 
 def _merge_problog_preserve(s1:str, s2:str) -> str:
+    """
+    Concatenate s1 and s2, dropping the longest token overlap between the end of s1 and the start of s2.
+    Only the last len(tokens(s2)) tokens of s1 can take part in the overlap, so s1 is never fully re-tokenized.
+    """
+    # longest overlap
+    j_start = _overlap_cut(s1, _tokenize_problog(s2))
+    if j_start: # we found the overlap!!!
+        return s1 + s2[j_start:]
+    return s1 + s2
 
-    # s1_lines = s1.rstrip('\n').split('\n')
-    # s2_lines = s2.lstrip('\n').split('\n')
-    # s1_clean = '\n'.join(s1_lines)
-    # s2_clean = '\n'.join(s2_lines)
+class CompiledTemplate:
+    """
+    A template whose placeholders are split out once, so it can be rendered many times.
+    The token boundaries of every segment are stored for the overlap merging, the output
+    is assembled from pieces with a single join, and the pieces of the last render are
+    kept so a render that only changes later slots restarts at the first changed slot.
 
-    tokens1 = _tokenize_problog(s1)
-    tokens2 = _tokenize_problog(s2)
+    args:
+        template: template with placeholders
+        placeholder: default as {{LANGDA}}
+    """
+    def __init__(self, template:str, placeholder:str="{{LANGDA}}"):
+        self.template = template
+        self.placeholder = placeholder
+        self.segments:List[str] = template.split(placeholder)
+        self.segment_tokens:List[List[tuple]] = [_tokenize_problog(seg) for seg in self.segments]
+        # pieces of the last render: [segment0, slot0, segment1, slot1, segment2, ...]
+        self._values:List[Any] = []
+        self._pieces:List[str] = [self.segments[0]]
+        self._lock = threading.Lock()
+
+    @property
+    def slot_count(self) -> int:
+        return len(self.segments) - 1
+
+    @staticmethod
+    def _values_from(replacement_list:Union[List[str],List[dict]]) -> List[Any]:
+        # Extract values from replacement items
+        if replacement_list and all(isinstance(item, dict) for item in replacement_list):
+            return [_parse_simple_dictonary(item)[1] for item in replacement_list]
+        return list(replacement_list or [])
+
+    def _render_from(self, values:List[Any], slot:int) -> str:
+        """Keep the pieces in front of `slot` and rebuild everything after it"""
+        pieces = self._pieces[:2 * slot + 1]
+        for i in range(slot, self.slot_count):
+            replace_text = values[i]
+            if replace_text is not None:
+                # !!! SYNTAX FIX !!!
+                # deal with overlap: segment[0] & "overlap text" + "overlap text" & replace_text
+                replace_text = replace_text.strip("\n")
+                pieces.append(replace_text[_overlap_cut(pieces, _tokenize_problog(replace_text)):])
+            else:
+                # No replacement available, keep the placeholder
+                pieces.append(self.placeholder)
 
-    texts1 = [t for t, _, _ in tokens1]
-    texts2 = [t for t, _, _ in tokens2]
-    
-    # longest overlap
-    max_k = min(len(texts1), len(texts2))
-    for k in range(max_k, 0, -1):
-        if texts1[-k:] == texts2[:k]: # we found the overlap!!!
-            j_start = tokens2[k-1][2]
-            return s1 + s2[j_start:]
-    return s1 + s2
+            # !!! SYNTAX FIX !!!
+            # deal with overlap: replace_text & "overlap text" + "overlap text" & segment[1]
+            seg = self.segments[i + 1]
+            pieces.append(seg[_overlap_cut(pieces, self.segment_tokens[i + 1]):])
+
+        self._values = list(values[:self.slot_count])
+        self._pieces = pieces
+        return "".join(pieces)
+
+    def render(self, replacement_list:Union[List[str],List[dict]]) -> str:
+        """
+        Fill the placeholders with items from the replacement list.
+        - if the value is None, the corresponding placeholder remains unchanged.
+        - valid input forms: List[str] or List[dict]
+        """
+        values = self._values_from(replacement_list)
+        if len(values) < self.slot_count:
+            raise IndexError(f"CompiledTemplate: {self.slot_count} placeholders but only {len(values)} replacements")
+        with self._lock:
+            slot = 0
+            while slot < len(self._values) and self._values[slot] == values[slot]:
+                slot += 1
+            return self._render_from(values, slot)
+
+    def update(self, slot:int, value:Optional[str]) -> str:
+        """
+        Re-render after only the value of one slot changed, the pieces in front of it are reused.
+        """
+        if not 0 <= slot < self.slot_count:
+            raise IndexError(f"CompiledTemplate: slot {slot} out of range [0, {self.slot_count})")
+        with self._lock:
+            if len(self._values) < self.slot_count:
+                raise RuntimeError("CompiledTemplate: render the template once before updating a slot")
+            values = list(self._values)
+            values[slot] = value
+            return self._render_from(values, slot)
+
+@functools.lru_cache(maxsize=64)
+def compile_template(template:str, placeholder:str="{{LANGDA}}") -> CompiledTemplate:
+    """
+    Return the shared CompiledTemplate of a template, so repeated renders across workflow rounds reuse it.
+    """
+    return CompiledTemplate(template, placeholder)
 
 def _replace_placeholder(template:str, replacement_list:Union[List[str],List[dict]], placeholder="{{LANGDA}}") -> str:
     """
@@ -123,78 +340,274 @@ def _replace_placeholder(template:str, replacement_list:Union[List[str],List[dic
         - if the value is None, the corresponding placeholder remains unchanged. 
         - valid input forms: List[str] or List[dict]
     """
+    return compile_template(template, placeholder).render(replacement_list)
 
-    # Extract values from replacement items
-    replace_str_list = []
-    if replacement_list and all(isinstance(item, dict) for item in replacement_list):
-        for item in replacement_list:
-            _, value = next(iter(item.items()))
-            replace_str_list.append(value)
-    else:
-        replace_str_list = replacement_list
 
-    # Split the template by placeholder
-    segments = template.split(placeholder)
-    result = segments[0]
-    
-    # Process each segment after the first
-    for i, seg in enumerate(segments[1:]):
 
-        replace_text = replace_str_list[i]
-        # Check if we have a replacement for this placeholder
-        if i < len(replace_str_list) and replace_text is not None:
-            # !!! SYNTAX FIX !!!
-            # deal with overlap: segment[0] & "overlap text" + "overlap text" & replace_text
-            result = _merge_problog_preserve(result, replace_text.strip("\n"))
+_LANGDA_INFO = re.compile(r"<Langda> Information:.*?</Langda>", re.DOTALL)
+_LANGDA_INFO_HASH = re.compile(r"<HASH> Hash tag of code: (\S+) </HASH>")
+# quoted atoms, strings and character codes (kept) or comments (removed)
+_CODE_COMMENT = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|0'(?:\\.|''|.))|%[^\n]*|/\*.*?\*/", re.DOTALL)
+
+def _strip_comments(code:str) -> str:
+    return _CODE_COMMENT.sub(lambda match: match.group(1) or "", code)
+
+def _local_format_code(template_code:str, generated:str, expected_hashes:Optional[List[str]] = None) -> Optional[str]:
+    """
+    Map the completed program of the first double-chain step onto the HASH slots of the template without
+    asking the LLM: the fixed segments between the <Langda> blocks are located in the program token by token
+    (KMP, comments and whitespace ignored), the code between two segments belongs to the slot in between.
+    args:
+        template_code: the prompt template with a <Langda> Information block per slot to fill
+        generated: the code extracted from the first chain
+        expected_hashes: the HASHes that have to be filled, checked against the template
+    returns:
+        the code blocks in the format of the second chain, None if the alignment is ambiguous: a fixed segment
+        is missing, changed or occurs more than once, two slots are adjacent, code is left outside of the
+        slots or a slot stays empty
+    """
+    infos = list(_LANGDA_INFO.finditer(template_code))
+    hashes = [_LANGDA_INFO_HASH.search(info.group()) for info in infos]
+    if not infos or None in hashes:
+        return None
+    hashes = [match.group(1) for match in hashes]
+    if expected_hashes is not None and sorted(hashes) != sorted(expected_hashes):
+        return None
+
+    bounds = [0] + [pos for info in infos for pos in info.span()] + [len(template_code)]
+    segments = [_strip_comments(template_code[bounds[i]:bounds[i + 1]]) for i in range(0, len(bounds), 2)]
+    code = _strip_comments(generated)
+    tokens = _tokenize_problog(code)
+    texts = [t for t, _, _ in tokens]
+
+    spans:List[Tuple[int, int]] = [] # character span of every segment in code
+    position = 0 # token index after the last matched segment
+    for idx, segment in enumerate(segments):
+        pattern = [t for t, _, _ in _tokenize_problog(segment)]
+        if not pattern:
+            if 0 < idx < len(segments) - 1: # two slots next to each other cannot be told apart
+                return None
+            spans.append((0, 0) if idx == 0 else (len(code), len(code)))
+            continue
+        found = _find_token_runs(texts, pattern, position)
+        if len(found) != 1:
+            return None
+        start, position = found[0], found[0] + len(pattern)
+        spans.append((tokens[start][1], tokens[position - 1][2]))
+    if code[:spans[0][0]].strip() or code[spans[-1][1]:].strip():
+        return None # code outside of the slots
+
+    codes = {}
+    for idx, hash_value in enumerate(hashes):
+        slot_code = code[spans[idx][1]:spans[idx + 1][0]].strip()
+        if not slot_code or "<Langda>" in slot_code:
+            return None
+        codes[hash_value] = slot_code
+    return _format_blocks("code", codes)
+
+def _format_blocks(type: Literal["report", "code"], items:Dict[str, Any]) -> str:
+    """
+    Write {HASH: code} or {HASH: report fields} as the fenced JSON blocks that _find_all_blocks reads back.
+    """
+    blocks = []
+    for hash_value, value in items.items():
+        if type == "code":
+            block, tag = {"HASH": hash_value, "Code": value}, "problog"
         else:
-            # No replacement available, keep the placeholder
-            result += placeholder
+            block, tag = {"HASH": hash_value, **value}, "report"
+        blocks.append(f"```{tag}\n" + json.dumps(block, ensure_ascii=False) + "\n```")
+    return "\n".join(blocks)
 
-        # !!! SYNTAX FIX !!!
-        # deal with overlap: replace_text & "overlap text" + "overlap text" & segment[1]
-        result = _merge_problog_preserve(result, seg)
-        
-    return result
+def _parse_block(type: Literal["report", "code", "final"], match_str: str) -> Optional[dict]:
+    """
+    Parse the content of a single block, returns None if it could not be parsed.
+    Valid JSON without the expected keys goes through the manual construction as well.
+    """
+    try:
+        # Try to parse the JSON directly
+        match_json = json.loads(match_str)
+        # When it succeed...
+        if type == "final":
+            return match_json
+        elif type == "code":
+            if isinstance(match_json, dict) and "HASH" in match_json and "Code" in match_json:
+                return {match_json["HASH"]: match_json["Code"]}
+            else:
+                raise TypeError("could not parse code, retry with manually construction")
+        elif type == "report":
+            if isinstance(match_json, dict) and "HASH" in match_json:
+                return {match_json["HASH"]: match_json}
+            else:
+                raise TypeError("could not parse report, retry with manually construction")
+
+    except (json.JSONDecodeError, TypeError):
+        # If JSON parsing fails, try manually constructing a dictionary
+        try:
+            if type == "code":
+                hash_value = re.search(r'"HASH":\s*"([^"]+)"', match_str).group(1)
+                code_value = re.search(r'"Code":\s*"((?:\\.|[^"])*)"', match_str).group(1)
+                
+                # Unescape the code
+                code_value = code_value.replace('\\\\', '\\').replace('\\"', '"').replace('\\n', '\n')
+                return {hash_value: code_value}
 
+            elif type == "report":
+                hash_value = re.search(r'"HASH":\s*"([^"]+)"', match_str).group(1)
+                error_summary = re.search(r'"ErrorSummary":\s*"((?:[^"\\]|\\.)*)"', match_str).group(1)
+                suggested_fix = re.search(r'"SuggestedFix":\s*"((?:[^"\\]|\\.)*)"', match_str).group(1)
+
+                need_regen = re.search(r'"NeedRegenerate":\s*(true|false)', match_str).group(1)
+
+                # Unescape the report
+                error_summary = error_summary.replace('\\"', '"').replace('\\\\', '\\')
+                suggested_fix = suggested_fix.replace('\\"', '"').replace('\\\\', '\\')
+                return {hash_value: {
+                    "HASH":hash_value,
+                    "ErrorSummary": error_summary,
+                    "SuggestedFix": suggested_fix,
+                    "NeedRegenerate": need_regen
+                }}
+
+            elif type == "final":
+                # {{"Report": "Fill in your analysis here...", "Validity_form": true|false,"Validity_result": true|false}}
+                report_value = re.search(r'"Report":\s*"((?:\\.|[^"])*)"', match_str).group(1)
+                validity_form_value = re.search(r'"Validity_form":\s*(true|false)', match_str).group(1)
+                validity_result_value = re.search(r'"Validity_result":\s*(true|false)', match_str).group(1)
+
+                # Unescape the report
+                report_value = report_value.replace('\\"', '"').replace('\\\\', '\\')
+                return {
+                    "Report": report_value,
+                    "Validity_form": validity_form_value,
+                    "Validity_result": validity_result_value,
+                }
+
+        except Exception as e:
+            logger.error(f"Parsing failed: {e}")
+            logger.error(f"Original content: {repr(match_str)}")
+    return None
+
+
+_FENCE_BODY = re.compile(r'\\.|"|```', re.DOTALL)
+_FENCE_TAG = re.compile(r"[A-Za-z0-9_+-]*")
+
+class FencedBlockScanner:
+    """
+    Incrementally find ``` fenced blocks in a text that arrives in chunks.
+    A block is closed by the first ``` that is not inside a quoted string, escapes are skipped.
+    With quote_aware=False the first ``` closes the block, as the old non-greedy regex did. Use this for
+    code blocks: generated code often has unbalanced quotes, which would otherwise swallow all later blocks.
+    With openers only fences with one of these tags start a block, any other ``` outside of a block is skipped,
+    so quotes are only tracked inside the blocks we are looking for.
+    feed() returns every block whose closing fence arrived with this chunk as (tag, content).
+    """
+    def __init__(self, quote_aware:bool = True, openers:Optional[Tuple[str, ...]] = None):
+        self.quote_aware = quote_aware
+        self.openers = openers
+        self.text = ""
+        self._pos = 0            # next position to scan
+        self._state = "out"      # "out" | "tag" | "body"
+        self._tag_start = 0
+        self._tag = ""
+        self._content_start = 0
+        self._in_quotes = False
+
+    def feed(self, chunk:str) -> List[Tuple[str, str]]:
+        self.text += chunk
+        text = self.text
+        blocks:List[Tuple[str, str]] = []
+        while True:
+            if self._state == "out":
+                start_pos = text.find("```", self._pos)
+                if start_pos == -1:
+                    # keep a partial fence at the end for the next chunk
+                    self._pos = max(self._pos, len(text) - 2)
+                    return blocks
+                self._tag_start = start_pos + 3
+                self._state = "tag"
+
+            if self._state == "tag":
+                tag_end = _FENCE_TAG.match(text, self._tag_start).end()
+                if tag_end == len(text):
+                    # the tag may continue in the next chunk
+                    return blocks
+                self._tag = text[self._tag_start:tag_end]
+                if self.openers is not None and self._tag not in self.openers:
+                    # a fence of another block or a stray ``` in prose
+                    self._pos = tag_end
+                    self._state = "out"
+                    continue
+                self._content_start = self._pos = tag_end
+                self._in_quotes = False
+                self._state = "body"
+
+            # Find REAL End pattern:
+            while True:
+                m = _FENCE_BODY.search(text, self._pos)
+                if m is None:
+                    # no quote, escape or fence left, only a trailing "\" or "``" may still grow
+                    self._pos = max(self._pos, len(text) - 2)
+                    return blocks
+                token = m.group()
+                self._pos = m.end()
+                if token == '"' and self.quote_aware:
+                    self._in_quotes = not self._in_quotes
+                elif token == "```" and not self._in_quotes:
+                    blocks.append((self._tag, text[self._content_start:m.start()]))
+                    self._state = "out"
+                    break
+
+class StreamingBlockExtractor:
+    """
+    Parse "code" or "report" blocks out of streamed LLM output as soon as their closing fence arrives.
+    args:
+        type: One of "code", "report"
+        expected_hashes: HASHes whose blocks complete the answer, see `complete`
+    """
+    BLOCK_TAGS = {"report": ("report", "json")}
+
+    def __init__(self, type: Literal["report", "code"], expected_hashes:Optional[List[str]] = None):
+        self.type = type
+        self.scanner = FencedBlockScanner(quote_aware=type != "code", openers=self.BLOCK_TAGS.get(type))
+        self.blocks:List[dict] = []
+        self.expected_hashes = set(expected_hashes or [])
+        self.received_hashes = set()
+
+    @property
+    def text(self) -> str:
+        return self.scanner.text
+
+    @property
+    def complete(self) -> bool:
+        """True once a block for every expected HASH has been received"""
+        return bool(self.expected_hashes) and self.expected_hashes <= self.received_hashes
+
+    def feed(self, chunk:str) -> List[dict]:
+        new_blocks:List[dict] = []
+        allowed_tags = self.BLOCK_TAGS.get(self.type)
+        for tag, content in self.scanner.feed(chunk):
+            if allowed_tags and tag not in allowed_tags:
+                continue
+            block = _parse_block(self.type, content.strip())
+            if block is None:
+                continue
+            key, _ = _parse_simple_dictonary(block)
+            self.received_hashes.add(key)
+            new_blocks.append(block)
+        self.blocks.extend(new_blocks)
+        return new_blocks
 
+def _scan_fenced_blocks(text:str, quote_aware:bool = True, openers:Optional[Tuple[str, ...]] = None) -> List[Tuple[str, str]]:
+    """
+    Single pass over the text that returns every ``` fenced block as (tag, content), in order.
+    ``` inside quoted strings and escaped characters do not close a block (unless quote_aware is False).
+    With openers only blocks with these tags are returned, see FencedBlockScanner.
+    """
+    return FencedBlockScanner(quote_aware, openers).feed(text)
 
 def _robust_find_block(text:str, block_type:str="report") -> List[str]:
     """Manually find all ``` blocks, this is essential, because we need to ignore ``` blocks in quote"""
-    blocks = []
-    i = 0
-    while i < len(text):
-        # Find Start pattern:
-        start_pattern = f"```{block_type}"
-        start_pos = text.find(start_pattern, i)
-        if start_pos == -1:
-            break
-
-        start_content = start_pos + len(start_pattern)
-
-        # Find REAL End pattern:
-        j = start_content
-        in_quotes = False
-        while j < len(text):
-            char = text[j]
-
-            # Escaped state check
-            if char == '\\' and j + 1 < len(text):
-                j += 2
-                continue
-            # Quoted state check
-            if char == '"':
-                in_quotes = not in_quotes
-
-            if not in_quotes and text[j:j+3] == '```':
-                block_content = text[start_content:j].strip()
-                blocks.append(block_content)
-                i = j + 3
-                break
-            j += 1
-        else:
-            break
-            
-    return blocks
+    return [content.strip() for _, content in _scan_fenced_blocks(text, openers=(block_type,))]
 
 def _find_all_blocks(type: Literal["report", "code", "final"], text: str) -> List[dict]:
     """
@@ -209,86 +622,24 @@ def _find_all_blocks(type: Literal["report", "code", "final"], text: str) -> Lis
         List of dictionaries containing the parsed blocks
     """
     blocks: List[dict] = []
-    # Select pattern based on purpose
-    if type == "report" or type == "final":
-        matches = _robust_find_block(text, "report")
-        if not matches:
-            matches = _robust_find_block(text, "json")
-    elif type == "code":
-        pattern = r"```(?:problog|[a-z]*)?\n(.*?)```"
-        matches = re.findall(pattern, text, re.DOTALL)
-        if not matches:
-            pattern = r"```(?:json|[a-z]*)?\n(.*?)```"
-            matches = re.findall(pattern, text, re.DOTALL)
-    else:
+    if type not in ("report", "code", "final"):
         raise ValueError("you must choose from ['report','code','final']")
+    # Classify all fenced blocks by their tag in a single scan
+    typed_blocks:Dict[str, List[str]] = {}
+    openers = StreamingBlockExtractor.BLOCK_TAGS["report"] if type != "code" else None
+    for tag, content in _scan_fenced_blocks(text, quote_aware=type != "code", openers=openers):
+        typed_blocks.setdefault(tag, []).append(content)
+
+    # Select blocks based on purpose
+    if type == "report" or type == "final":
+        matches = typed_blocks.get("report") or typed_blocks.get("json", [])
+    else: # code blocks may come with any tag (problog, json, prolog, ...)
+        matches = [content for contents in typed_blocks.values() for content in contents]
     
     for match in matches:
-        match_str = match.strip()
-        
-        try:
-            # Try to parse the JSON directly
-            match_json = json.loads(match_str)
-            # When it succeed...
-            if type == "final":
-                blocks.append(match_json)
-            elif type == "code":
-                if isinstance(match_json, dict) and "HASH" in match_json and "Code" in match_json:
-                    blocks.append({match_json["HASH"]: match_json["Code"]})
-                else:
-                    raise TypeError("could not parse code, retry with manually construction")
-            elif type == "report":
-                if isinstance(match_json, dict) and "HASH" in match_json:
-                    blocks.append({match_json["HASH"]: match_json})
-                else:
-                    raise TypeError("could not parse report, retry with manually construction")
-
-        except json.JSONDecodeError:
-            # If JSON parsing fails, try manually constructing a dictionary
-            try:
-                if type == "code":
-                    hash_value = re.search(r'"HASH":\s*"([^"]+)"', match_str).group(1)
-                    code_value = re.search(r'"Code":\s*"((?:\\.|[^"])*)"', match_str).group(1)
-                    
-                    # Unescape the code
-                    code_value = code_value.replace('\\\\', '\\').replace('\\"', '"').replace('\\n', '\n')
-                    blocks.append({hash_value: code_value})
-
-                elif type == "report":
-                    hash_value = re.search(r'"HASH":\s*"([^"]+)"', match_str).group(1)
-                    error_summary = re.search(r'"ErrorSummary":\s*"((?:[^"\\]|\\.)*)"', match_str).group(1)
-                    suggested_fix = re.search(r'"SuggestedFix":\s*"((?:[^"\\]|\\.)*)"', match_str).group(1)
-
-                    need_regen = re.search(r'"NeedRegenerate":\s*(true|false)', match_str).group(1)
-
-                    # Unescape the report
-                    error_summary = error_summary.replace('\\"', '"').replace('\\\\', '\\')
-                    suggested_fix = suggested_fix.replace('\\"', '"').replace('\\\\', '\\')
-                    blocks.append({hash_value: {
-                        "HASH":hash_value,
-                        "ErrorSummary": error_summary,
-                        "SuggestedFix": suggested_fix,
-                        "NeedRegenerate": need_regen
-                    }})
-
-                elif type == "final":
-                    # {{"Report": "Fill in your analysis here...", "Validity_form": true|false,"Validity_result": true|false}}
-                    report_value = re.search(r'"Report":\s*"((?:\\.|[^"])*)"', match_str).group(1)
-                    validity_form_value = re.search(r'"Validity_form":\s*(true|false)', match_str).group(1)
-                    validity_result_value = re.search(r'"Validity_result":\s*(true|false)', match_str).group(1)
-
-                    # Unescape the report
-                    report_value = report_value.replace('\\"', '"').replace('\\\\', '\\')
-                    blocks.append({
-                        "Report": report_value,
-                        "Validity_form": validity_form_value,
-                        "Validity_result": validity_result_value,
-                    })
-
-            except Exception as e:
-                logger.error(f"Parsing failed: {e}")
-                logger.error(f"Original content: {repr(match_str)}")
-                continue
+        block = _parse_block(type, match.strip())
+        if block is not None:
+            blocks.append(block)
 
     return blocks
 
@@ -0,0 +1,124 @@
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, TypeVar
+from uuid import UUID
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+import logging
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class RequestCancelled(Exception):
+    """The call lost a hedged race and was cancelled"""
+
+class CancelCallback(BaseCallbackHandler):
+    """Stop every LLM call of an executor once its cancel event is set, also between the steps of a tool agent"""
+    raise_error = True
+
+    def __init__(self, event:threading.Event):
+        self.event = event
+
+    def _check(self) -> None:
+        if self.event.is_set():
+            raise RequestCancelled("cancelled, the hedged duplicate answered first")
+
+    def on_chat_model_start(self, serialized:Dict[str, Any], messages, *, run_id:UUID, **kwargs:Any) -> None:
+        self._check()
+
+    def on_llm_new_token(self, token:str, *, run_id:UUID, **kwargs:Any) -> None:
+        self._check()
+
+class LatencyTracker:
+    """Recent latencies per call kind, for the hedging threshold"""
+
+    def __init__(self, window:int = 200):
+        self.window = window
+        self._latencies:Dict[Hashable, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key:Hashable, seconds:float) -> None:
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def threshold(self, key:Hashable, percentile:float, default:float, min_samples:int) -> float:
+        """The percentile of the recent latencies, default until min_samples are known"""
+        with self._lock:
+            latencies = list(self._latencies.get(key, ()))
+        if len(latencies) < min_samples:
+            return default
+        return float(np.percentile(latencies, percentile))
+
+class HedgeBudget:
+    """Caps the duplicates to a share of all calls and optionally to a total number"""
+
+    def __init__(self):
+        self.stats:Dict[str, int] = {"calls": 0, "hedged": 0, "hedge_won": 0}
+        self._lock = threading.Lock()
+
+    def register_call(self) -> None:
+        with self._lock:
+            self.stats["calls"] += 1
+
+    def try_hedge(self, max_ratio:float, max_hedges:Optional[int]) -> bool:
+        with self._lock:
+            if max_hedges is not None and self.stats["hedged"] >= max_hedges:
+                return False
+            if self.stats["hedged"] + 1 > max_ratio * self.stats["calls"]:
+                return False
+            self.stats["hedged"] += 1
+            return True
+
+    def record_win(self) -> None:
+        with self._lock:
+            self.stats["hedge_won"] += 1
+
+_latency_tracker = LatencyTracker()
+_hedge_budget = HedgeBudget()
+
+def hedge_stats() -> Dict[str, int]:
+    """Calls that could be hedged, duplicates sent and duplicates that answered first"""
+    with _hedge_budget._lock:
+        return dict(_hedge_budget.stats)
+
+def hedged_call(key:Hashable, primary:Callable[[], T], secondary:Callable[[], T],
+                primary_cancel:threading.Event, secondary_cancel:threading.Event, is_valid:Callable[[T], bool],
+                percentile:float, delay:float, min_samples:int, max_ratio:float, max_hedges:Optional[int]) -> T:
+    """
+    Run primary; if it has not returned after the percentile of its recent latencies (delay before
+    min_samples are known) and the budget allows, run secondary as well. The first valid result wins and
+    the cancel event of the other call is set. If neither result is valid, the primary one is returned
+    (or its exception raised).
+    """
+    _hedge_budget.register_call()
+    threshold = _latency_tracker.threshold(key, percentile, delay, min_samples)
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="langda-hedge")
+    start = time.monotonic()
+    first = pool.submit(contextvars.copy_context().run, primary) # keep the metrics collector of the run
+    first.add_done_callback(lambda _: _latency_tracker.record(key, time.monotonic() - start)) # lower bound if cancelled
+    try:
+        done, _ = wait([first], timeout=threshold)
+        if done or not _hedge_budget.try_hedge(max_ratio, max_hedges):
+            return first.result()
+        logger.info(f"No answer after {threshold:.1f}s, sending a hedged duplicate to the secondary model")
+        second = pool.submit(contextvars.copy_context().run, secondary)
+        cancel = {first: primary_cancel, second: secondary_cancel}
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: f is not first): # the primary wins a tie
+                if future.exception() is None and is_valid(future.result()):
+                    for other in pending:
+                        cancel[other].set()
+                    if future is second:
+                        _hedge_budget.record_win()
+                        logger.info(f"Hedged duplicate answered first after {time.monotonic() - start:.1f}s")
+                    return future.result()
+        return first.result()
+    finally:
+        pool.shutdown(wait=False)
@@ -0,0 +1,103 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Set, Union
+
+from .rate_limit import estimate_tokens
+
+import logging
+logger = logging.getLogger(__name__)
+
+# an entry of test_analysis: a static note (the syntax rules) or the result of one evaluate round
+# {"round": int, "analysis": first-chain analysis, "reports": {HASH: report block}}
+AnalysisEntry = Union[str, Dict[str, Any]]
+
+_MIN_DEDUP_LENGTH = 20 # shorter lines (fences, headings) are kept, they carry no repeated error text
+
+def _normalize(line:str) -> str:
+    return " ".join(line.split()).lower()
+
+def compact_test_analysis(entries:List[AnalysisEntry]) -> List[AnalysisEntry]:
+    """
+    Prune the history of the evaluate rounds: static notes are kept as they are, of the rounds only the latest
+    report of every HASH and the analysis lines that a later round does not repeat are kept.
+    Rounds with nothing left are dropped.
+    """
+    reported:Set[str] = set()
+    seen_lines:Set[str] = set()
+    compacted:List[AnalysisEntry] = []
+    for entry in reversed(entries):
+        if isinstance(entry, str):
+            compacted.append(entry)
+            continue
+        reports = {hash_value: report for hash_value, report in entry.get("reports", {}).items() if hash_value not in reported}
+        reported.update(reports)
+        lines = []
+        for line in (entry.get("analysis") or "").splitlines():
+            normalized = _normalize(line)
+            if len(normalized) >= _MIN_DEDUP_LENGTH:
+                if normalized in seen_lines:
+                    continue
+                seen_lines.add(normalized)
+            lines.append(line)
+        analysis = "\n".join(lines).strip()
+        if not any(len(_normalize(line)) >= _MIN_DEDUP_LENGTH for line in lines):
+            analysis = "" # only fences and headings left
+        if reports or analysis:
+            compacted.append({"round": entry.get("round"), "analysis": analysis, "reports": reports})
+    compacted.reverse()
+    return compacted
+
+def _format_report(hash_value:str, report:Dict[str, Any]) -> str:
+    fields = [f"{name}: {report[name]}" for name in ("NeedRegenerate", "ErrorSummary", "SuggestedFix", "Dependencies") if name in report]
+    return f"[HASH {hash_value}]\n" + "\n".join(fields)
+
+_rendered:"OrderedDict[str, str]" = OrderedDict()
+_rendered_lock = threading.Lock()
+_MAX_RENDERED = 256
+
+def render_test_analysis(entries:List[AnalysisEntry], token_budget:int = 4000) -> str:
+    """
+    The text get_report_tool returns: the static notes, the latest report per HASH and the analyses from the
+    newest round backwards until the token budget is used up. Renderings are cached by content, repeated tool
+    calls within and across rounds cost nothing.
+    """
+    key = hashlib.blake2b(json.dumps([entries, token_budget], sort_keys=True, default=str).encode("utf-8"), digest_size=16).hexdigest()
+    with _rendered_lock:
+        if key in _rendered:
+            _rendered.move_to_end(key)
+            return _rendered[key]
+
+    entries = compact_test_analysis(entries)
+    sections = [entry for entry in entries if isinstance(entry, str)]
+    rounds = [entry for entry in entries if not isinstance(entry, str)]
+    reports = [_format_report(hash_value, report) for entry in reversed(rounds) for hash_value, report in entry["reports"].items()]
+    if reports:
+        sections.append("% Latest report per HASH:\n" + "\n\n".join(reports))
+    for entry in reversed(rounds):
+        if entry["analysis"]:
+            sections.append(f"% Analysis of round {entry['round']}:\n{entry['analysis']}")
+
+    kept:List[str] = []
+    remaining = token_budget
+    for section in sections:
+        tokens = estimate_tokens(section)
+        if tokens <= remaining:
+            kept.append(section)
+            remaining -= tokens
+            continue
+        if remaining > 50: # cut the section instead of dropping it
+            kept.append(section[:remaining * 4] + "\n ...<truncated>... ")
+        omitted = len(sections) - len(kept)
+        if omitted:
+            kept.append(f" ...<{omitted} older sections omitted to stay within {token_budget} tokens>... ")
+        break
+    text = "\n\n".join(kept)
+    logger.info(f"test_analysis compacted to about {estimate_tokens(text)} tokens ({len(rounds)} rounds)")
+
+    with _rendered_lock:
+        _rendered[key] = text
+        while len(_rendered) > _MAX_RENDERED:
+            _rendered.popitem(last=False)
+    return text
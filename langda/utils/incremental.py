@@ -0,0 +1,181 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+from problog.program import PrologString
+from problog.logic import Clause, AnnotatedDisjunction, Term, Var, Or
+
+from .problog_result import ProblogResult
+from .static_check import _walk_goals, _signature
+
+import logging
+logger = logging.getLogger(__name__)
+
+Signature = Tuple[str, int]
+_ANY = ("*", 0) # a clause that calls a variable goal may depend on every predicate
+
+class ProgramGraph(NamedTuple):
+    """Predicate definitions and the predicate dependency graph of a parsed program"""
+    definitions: Dict[Signature, List[str]] # clauses per predicate, as text, in program order
+    calls: Dict[Signature, Set[Signature]] # predicates called by the clauses of a predicate
+    queries: List[Term] # arguments of the query/1 facts
+    evidence: List[Term] # evidence/1 and evidence/2 facts
+    directives: List[str]
+
+def program_graph(model:str) -> Optional[ProgramGraph]:
+    """
+    Parse the program into its predicate dependency graph, None if it does not parse
+    or declares queries or evidence through rules (their atoms are not known before grounding).
+    """
+    definitions:Dict[Signature, List[str]] = {}
+    calls:Dict[Signature, Set[Signature]] = {}
+    queries:List[Term] = []
+    evidence:List[Term] = []
+    directives:List[str] = []
+    try:
+        clauses = list(PrologString(model))
+    except Exception as e:
+        logger.debug(f"program_graph: could not parse program: {e}")
+        return None
+    for clause in clauses:
+        if isinstance(clause, Clause) and clause.head.functor == "_directive": # problog's form of ":- Goal."
+            directives.append(f":- {clause.body}.")
+            continue
+        if isinstance(clause, AnnotatedDisjunction):
+            heads, body = list(clause.heads), clause.body
+        elif isinstance(clause, Clause):
+            heads, body = clause.head.to_list() if isinstance(clause.head, Or) else [clause.head], clause.body
+        elif isinstance(clause, Or):
+            heads, body = clause.to_list(), None
+        else:
+            heads, body = [clause], None
+        signatures = [_signature(head) for head in heads]
+        if any(signature in (("query", 1), ("evidence", 1), ("evidence", 2)) for signature in signatures):
+            if body is not None or len(heads) > 1:
+                return None
+            (queries if signatures[0] == ("query", 1) else evidence).append(heads[0])
+            continue
+        called:Set[Signature] = set()
+        if body is not None:
+            for goal, _ in _walk_goals(body):
+                called.add(_ANY if isinstance(goal, Var) else _signature(goal))
+        for signature in signatures:
+            definitions.setdefault(signature, []).append(str(clause))
+            calls.setdefault(signature, set()).update(called)
+    return ProgramGraph(definitions, calls, [query.args[0] for query in queries], evidence, directives)
+
+def _closure(graph:ProgramGraph, roots:List[Signature]) -> Set[Signature]:
+    """The predicates the roots depend on, transitively"""
+    seen:Set[Signature] = set()
+    stack = list(roots)
+    while stack:
+        signature = stack.pop()
+        if signature in seen:
+            continue
+        if signature == _ANY:
+            return set(graph.definitions) | {_ANY}
+        seen.add(signature)
+        stack.extend(graph.calls.get(signature, ()))
+    return seen
+
+def query_fingerprints(graph:ProgramGraph, backend:Optional[str] = None) -> List[str]:
+    """
+    One fingerprint per query: the query, the backend, the directives (use_module, consult, ... may define
+    any predicate) and the clauses of every predicate the query (or the evidence, which conditions every
+    query) depends on. A query keeps its fingerprint as long as none of these change.
+    """
+    evidence_roots = [_signature(ev.args[0]) for ev in graph.evidence if ev.args and isinstance(ev.args[0], Term)]
+    evidence_closure = _closure(graph, evidence_roots)
+    shared = [backend or "default", *graph.directives, *sorted(map(str, graph.evidence))]
+    fingerprints = []
+    for query in graph.queries:
+        closure = _closure(graph, [_signature(query)]) | evidence_closure
+        parts = shared + [str(query)] + [f"{name}/{arity}:" + "\n".join(graph.definitions.get((name, arity), []))
+                                          for name, arity in sorted(closure)]
+        fingerprints.append(hashlib.blake2b("\x00".join(parts).encode("utf-8"), digest_size=16).hexdigest())
+    return fingerprints
+
+def _matches(pattern, term) -> bool:
+    """Whether a ground query result is an instance of a declared query (repeated variables are not checked)"""
+    if pattern is None or isinstance(pattern, Var):
+        return True
+    if not isinstance(term, Term) or not isinstance(pattern, Term):
+        return pattern == term
+    if pattern.functor != term.functor or pattern.arity != term.arity:
+        return False
+    return all(_matches(p, t) for p, t in zip(pattern.args, term.args))
+
+class IncrementalPlan(NamedTuple):
+    """The queries of a program split into those with a cached result and those to evaluate"""
+    queries: List[Term] # declared queries, in program order
+    fingerprints: List[str]
+    cached: Dict[int, List[Tuple[Term, float]]] # index of a declared query -> its results
+    pending: List[int] # indices of the declared queries to evaluate
+
+class IncrementalEvaluator:
+    """
+    Keep the results of every query between the rounds of the generate-evaluate loop. Only the queries
+    whose predicate dependencies (the clauses they reach in the dependency graph) changed are grounded
+    and evaluated again, on large fixed knowledge bases the work per round follows the size of the change.
+    Only exact results are cached.
+    """
+
+    def __init__(self, max_entries:int = 4096):
+        self.max_entries = max_entries
+        self._results:"OrderedDict[str, List[Tuple[Term, float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats:Dict[str, int] = {"reused": 0, "evaluated": 0}
+
+    def plan(self, model:str, backend:Optional[str] = None) -> Optional[IncrementalPlan]:
+        """None if the program has no plain query/1 facts, then it is evaluated as a whole"""
+        graph = program_graph(model)
+        if graph is None or not graph.queries:
+            return None
+        fingerprints = query_fingerprints(graph, backend)
+        cached:Dict[int, List[Tuple[Term, float]]] = {}
+        pending:List[int] = []
+        with self._lock:
+            for idx, fingerprint in enumerate(fingerprints):
+                if fingerprint in self._results:
+                    self._results.move_to_end(fingerprint)
+                    cached[idx] = self._results[fingerprint]
+                else:
+                    pending.append(idx)
+        return IncrementalPlan(graph.queries, fingerprints, cached, pending)
+
+    def merge(self, plan:IncrementalPlan, evaluated:Optional[ProblogResult] = None) -> ProblogResult:
+        """
+        Combine the cached results with the evaluation of the pending queries, in the order of the program.
+        A failed or approximate evaluation is returned as it is, without caching.
+        """
+        if evaluated is not None and (not evaluated.ok or evaluated.method != "exact" or evaluated.upper is not None):
+            return evaluated
+        fresh:Dict[int, List[Tuple[Term, float]]] = {idx: [] for idx in plan.pending}
+        if evaluated is not None:
+            for term, probability in zip(evaluated.queries, evaluated.probabilities.tolist()):
+                for idx in plan.pending:
+                    if _matches(plan.queries[idx], term):
+                        fresh[idx].append((term, probability))
+                        break
+        with self._lock:
+            for idx, results in fresh.items():
+                self._results[plan.fingerprints[idx]] = results
+                self._results.move_to_end(plan.fingerprints[idx])
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+            self.stats["reused"] += len(plan.cached)
+            self.stats["evaluated"] += len(plan.pending)
+        logger.info(f"Incremental evaluation: {len(plan.cached)} queries reused, {len(plan.pending)} evaluated")
+        merged = [pair for idx in range(len(plan.queries)) for pair in (plan.cached.get(idx) or fresh.get(idx, []))]
+        return ProblogResult([term for term, _ in merged], np.array([p for _, p in merged], dtype=np.float64))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+_incremental_evaluator = IncrementalEvaluator()
+
+def get_incremental_evaluator() -> IncrementalEvaluator:
+    return _incremental_evaluator
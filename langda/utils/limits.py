@@ -0,0 +1,177 @@
+import sys
+import time
+import signal
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, NamedTuple, Optional
+
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+try:
+    import resource
+except ImportError: # not on Windows, limits are not enforced there
+    resource = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+class EvaluationLimits(BaseSettings):
+    """
+    Resource limits of one evaluation in an evaluator worker, supports environment variable overrides.
+    None disables a limit. The wall-clock timeout of the pool applies in any case.
+    """
+    max_memory_mb: Optional[float] = Field(default=4096, description="Address space an evaluation may allocate on top of the idle worker")
+    max_cpu_seconds: Optional[float] = Field(default=None, description="CPU seconds of one evaluation")
+    recursion_limit: Optional[int] = Field(default=None, description="Python recursion limit while evaluating")
+    model_config = SettingsConfigDict(
+        env_prefix="LANGDA_EVAL_LIMIT_",
+        env_file=".env",
+        extra="ignore",
+    )
+
+class EvaluationUsage(NamedTuple):
+    """Resources used by one evaluation, sizes are None if the job did not compile a program"""
+    peak_rss_mb: float
+    cpu_seconds: float
+    wall_seconds: float
+    ground_nodes: Optional[int] = None
+    circuit_nodes: Optional[int] = None
+
+    def __str__(self) -> str:
+        sizes = "".join(f", {name.replace('_', ' ')} {value}" for name, value in
+                        (("ground_nodes", self.ground_nodes), ("circuit_nodes", self.circuit_nodes)) if value is not None)
+        return f"peak memory {self.peak_rss_mb:.1f} MB, cpu {self.cpu_seconds:.2f} s, wall {self.wall_seconds:.2f} s{sizes}"
+
+class ResourceLimitExceeded(Exception):
+    """The evaluation used more CPU time than its limit allows"""
+
+# sizes of the program evaluated by the current job, filled in by the evaluation functions
+_program_sizes:Dict[str, Optional[int]] = {}
+
+def record_sizes(ground:Any = None, circuit:Any = None) -> None:
+    """Remember the number of nodes of the ground program and of the compiled circuit for the usage report"""
+    for name, formula in (("ground_nodes", ground), ("circuit_nodes", circuit)):
+        if formula is None:
+            continue
+        try:
+            _program_sizes[name] = len(formula)
+        except TypeError: # e.g. k-best formulas have no length
+            pass
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # peak of the whole process
+
+def _reset_peak_rss() -> None:
+    """Reset the peak RSS (VmHWM) to the current RSS, so the peak is per evaluation (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def _address_space_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmSize:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def _cpu_seconds() -> float:
+    """CPU time of this process and its finished children, e.g. the dsharp compiler"""
+    if resource is None:
+        return time.process_time()
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def _cpu_exceeded(signum, frame):
+    raise ResourceLimitExceeded("CPU time limit exceeded")
+
+# soft limits lowered by the current job: resource -> (soft, hard) before the job
+_lowered:Dict[int, tuple] = {}
+
+@contextmanager
+def _soft_limit(kind:int, value:int):
+    """Lower the soft limit of a resource for the duration of the block, the hard limit stays"""
+    soft, hard = resource.getrlimit(kind)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(kind, (value, hard))
+    _lowered[kind] = (soft, hard)
+    try:
+        yield
+    finally:
+        release_limits()
+
+def release_limits() -> None:
+    """Restore the limits lowered for the current job, e.g. to report an exceeded limit without hitting it again"""
+    while _lowered:
+        kind, limits = _lowered.popitem()
+        resource.setrlimit(kind, limits)
+
+@contextmanager
+def enforce_limits(limits:Optional[EvaluationLimits]):
+    """
+    Run the block of an evaluator worker under the limits and measure what it used.
+    Memory is limited through RLIMIT_AS (allocations beyond it raise MemoryError), CPU time through
+    RLIMIT_CPU (SIGXCPU raises ResourceLimitExceeded). Only for the main thread of a worker process,
+    the limits hold for the whole process.
+    yields:
+        a dict that holds the EvaluationUsage under "usage" after the block
+    """
+    report:Dict[str, EvaluationUsage] = {}
+    _program_sizes.clear()
+    _reset_peak_rss()
+    start_cpu, start_wall = _cpu_seconds(), time.monotonic()
+    memory = cpu = None
+    recursion_limit = sys.getrecursionlimit()
+    if limits is not None and resource is not None:
+        baseline = _address_space_mb()
+        if limits.max_memory_mb is not None and baseline is not None:
+            memory = int((baseline + limits.max_memory_mb) * 1024 * 1024)
+        if limits.max_cpu_seconds is not None:
+            own = resource.getrusage(resource.RUSAGE_SELF)
+            cpu = int(own.ru_utime + own.ru_stime + limits.max_cpu_seconds) + 1
+    previous_handler = signal.signal(signal.SIGXCPU, _cpu_exceeded) if cpu is not None else None
+    try:
+        if limits is not None and limits.recursion_limit is not None:
+            sys.setrecursionlimit(limits.recursion_limit)
+        with ExitStack() as stack:
+            if memory is not None:
+                stack.enter_context(_soft_limit(resource.RLIMIT_AS, memory))
+            if cpu is not None:
+                stack.enter_context(_soft_limit(resource.RLIMIT_CPU, cpu))
+            yield report
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+        if previous_handler is not None:
+            signal.signal(signal.SIGXCPU, previous_handler)
+        report["usage"] = EvaluationUsage(
+            peak_rss_mb=round(_peak_rss_mb(), 1),
+            cpu_seconds=round(_cpu_seconds() - start_cpu, 3),
+            wall_seconds=round(time.monotonic() - start_wall, 3),
+            ground_nodes=_program_sizes.get("ground_nodes"),
+            circuit_nodes=_program_sizes.get("circuit_nodes"),
+        )
+
+def too_expensive_message(error:BaseException) -> str:
+    """The evaluation result for the LLM when a program hit a resource limit, lifts the limits of the job"""
+    release_limits()
+    sizes = ", ".join(f"{name.replace('_', ' ')}: {value}" for name, value in _program_sizes.items())
+    kind = {MemoryError: "memory", RecursionError: "recursion depth"}.get(type(error), "CPU time")
+    return ("Error evaluating Problog model:\n"
+            f"The program is too expensive to evaluate, it exceeded the {kind} limit"
+            + (f" ({sizes})" if sizes else "") + ".\n"
+            "Check for unbounded recursion or rules whose grounding explodes, e.g. recursion without a decreasing "
+            "argument or large cross products of facts.")
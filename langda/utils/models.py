@@ -1,12 +1,18 @@
-from typing import Literal, Dict, List, Tuple, Optional
+from typing import Any, Literal, Dict, List, Tuple, Optional
 from pydantic import BaseModel, Field
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pathlib import Path
 import time
 import re
-
-from langchain.tools import BaseTool
+import inspect
+import functools
+import threading
+from collections import Counter
+
+from langchain.tools import BaseTool, Tool, StructuredTool
+from langchain.agents.format_scratchpad.tools import format_to_tool_messages
+from langchain_core.messages import HumanMessage
 from langchain.schema import BaseOutputParser
 from langchain.schema.runnable import Runnable
 from langchain.chat_models.base import BaseChatModel
@@ -20,31 +26,115 @@ from langchain.agents import (
     AgentExecutor,
 )
 from dotenv import find_dotenv
+from .format_tools import StreamingBlockExtractor, _local_format_code, _format_blocks, _find_all_blocks
+from .retry import RetrySettings, classify_error, is_provider_error, backoff_delay, get_circuit_breaker
+from .rate_limit import RateLimitSettings, RateLimitCallback, get_rate_limiter
+from .hedging import CancelCallback, RequestCancelled, hedged_call
+from ..metrics import MetricsCallback, ToolMetricsCallback, current_metrics, record
+from .cassette import CassetteConfig, CassetteChatModel
 
 import logging
 from langchain_logger.callback import ChainOfThoughtCallbackHandler
 logger = logging.getLogger(__name__)
 
 def retry_agent(max_attempts):
-    # Allow the agent retry 2 times
+    """
+    Retry an LLM call of the executor with jittered exponential backoff, honoring Retry-After.
+    Fatal errors (authentication, invalid requests) are raised at once, transient provider errors count towards
+    the circuit breaker of the provider and model, which fails fast while the provider is unhealthy.
+    """
     def decorator(func):
-        def wrapper(*args, **kwargs):
+        signature = inspect.signature(func)
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            config = signature.bind_partial(self, *args, **kwargs).arguments.get("config")
+            settings = RetrySettings()
+            breaker = get_circuit_breaker(*self._circuit_key(config), settings)
             for attempt in range(max_attempts):
+                breaker.before_call()
+                resolved = False # whether the call told the breaker anything, see CircuitBreaker.abandon_trial
                 try:
-                    return func(*args, **kwargs)
+                    result = func(self, *args, **kwargs)
+                    breaker.record_success()
+                    resolved = True
+                    return result
                 except Exception as e:
-                    if "Authentication failed" in str(e) or "401" in str(e):
-                        logger.error(f"Fatal authentication error: {e}")
+                    if self.cancel_event is not None and self.cancel_event.is_set():
+                        raise # lost a hedged race, nothing to retry
+                    kind = classify_error(e)
+                    if kind == "fatal":
+                        logger.error(f"Fatal error, not retrying: {type(e).__name__}: {e}")
                         raise
-                    if attempt < max_attempts - 1:
-                        logger.warning(f"Attempt {attempt + 1} failed with error: {e}. Retrying...")
-                        time.sleep(1)
+                    if is_provider_error(e):
+                        breaker.record_failure()
+                    else: # the provider answered, the answer was unusable (e.g. no block to parse)
+                        breaker.record_success()
+                    resolved = True
+                    record("retry", breaker.name, error_kind=kind)
+                    if attempt < max_attempts - 1 and breaker.state != "open":
+                        delay = backoff_delay(attempt, e, settings)
+                        logger.warning(f"Attempt {attempt + 1} failed with {kind} error: {e}. Retrying in {delay:.1f}s...")
+                        time.sleep(delay)
                     else:
                         logger.error(f"All {max_attempts} attempts failed. Last error: {e}")
                         raise
+                finally:
+                    if not resolved:
+                        breaker.abandon_trial()
         return wrapper
     return decorator
 
+# how often the double-chain agent formatted the code locally instead of calling the second chain
+_local_format_stats:Dict[str, int] = {"local": 0, "second_chain": 0}
+_local_format_lock = threading.Lock()
+
+def _count_local_format(local:bool) -> None:
+    with _local_format_lock:
+        _local_format_stats["local" if local else "second_chain"] += 1
+        total = sum(_local_format_stats.values())
+        logger.info(f"Local formatter fast path taken in {_local_format_stats['local']} of {total} code formatting steps "
+                    f"({_local_format_stats['local'] / total:.0%})")
+
+def local_format_stats() -> Dict[str, int]:
+    """Counts of code formatting steps done by the local formatter and by the second chain"""
+    with _local_format_lock:
+        return dict(_local_format_stats)
+
+def _structured_schema(block_type:Literal["code", "report"], hashes:List[str]) -> dict:
+    """JSON schema of the answer with one required property per HASH, for with_structured_output"""
+    if block_type == "code":
+        title, item = "langda_code_blocks", {"type": "string", "description": "The completed code of the block with this HASH, without comments"}
+    else:
+        title, item = "langda_reports", {
+            "type": "object",
+            "properties": {
+                "ErrorSummary": {"type": "string", "description": "Brief summary of the errors, 'No issues found.' if there are none"},
+                "SuggestedFix": {"type": "string", "description": "A fix that addresses the errors"},
+                "Dependencies": {"type": "array", "items": {"type": "string"}, "description": "HASHes of blocks that must change together with this one"},
+                "NeedRegenerate": {"type": "boolean", "description": "True if the block has to be regenerated"},
+            },
+            "required": ["ErrorSummary", "SuggestedFix", "Dependencies", "NeedRegenerate"],
+        }
+    return {
+        "title": title,
+        "description": "One entry per HASH of the <langda> blocks",
+        "type": "object",
+        "properties": {hash_value: item for hash_value in hashes},
+        "required": list(hashes),
+    }
+
+# the same leading system message for every prompt type, so providers can reuse their prefix cache
+_SHARED_SYSTEM_PROMPT = ("You are an expert programmer and code evaluator proficient in Problog and DeepProbLog. "
+                         "Follow the task instructions exactly, the input of the task is given at the end.")
+
+@functools.lru_cache(maxsize=1)
+def _syntax_notes() -> str:
+    with open(Path(__file__).parent.parent / "prompts" / "Problog_Syntax.txt", "r", encoding="utf-8") as f:
+        return f.read()
+
+def _escape_braces(text:str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
 class NoOpOutputParser(BaseOutputParser[str]):
     def parse(self, text: str) -> str:
         return text
@@ -59,6 +149,15 @@ class LLMConfig(BaseModel):
     api_ver: str = "2024-01-01"
     temperature: float = 0.2
 
+class HedgeConfig(BaseModel):
+    provider: str = "" # secondary provider, detected from the model name if empty
+    model: str = "" # secondary model, hedging is off without it
+    percentile: float = 95 # send the duplicate once a call takes longer than this percentile of recent calls
+    delay: float = 30.0 # threshold in seconds until min_samples latencies are known
+    min_samples: int = 20
+    max_ratio: float = 0.1 # at most this share of the calls is duplicated
+    max_hedges: Optional[int] = None # at most this many duplicates per process
+
 class AgentSettings(BaseSettings):
 
     model_config = SettingsConfigDict(
@@ -72,6 +171,8 @@ class AgentSettings(BaseSettings):
     deepseek: LLMConfig  = {} # 1. subconfig：DeepSeek
     openai: LLMConfig  = {} # 2. subconfig：OpenAI
     groq: LLMConfig  = {} # 3. subconfig：GroqCloud
+    hedge: HedgeConfig = {} # secondary provider/model of hedged requests
+    cassette: CassetteConfig = {} # record/replay stand-in, model_name "cassette" or "cassette:<path>"
 
 class LangdaAgentExecutor(BaseModel):
     """
@@ -81,6 +182,13 @@ class LangdaAgentExecutor(BaseModel):
     cfgs: AgentSettings = Field(default_factory=AgentSettings)
     tools: List[BaseTool]
     model_name:str
+    local_format: bool = True # map the first chain's code onto the HASHes locally when the alignment is unambiguous
+    structured_output: bool = False # provider-native structured output for the code and report blocks
+    cancel_event: Optional[Any] = Field(default=None, exclude=True) # threading.Event that cancels the calls of a hedged race
+    prefix_cache_layout: bool = False # static instructions first and the per-run content last, for provider prefix caches
+    max_iterations: int = 15 # tool-calling turns of the first chain before a final answer is forced
+    max_execution_time: Optional[float] = None # seconds of the tool-calling loop before a final answer is forced
+    tool_quotas: Dict[str, int] = Field(default_factory=dict) # calls per tool and invocation, e.g. {"search_tool": 2}
     # File name configurations:
     prompt_format: Dict[str, str] = Field(default={
         "generate": "generate_prompt_{}.txt",
@@ -94,6 +202,8 @@ class LangdaAgentExecutor(BaseModel):
         Detect the LLM provider based on model_name.
         """
         name = (self.model_name or "").lower()
+        if name.startswith("cassette"):
+            return "cassette"
         if "deepseek" in name:
             return "deepseek"
         if "gpt" in name or "openai" in name:
@@ -102,11 +212,36 @@ class LangdaAgentExecutor(BaseModel):
             return "groq"
         raise TypeError(f"unsupported model: {self.model_name}")
 
-    def get_callbacks(self) -> Optional[List]:
+    def _circuit_key(self, config:Optional[dict] = None) -> Tuple[str, str]:
+        """(provider, model) of the calls with this config, the key of the shared circuit breaker"""
+        xauth:dict = (config or {}).get("metadata", {}).get("x_auth", {})
+        return xauth.get("provider") or self._detect_provider(), xauth.get("model") or self.model_name
+
+    def get_callbacks(self, provider:Optional[str] = None, api_key:Optional[str] = None, model:Optional[str] = None) -> Optional[List]:
         """
-        Get callbacks for LLM logging if enabled.
+        Get callbacks for LLM logging if enabled, for the rate limit of the provider and API key if it is limited
+        and for the metrics of the current run.
         """
-        return [ChainOfThoughtCallbackHandler(logger=logger)]
+        callbacks = [ChainOfThoughtCallbackHandler(logger=logger)]
+        collector = current_metrics()
+        if collector is not None:
+            callbacks.append(MetricsCallback(collector, f"{provider}/{model}" if provider else self.model_name,
+                                             layout="prefix_cache" if self.prefix_cache_layout else "default"))
+        if self.cancel_event is not None:
+            callbacks.append(CancelCallback(self.cancel_event))
+        if provider and api_key:
+            settings = RateLimitSettings()
+            limiter = get_rate_limiter(provider, api_key, settings)
+            if limiter is not None:
+                callbacks.append(RateLimitCallback(limiter, settings))
+        return callbacks
+
+    def tool_run_config(self, config:dict) -> dict:
+        """The run config with the tool metrics callback of the current run, tools only see the callbacks of the config"""
+        collector = current_metrics()
+        if collector is None:
+            return config
+        return {**config, "callbacks": [*(config.get("callbacks") or []), ToolMetricsCallback(collector)]}
 
     def get_prompt_path(self, prompt_type: str, agent_type:str) -> Path:
         """
@@ -144,6 +279,8 @@ class LangdaAgentExecutor(BaseModel):
 
         # Determine provider first (before we need final_model)
         provider = xauth.get("provider") or self._detect_provider()
+        if provider == "cassette":
+            return self.get_cassette_model(config)
 
         # Get base configurations based on provider
         if provider == "deepseek":
@@ -185,25 +322,185 @@ class LangdaAgentExecutor(BaseModel):
                 model_name=final_model,
                 temperature=final_temp,
                 openai_api_key=final_key,
-                callbacks=self.get_callbacks(),
+                stream_usage=True, # token usage of streamed answers
+                max_retries=0, # retried by retry_agent
+                callbacks=self.get_callbacks(provider, final_key, final_model),
             )
         if provider == "deepseek":
             return ChatDeepSeek(
                 model=final_model,
                 temperature=final_temp,
                 api_key=final_key,
-                callbacks=self.get_callbacks(),
+                stream_usage=True,
+                max_retries=0, # retried by retry_agent
+                callbacks=self.get_callbacks(provider, final_key, final_model),
             )
         if provider == "groq":
             return ChatGroq(
                 model=final_model,
                 temperature=final_temp,
                 api_key=final_key,
-                callbacks=self.get_callbacks(),
+                max_retries=0, # retried by retry_agent
+                callbacks=self.get_callbacks(provider, final_key, final_model),
             )
         
         raise TypeError(f"unsupported provider: {provider}")
 
+    def get_cassette_model(self, config: Optional[dict] = None) -> BaseChatModel:
+        """
+        The record/replay stand-in of AgentSettings.cassette. Recording asks the real model cassette.model,
+        replaying needs neither API keys nor network.
+        """
+        cassette = self.cfgs.cassette
+        _, _, path = self.model_name.partition(":")
+        inner = None
+        if cassette.mode != "replay":
+            cfg = dict(config or {})
+            metadata = dict(cfg.get("metadata", {}))
+            metadata["x_auth"] = {k: v for k, v in metadata.get("x_auth", {}).items() if k not in ("provider", "model")}
+            inner = self.model_copy(update={"model_name": cassette.model}).get_model({**cfg, "metadata": metadata})
+        return CassetteChatModel(
+            cassette_path=path or cassette.path,
+            mode=cassette.mode,
+            latency=cassette.latency,
+            recorded_latency=cassette.recorded_latency,
+            inner=inner,
+            callbacks=self.get_callbacks("cassette", None, path or cassette.path),
+        )
+
+    def stream_chain(self, chain:Runnable, input:dict, config:dict, block_type:Optional[str] = None, expected_hashes:Optional[List[str]] = None) -> str:
+        """
+        Stream the output of a chain and stop early once every expected HASH block has been received.
+        args:
+            chain: chain that outputs a string
+            block_type: One of ["code", "report"], None for free text that is always consumed completely
+            expected_hashes: the HASHes of all blocks that the answer should contain
+        returns:
+            the text received until the request was finished or cancelled
+        """
+        extractor = StreamingBlockExtractor(block_type, expected_hashes if block_type else None)
+        stream = chain.stream(input=input, config=config)
+        try:
+            for chunk in stream:
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    raise RequestCancelled("cancelled, the hedged duplicate answered first")
+                for block in extractor.feed(chunk):
+                    logger.info(f"Received {block_type} block for HASH {next(iter(block))} after {len(extractor.text)} characters")
+                if extractor.complete:
+                    logger.info("All expected HASHes received, cancelling the rest of the completion")
+                    break
+        finally:
+            close = getattr(stream, "close", None)
+            if close: # closing the generator cancels the underlying request
+                close()
+        return extractor.text
+
+    def invoke_structured(self, prompt:Runnable, llm:BaseChatModel, input:dict, config:dict, block_type:Literal["code", "report"], hashes:List[str]) -> Optional[str]:
+        """
+        Ask for the blocks through the provider's structured output (tool calling) with a schema that has one
+        property per HASH, so the answer is valid by construction. The blocks are returned in the usual fenced
+        form for _find_all_blocks, None if the provider does not support it or the call failed.
+        """
+        try:
+            structured_llm = llm.with_structured_output(_structured_schema(block_type, hashes))
+            data = (prompt | structured_llm).invoke(input, config=config)
+        except Exception as e:
+            logger.warning(f"Structured output failed, falling back to free text: {type(e).__name__}: {e}")
+            return None
+        if not isinstance(data, dict):
+            logger.warning(f"Structured output returned {type(data).__name__}, falling back to free text")
+            return None
+        missing = [hash_value for hash_value in hashes if hash_value not in data]
+        if missing:
+            logger.warning(f"Structured output is missing the HASHes {missing}")
+        return _format_blocks(block_type, {hash_value: data[hash_value] for hash_value in hashes if hash_value in data})
+
+    def invoke_hedged(self, agent_type:Literal["simple","doublechain"], prompt_type:str, input:Dict[str,str], config:Dict[str,str]) -> Tuple[str, str, str]:
+        """
+        Invoke the agent, and a duplicate on the secondary provider/model of AgentSettings.hedge if the call is
+        slower than usual. The first answer with code blocks wins, the other call is cancelled.
+        """
+        hedge = self.cfgs.hedge
+        xauth:dict = (config or {}).get("metadata", {}).get("x_auth", {})
+        def invoke(executor:"LangdaAgentExecutor", config:dict):
+            if agent_type == "simple":
+                return executor.invoke_simple_agent(prompt_type, input, config)
+            return executor.invoke_doublechain_agent(prompt_type, input, config)
+        if not hedge.model or xauth.get("source") == "api": # no secondary, or no key of ours for BYOK calls
+            return invoke(self, config)
+
+        primary = self.model_copy(update={"cancel_event": threading.Event()})
+        secondary = self.model_copy(update={"model_name": hedge.model, "cancel_event": threading.Event()})
+        secondary_auth = {"model": hedge.model, **({"provider": hedge.provider} if hedge.provider else {})}
+        secondary_config = {**config, "metadata": {**config.get("metadata", {}), "x_auth": secondary_auth}}
+        return hedged_call(
+            key=(*self._circuit_key(config), agent_type, prompt_type),
+            primary=lambda: invoke(primary, config),
+            secondary=lambda: invoke(secondary, secondary_config),
+            primary_cancel=primary.cancel_event,
+            secondary_cancel=secondary.cancel_event,
+            is_valid=lambda result: bool(_find_all_blocks("code", result[0])),
+            percentile=hedge.percentile,
+            delay=hedge.delay,
+            min_samples=hedge.min_samples,
+            max_ratio=hedge.max_ratio,
+            max_hedges=hedge.max_hedges,
+        )
+
+    def cache_friendly_prompt(self, template:str, dynamic_vars:List[str], role_prompt:str, scratchpad:bool = False) -> ChatPromptTemplate:
+        """
+        Lay out a prompt so that its leading tokens are the same across runs, blocks and prompt types:
+        the shared system prompt and the syntax notes, then the static instructions of the prompt type,
+        then the per-run content of dynamic_vars (the program, the requirements) in the last message.
+        """
+        instructions = template
+        sections = []
+        for var in dynamic_vars:
+            instructions = instructions.replace("{" + var + "}", f"(see <{var}> at the end)")
+            sections.append(f"<{var}>\n{{{var}}}\n</{var}>")
+        messages = [
+            ("system", _SHARED_SYSTEM_PROMPT + "\n\n" + _escape_braces(_syntax_notes())),
+            ("human", role_prompt + "\n\n" + instructions),
+            ("human", "\n\n".join(sections)),
+        ]
+        if scratchpad:
+            messages.append(("assistant", "{agent_scratchpad}"))
+        return ChatPromptTemplate.from_messages(messages)
+
+    def limit_tools(self, tools:List[BaseTool]) -> List[BaseTool]:
+        """
+        The tools with their quotas: calls of a tool with a quota are counted per invocation, a call beyond
+        the quota is not run and tells the model to answer with what it has. Tools without a quota are kept as they are.
+        """
+        counts:Dict[str, int] = {}
+        def guarded(tool:BaseTool, quota:int):
+            def call(*args, **kwargs):
+                counts[tool.name] = counts.get(tool.name, 0) + 1
+                if counts[tool.name] > quota:
+                    logger.info(f"Quota of {tool.name} exhausted ({quota} calls)")
+                    return f"The quota of {tool.name} ({quota} calls) is exhausted. Do not call it again, answer with the information you have."
+                # no callbacks, the run of the wrapper is the one that is logged and metered
+                return tool.invoke(args[0] if args else kwargs, config={"callbacks": []})
+            return call
+        limited:List[BaseTool] = []
+        for tool in tools:
+            quota = self.tool_quotas.get(tool.name)
+            if quota is None:
+                limited.append(tool)
+            elif isinstance(tool, Tool):
+                limited.append(Tool(name=tool.name, description=tool.description, func=guarded(tool, quota)))
+            else:
+                limited.append(StructuredTool.from_function(func=guarded(tool, quota), name=tool.name,
+                                                            description=tool.description, args_schema=tool.args_schema))
+        return limited
+
+    def force_final_answer(self, prompt:ChatPromptTemplate, llm:BaseChatModel, input:dict, steps:list, config:dict) -> str:
+        """One last call without tools when the tool-calling loop ran out of iterations or time"""
+        messages = prompt.format_messages(**{**input, "agent_scratchpad": format_to_tool_messages(steps)})
+        messages.append(HumanMessage("The budget for tool calls is exhausted. Do not call any tools, "
+                                     "give your final answer now with the information you have."))
+        return StrOutputParser().invoke(llm.invoke(messages, config=config))
+
     # ========================= SIMPLE AGRNT ========================= #
     @retry_agent(max_attempts=3)
     def invoke_simple_agent(self, prompt_type:str, input:Dict[str,str], config:Dict[str,str], ext_prompt=False) -> str:
@@ -220,10 +517,14 @@ class LangdaAgentExecutor(BaseModel):
             raw_prompt_template = self.load_prompt(prompt_type, "simple")
         else:
             raw_prompt_template = prompt_type
-        chatprompt_template = ChatPromptTemplate.from_messages([
-            ("system", "You are an expert programmer proficient in Problog and DeepProbLog. You could complete the task with your knowledge."),
-            ("human", raw_prompt_template)
-        ])
+        system_prompt = "You are an expert programmer proficient in Problog and DeepProbLog. You could complete the task with your knowledge."
+        if self.prefix_cache_layout and prompt_type != "final_test":
+            chatprompt_template = self.cache_friendly_prompt(raw_prompt_template, ["input"], system_prompt)
+        else:
+            chatprompt_template = ChatPromptTemplate.from_messages([
+                ("system", system_prompt),
+                ("human", raw_prompt_template)
+            ])
         if not(prompt_type == "final_test"):
             simple_input = {"input":input["prompt_template"]}
         else:
@@ -233,7 +534,12 @@ class LangdaAgentExecutor(BaseModel):
 
         new_llm = self.get_model(config)
         chain:Runnable = chatprompt_template | new_llm | StrOutputParser()
-        result = chain.invoke(input=simple_input, config=config)
+        block_type = {"generate": "code", "regenerate": "code", "evaluate": "report"}.get(prompt_type)
+        result = None
+        if self.structured_output and block_type and input.get("expected_hashes"):
+            result = self.invoke_structured(chatprompt_template, new_llm, simple_input, config, block_type, input["expected_hashes"])
+        if result is None:
+            result = self.stream_chain(chain, simple_input, config, block_type, input.get("expected_hashes"))
         logger.info("### ====================== End of simple_agent ====================== ###")
         return result, formatted_prompt, ""
     
@@ -297,7 +603,10 @@ class LangdaAgentExecutor(BaseModel):
             ("human", first_chain_prompt_template),
             ("assistant", "{agent_scratchpad}")  # where tool outputs and thoughts will appear
         ]
-        first_chain_prompt = ChatPromptTemplate.from_messages(prompt_msgs)
+        if self.prefix_cache_layout:
+            first_chain_prompt = self.cache_friendly_prompt(first_chain_prompt_template, ["input"], system_prompt[1], scratchpad=True)
+        else:
+            first_chain_prompt = ChatPromptTemplate.from_messages(prompt_msgs)
         first_formatted_prompt = first_chain_prompt.format_prompt(**first_input).to_string()
         # Create the model for generation
 
@@ -308,11 +617,26 @@ class LangdaAgentExecutor(BaseModel):
             format_chain_first = first_chain_prompt | new_llm | StrOutputParser()
             first_result = format_chain_first.invoke(input=first_input, config=config)
         elif prompt_type == "generate" or prompt_type == "regenerate":
-            agent = create_tool_calling_agent(new_llm, self.tools, first_chain_prompt)
-            agent_executor = AgentExecutor(agent=agent, tools=self.tools, verbose=True)
+            tools = sorted(self.tools, key=lambda tool: tool.name) if self.prefix_cache_layout else self.tools # same tool definitions prefix
+            tools = self.limit_tools(tools) if self.tool_quotas else tools
+            agent = create_tool_calling_agent(new_llm, tools, first_chain_prompt)
+            agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True, return_intermediate_steps=True,
+                                           max_iterations=self.max_iterations, max_execution_time=self.max_execution_time)
             # Execute the first chain
-            first_result_raw = agent_executor.invoke(input=first_input, config=config)
+            collector = current_metrics()
+            tool_events = collector.count("tool") if collector is not None else 0
+            first_result_raw = agent_executor.invoke(input=first_input, config=self.tool_run_config(config))
             first_result = first_result_raw.get("output", "")
+            steps = first_result_raw.get("intermediate_steps", [])
+            stopped = first_result.startswith("Agent stopped due to") # early_stopping_method "force"
+            if stopped:
+                logger.warning(f"Tool-calling loop stopped after {len(steps)} tool calls, forcing a final answer")
+                first_result = self.force_final_answer(first_chain_prompt, new_llm, first_input, steps, config)
+            tool_counts = dict(Counter(action.tool for action, _ in steps))
+            logger.info(f"Tool calls of the first chain: {len(steps)} {tool_counts}")
+            record("tool_turns", prompt_type, turns=len(steps), tools=tool_counts, stopped=stopped)
+            if collector is not None and collector.count("tool") - tool_events < len(steps):
+                logger.warning(f"Only {collector.count('tool') - tool_events} of {len(steps)} tool calls were recorded in the metrics")
         # *** CASE2: Test double chain with tools: *** #
         # agent = create_tool_calling_agent(new_llm, self.tools, first_chain_prompt)
         # agent_executor = AgentExecutor(agent=agent, tools=self.tools, verbose=True)
@@ -326,16 +650,33 @@ class LangdaAgentExecutor(BaseModel):
             pattern = r"```(?:problog|[a-z]*)?\n(.*?)```"
             matches = re.findall(pattern, first_result, re.DOTALL)
             extracted_result = matches[-1]
+            if self.local_format:
+                local_result = _local_format_code(input["prompt_template"], extracted_result, input.get("expected_hashes"))
+                _count_local_format(local_result is not None)
+                if local_result is not None:
+                    logger.info(f"*** Generated New Code (local formatter) ***\n{local_result}")
+                    logger.info("### ====================== End of doublechain_agent ====================== ###")
+                    return local_result, first_formatted_prompt + "\n\n**split**\n\n(formatted locally)", extracted_result
+                logger.info("Local formatter could not align the code unambiguously, using the second chain")
         second_input = {
             "template_code": input["prompt_template"],
             "first_chain_output": extracted_result.strip()
         }
-        second_chain_prompt = PromptTemplate.from_template(second_chain_prompt_template)
+        if self.prefix_cache_layout:
+            second_chain_prompt = self.cache_friendly_prompt(second_chain_prompt_template, ["template_code", "first_chain_output"],
+                                                             "Format the code of the first chain into the blocks of the template.")
+        else:
+            second_chain_prompt = PromptTemplate.from_template(second_chain_prompt_template)
         second_formatted_prompt = second_chain_prompt.format_prompt(**second_input).to_string()
         # Execute the second chain
         logger.info("Executing second chain: Code formatting...")
         format_chain = second_chain_prompt | new_llm | StrOutputParser()
-        second_result = format_chain.invoke(input=second_input, config=config)
+        block_type = "report" if prompt_type == "evaluate" else "code"
+        second_result = None
+        if self.structured_output and input.get("expected_hashes"):
+            second_result = self.invoke_structured(second_chain_prompt, new_llm, second_input, config, block_type, input["expected_hashes"])
+        if second_result is None:
+            second_result = self.stream_chain(format_chain, second_input, config, block_type, input.get("expected_hashes"))
         logger.info(f"*** Generated New Code ***\n{second_result}")
         logger.info("### ====================== End of doublechain_agent ====================== ###")
         return second_result, first_formatted_prompt + "\n\n**split**\n\n" + second_formatted_prompt, extracted_result
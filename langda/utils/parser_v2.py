@@ -2,7 +2,7 @@ import re
 from enum import Enum
 from typing import List, Tuple
 from typing_extensions import TypedDict
-from .format_tools import _compute_short_md5
+from .format_tools import _compute_short_hash
 
 # from problog.program import PrologString
 # from problog.logic import Term, Var, Constant, Clause, AnnotatedDisjunction, And, Or, Not, AggTerm, list2term, term2list, is_list
@@ -358,13 +358,14 @@ class Parser(object):
         return result_dict
 
 
-    def replace_langda_and_lann_terms(self,text_list:List[Tuple[str, str, str]], placeholder="{{LANGDA}}") -> Tuple[List[str],List[dict],List[LangdaDict]]:
+    def replace_langda_and_lann_terms(self,text_list:List[Tuple[str, str, str]], placeholder="{{LANGDA}}", digest_size:int=4) -> Tuple[List[str],List[dict],List[LangdaDict]]:
         """
         Replace langda and lann predicates in the given text list.
         And store informations in dictonary
         Args:
             text_list: List of tuples (code, comment, predicate_status)
                     where predicate_status can be "NONE", "BODY", or "END."
+            digest_size: digest size of the HASH in bytes, the HASH has 2*digest_size characters
         It calls the function: self._parse_lann_or_langda_content_to_dicts()
         Returns:
             Tuple of (modified text list, lann_dicts, langda_dicts)
@@ -482,9 +483,9 @@ class Parser(object):
                     langda_dict_content_for_hash = self.clean_result_fields(
                         langda_dict_content, 
                         ["HEAD", "LOT", "NET", "LLM"])
-                    langda_md5_digits = _compute_short_md5(8,langda_dict_content_for_hash, upper=True)
+                    langda_hash_digits = _compute_short_hash(2*digest_size, langda_dict_content_for_hash, upper=True, digest_size=digest_size)
 
-                    langda_dict_content["HASH"] = langda_md5_digits
+                    langda_dict_content["HASH"] = langda_hash_digits
                     langda_dicts.append(langda_dict_content)
 
                     # Filter out empty comments before joining
@@ -507,8 +508,8 @@ class Parser(object):
         # return [item[0] for item in text_list_copy], lann_dict, langda_dicts
 
 # =============================== FINAL PARSER API =============================== #
-def integrated_code_parser(text:str, placeholder) -> Tuple[str, List[dict], List[LangdaDict], bool]:
+def integrated_code_parser(text:str, placeholder, digest_size:int=4) -> Tuple[str, List[dict], List[LangdaDict], bool]:
     parser = Parser()
     text_list, has_query = parser.get_dense_code_with_comments(text)
-    result_text, lann_dicts, langda_dicts = parser.replace_langda_and_lann_terms(text_list, placeholder)
+    result_text, lann_dicts, langda_dicts = parser.replace_langda_and_lann_terms(text_list, placeholder, digest_size)
     return "\n".join(result_text), lann_dicts, langda_dicts, has_query
\ No newline at end of file
@@ -0,0 +1,132 @@
+import json
+import zlib
+import struct
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional
+
+import numpy as np
+from problog.logic import Term
+
+_MAGIC = b"LPR1"
+_HEADER = struct.Struct("<4sII") # magic, number of queries, length of the compressed metadata
+
+class ProblogResult(NamedTuple):
+    """
+    The complete result of one ProbLog evaluation.
+    probabilities holds one value per query, the lower bound if the query has bounds in upper.
+    A failed evaluation has no queries and the error text in error.
+    """
+    queries: List[Term]
+    probabilities: np.ndarray
+    upper: Optional[np.ndarray] = None # upper bounds of approximate inference, None if every value is exact
+    method: str = "exact" # "exact", "bounds" or "sample"
+    note: str = "" # shown in the header of the rendering, e.g. "sample estimate"
+    samples: Optional[int] = None # accepted samples of a sample estimate
+    error: Optional[str] = None
+    warnings: str = "" # appended to the rendering, e.g. from the static validation
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @classmethod
+    def failure(cls, error:str) -> "ProblogResult":
+        return cls([], np.zeros(0), error=error)
+
+    @classmethod
+    def from_evaluation(cls, results:Mapping[Term, Any], note:str = "") -> "ProblogResult":
+        """From evaluatable.evaluate(), whose values are floats or (lower, upper) for k-best"""
+        queries = list(results)
+        values = [results[query] for query in queries]
+        lower = np.array([value[0] if isinstance(value, tuple) else value for value in values], dtype=np.float64)
+        upper = np.array([value[1] if isinstance(value, tuple) else value for value in values], dtype=np.float64)
+        if np.all(upper - lower <= 1e-6):
+            return cls(queries, lower, note=note)
+        return cls(queries, lower, upper, method="bounds", note=note)
+
+    @classmethod
+    def from_estimates(cls, estimates:Mapping[Term, float], samples:int, note:str = "sample estimate") -> "ProblogResult":
+        queries = list(estimates)
+        return cls(queries, np.array([estimates[query] for query in queries], dtype=np.float64),
+                   method="sample", note=note, samples=samples)
+
+    def as_dict(self) -> Dict[Term, Any]:
+        """{query: probability}, (lower, upper) for queries with bounds, like evaluatable.evaluate()"""
+        if self.upper is None:
+            return dict(zip(self.queries, self.probabilities.tolist()))
+        return {query: (lower if upper - lower <= 1e-6 else (lower, upper))
+                for query, lower, upper in zip(self.queries, self.probabilities.tolist(), self.upper.tolist())}
+
+    def get(self, query:Term | str, default:Any = None) -> Any:
+        query = Term.from_string(query) if isinstance(query, str) else query
+        return self.as_dict().get(query, default)
+
+    def _format(self, idx:int) -> str:
+        lower = self.probabilities[idx]
+        if self.upper is not None and self.upper[idx] - lower > 1e-6:
+            return f"= [{lower:.4f}, {self.upper[idx]:.4f}]"
+        return f"{'≈' if self.method == 'sample' else '='} {lower:.4f}"
+
+    def render(self, limit:Optional[int] = 20) -> str:
+        """
+        Text for prompts and result files.
+        args:
+            limit: number of query lines, the rest is elided; None for all of them
+        """
+        if not self.ok:
+            text = self.error
+        else:
+            note = self.note or ("[lower, upper] bounds where inference did not converge" if self.method == "bounds" else "")
+            header = f"% Problog Inference Result ({note})：" if note else "% Problog Inference Result："
+            lines = [f"{query} {self._format(idx)}" for idx, query in enumerate(self.queries)]
+            if limit is not None and len(lines) > limit:
+                text = header + "\n" + "\n".join(lines[:limit]) + "\n ...<other results>... "
+            else:
+                text = header + "\n" + "\n".join(lines)
+        if self.warnings:
+            text += "\n" + self.warnings
+        return text
+
+    def __str__(self) -> str:
+        return self.render()
+
+    def to_bytes(self) -> bytes:
+        """
+        Compact binary form: a fixed header, zlib-compressed JSON metadata (query terms as text) and the
+        probabilities (and upper bounds) as little-endian float64.
+        """
+        meta = zlib.compress(json.dumps({
+            "queries": [str(query) for query in self.queries],
+            "method": self.method,
+            "note": self.note,
+            "samples": self.samples,
+            "error": self.error,
+            "warnings": self.warnings,
+            "bounds": self.upper is not None,
+        }, ensure_ascii=False).encode("utf-8"))
+        parts = [_HEADER.pack(_MAGIC, len(self.queries), len(meta)), meta, self.probabilities.astype("<f8").tobytes()]
+        if self.upper is not None:
+            parts.append(self.upper.astype("<f8").tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data:bytes) -> "ProblogResult":
+        magic, count, meta_size = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not a serialized ProblogResult")
+        offset = _HEADER.size
+        meta = json.loads(zlib.decompress(data[offset:offset + meta_size]).decode("utf-8"))
+        offset += meta_size
+        arrays:List[np.ndarray] = []
+        for _ in range(2 if meta["bounds"] else 1):
+            arrays.append(np.frombuffer(data, dtype="<f8", count=count, offset=offset).astype(np.float64))
+            offset += 8 * count
+        return cls(
+            queries=[Term.from_string(query) for query in meta["queries"]],
+            probabilities=arrays[0],
+            upper=arrays[1] if meta["bounds"] else None,
+            method=meta["method"],
+            note=meta["note"],
+            samples=meta["samples"],
+            error=meta["error"],
+            warnings=meta["warnings"],
+        )
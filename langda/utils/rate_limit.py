@@ -0,0 +1,216 @@
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from pydantic import BaseModel, Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from langchain_core.callbacks import BaseCallbackHandler
+
+from ..metrics import llm_usage
+
+try:
+    import fcntl
+except ImportError: # not on Windows, the limiter is process-wide there
+    fcntl = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+class ProviderLimits(BaseModel):
+    rpm: Optional[float] = None # requests per minute
+    tpm: Optional[float] = None # tokens (prompt + completion) per minute
+
+class RateLimitSettings(BaseSettings):
+    """
+    Request and token rate of the LLM calls per provider and API key, supports environment variable overrides.
+    Without any rpm/tpm the calls are not limited.
+    """
+    rpm: Optional[float] = Field(default=None, description="Requests per minute of every provider")
+    tpm: Optional[float] = Field(default=None, description="Tokens per minute of every provider")
+    providers: Dict[str, ProviderLimits] = Field(default_factory=dict, description="Limits per provider, e.g. {\"openai\": {\"rpm\": 500}}")
+    lock_dir: Optional[str] = Field(default=None, description="Directory of the shared bucket files, limits across processes if set")
+    completion_tokens: int = Field(default=1024, description="Completion tokens assumed before a call when max_tokens is not set")
+    max_wait: float = Field(default=600.0, description="Longest wait for capacity before a call fails")
+    model_config = SettingsConfigDict(
+        env_prefix="LANGDA_RATE_LIMIT_",
+        env_file=".env",
+        extra="ignore",
+    )
+
+    def limits_for(self, provider:str) -> ProviderLimits:
+        limits = self.providers.get(provider, ProviderLimits())
+        return ProviderLimits(rpm=limits.rpm or self.rpm, tpm=limits.tpm or self.tpm)
+
+class RateLimitTimeout(TimeoutError):
+    """No capacity was free within max_wait"""
+
+def estimate_tokens(text:str) -> int:
+    """Rough token count of a text, about four characters per token"""
+    return len(text) // 4 + 1
+
+class RateLimiter:
+    """
+    Two token buckets, for requests and for tokens, each refilled continuously up to its per-minute limit.
+    acquire() blocks until both hold enough for the call. With a state_path the buckets live in a file
+    guarded by an exclusive lock, so every process with the same lock_dir shares them.
+    """
+
+    def __init__(self, name:str, limits:ProviderLimits, state_path:Optional[Path] = None):
+        self.name = name
+        self.capacity = {"requests": limits.rpm, "tokens": limits.tpm}
+        self.state_path = state_path if fcntl is not None else None
+        self._state:Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.metrics:Dict[str, float] = {"queue_depth": 0, "max_queue_depth": 0, "acquired": 0, "waited": 0,
+                                         "wait_seconds": 0.0, "max_wait_seconds": 0.0, "tokens_estimated": 0, "tokens_used": 0}
+
+    def _refill(self, state:Dict[str, float], now:float) -> Dict[str, float]:
+        elapsed = max(0.0, now - state.get("updated", now))
+        refilled = {"updated": now}
+        for bucket, capacity in self.capacity.items():
+            if capacity is not None:
+                refilled[bucket] = min(capacity, state.get(bucket, capacity) + elapsed * capacity / 60)
+        return refilled
+
+    def _update(self, change) -> Any:
+        """Apply change(state) -> (state, result) to the refilled buckets atomically, across processes if shared"""
+        with self._lock:
+            if self.state_path is None:
+                self._state, result = change(self._refill(self._state, time.time()))
+                return result
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.state_path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read() or "{}")
+                    except ValueError:
+                        state = {}
+                    state, result = change(self._refill(state, time.time()))
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                return result
+
+    def _try_take(self, tokens:int):
+        """Take one request and the tokens if both buckets hold enough, else the seconds until they will"""
+        def change(state):
+            needed = {"requests": 1, "tokens": tokens}
+            wait = 0.0
+            for bucket, capacity in self.capacity.items():
+                if capacity is None:
+                    continue
+                missing = min(needed[bucket], capacity) - state[bucket] # more than the capacity never fits, take it all
+                if missing > 0:
+                    wait = max(wait, missing * 60 / capacity)
+            if wait == 0.0:
+                for bucket, capacity in self.capacity.items():
+                    if capacity is not None:
+                        state[bucket] -= needed[bucket]
+            return state, wait
+        return self._update(change)
+
+    def acquire(self, tokens:int, max_wait:float = 600.0) -> float:
+        """
+        Block until the call may start.
+        args:
+            tokens: estimated prompt and completion tokens of the call
+        returns:
+            the seconds waited
+        """
+        start = time.monotonic()
+        slept = False
+        with self._metrics_lock:
+            self.metrics["queue_depth"] += 1
+            self.metrics["max_queue_depth"] = max(self.metrics["max_queue_depth"], self.metrics["queue_depth"])
+        try:
+            while True:
+                wait = self._try_take(tokens)
+                if wait == 0.0:
+                    break
+                waited = time.monotonic() - start
+                if waited + wait > max_wait:
+                    raise RateLimitTimeout(f"Rate limit of {self.name}: no capacity for {tokens} tokens within {max_wait:.0f}s")
+                time.sleep(min(wait, 1.0)) # re-check, other processes may have settled their usage
+                slept = True
+        finally:
+            waited = time.monotonic() - start
+            with self._metrics_lock:
+                self.metrics["queue_depth"] -= 1
+        with self._metrics_lock:
+            self.metrics["acquired"] += 1
+            self.metrics["tokens_estimated"] += tokens
+            if slept:
+                self.metrics["waited"] += 1
+                self.metrics["wait_seconds"] += waited
+                self.metrics["max_wait_seconds"] = max(self.metrics["max_wait_seconds"], waited)
+        if slept:
+            logger.info(f"Rate limit of {self.name}: waited {waited:.2f}s for {tokens} tokens")
+        return waited
+
+    def settle(self, estimated:int, actual:int) -> None:
+        """Correct the token bucket by the difference between the estimate and the tokens the call really used"""
+        with self._metrics_lock:
+            self.metrics["tokens_used"] += actual
+        if self.capacity["tokens"] is None or actual == estimated:
+            return
+        def change(state):
+            state["tokens"] = state["tokens"] + estimated - actual # may go below zero, later calls wait longer
+            return state, None
+        self._update(change)
+
+_limiters:Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider:str, api_key:str, settings:Optional[RateLimitSettings] = None) -> Optional[RateLimiter]:
+    """The limiter shared by every call with this provider and API key, None if the provider is not limited"""
+    settings = settings or RateLimitSettings()
+    limits = settings.limits_for(provider)
+    if limits.rpm is None and limits.tpm is None:
+        return None
+    key_id = hashlib.blake2b(api_key.encode("utf-8"), digest_size=6).hexdigest() # the key itself is never stored
+    with _limiters_lock:
+        if (provider, key_id) not in _limiters:
+            state_path = Path(settings.lock_dir) / f"{provider}_{key_id}.json" if settings.lock_dir else None
+            _limiters[(provider, key_id)] = RateLimiter(f"{provider}/{key_id}", limits, state_path)
+        return _limiters[(provider, key_id)]
+
+def rate_limiter_stats() -> Dict[str, Dict[str, float]]:
+    """Queue depth, waits and tokens of every limiter of this process"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: dict(limiter.metrics) for limiter in limiters}
+
+class RateLimitCallback(BaseCallbackHandler):
+    """Acquire from the limiter before every chat model call of a model and settle the real usage after it"""
+    raise_error = True # a RateLimitTimeout has to stop the call
+
+    def __init__(self, limiter:RateLimiter, settings:RateLimitSettings):
+        self.limiter = limiter
+        self.settings = settings
+        self._estimates:Dict[UUID, int] = {}
+
+    def on_chat_model_start(self, serialized:Dict[str, Any], messages:List[List[Any]], *, run_id:UUID, **kwargs:Any) -> None:
+        prompt = sum(estimate_tokens(str(message.content)) for batch in messages for message in batch)
+        completion = (kwargs.get("invocation_params") or {}).get("max_tokens") or self.settings.completion_tokens
+        self._estimates[run_id] = prompt + completion
+        self.limiter.acquire(prompt + completion, self.settings.max_wait)
+
+    def on_llm_end(self, response, *, run_id:UUID, **kwargs:Any) -> None:
+        estimated = self._estimates.pop(run_id, None)
+        usage = llm_usage(response)
+        actual = usage["prompt_tokens"] + usage["completion_tokens"]
+        if estimated is not None and actual:
+            self.limiter.settle(estimated, actual)
+
+    def on_llm_error(self, error:BaseException, *, run_id:UUID, **kwargs:Any) -> None:
+        self._estimates.pop(run_id, None)
@@ -0,0 +1,176 @@
+import re
+import time
+import random
+import threading
+from typing import Dict, Literal, Optional, Tuple
+
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+import openai
+try:
+    import groq
+except ImportError: # groq is only needed for the groq models
+    groq = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+class RetrySettings(BaseSettings):
+    """Backoff of the LLM calls and the circuit breaker per provider and model, supports environment variable overrides"""
+    base_delay: float = Field(default=1.0, description="Backoff of the first retry in seconds, doubled on every attempt")
+    max_delay: float = Field(default=60.0, description="Upper bound of one backoff, also for Retry-After")
+    failure_threshold: int = Field(default=5, description="Consecutive transient failures that open the circuit")
+    reset_timeout: float = Field(default=30.0, description="Seconds the circuit stays open before a trial call")
+    model_config = SettingsConfigDict(
+        env_prefix="LANGDA_RETRY_",
+        env_file=".env",
+        extra="ignore",
+    )
+
+class CircuitOpenError(RuntimeError):
+    """The provider failed repeatedly, calls fail fast until the circuit is half-open again"""
+
+ErrorKind = Literal["fatal", "rate_limit", "retryable"]
+
+def _sdk_errors(*names:str) -> Tuple[type, ...]:
+    """The exception classes of the provider SDKs (openai also serves DeepSeek) with these names"""
+    return tuple(getattr(module, name) for module in (openai, groq) if module is not None for name in names if hasattr(module, name))
+
+_FATAL_ERRORS = _sdk_errors("AuthenticationError", "PermissionDeniedError", "BadRequestError", "NotFoundError", "UnprocessableEntityError")
+_RATE_LIMIT_ERRORS = _sdk_errors("RateLimitError")
+_TRANSIENT_ERRORS = _sdk_errors("APITimeoutError", "APIConnectionError", "InternalServerError", "ConflictError")
+_PROVIDER_ERRORS = _sdk_errors("APIError") # base of the status and connection errors
+
+def classify_error(error:BaseException) -> ErrorKind:
+    """
+    fatal: the request cannot succeed (authentication, invalid request, unknown model, configuration errors)
+    rate_limit: the provider asks us to slow down (429)
+    retryable: anything else, e.g. timeouts, connection errors, 5xx or unparsable answers
+    """
+    if getattr(error, "retryable", None) is False: # e.g. a prompt missing from a replay cassette
+        return "fatal"
+    if isinstance(error, _RATE_LIMIT_ERRORS):
+        return "rate_limit"
+    if isinstance(error, _FATAL_ERRORS) or isinstance(error, (TypeError, NotImplementedError, FileExistsError)):
+        return "fatal"
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return "retryable"
+    status = getattr(error, "status_code", None) # other SDK status errors
+    if status == 429:
+        return "rate_limit"
+    if isinstance(status, int) and 400 <= status < 500 and status not in (408, 409):
+        return "fatal"
+    return "retryable"
+
+def is_provider_error(error:BaseException) -> bool:
+    """
+    Whether the error comes from the provider or the transport to it. Only these count towards the circuit
+    breaker, an unusable answer or a local error (rate limiter, parsing) says nothing about the provider's health.
+    """
+    return isinstance(error, _PROVIDER_ERRORS) or isinstance(getattr(error, "status_code", None), int)
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def _parse_duration(value:str) -> Optional[float]:
+    """Seconds of '12', '1.5' or of the rate-limit reset format like '6m0s', '20ms'"""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    return sum(float(number) * _UNITS[unit] for number, unit in parts) if parts else None
+
+def retry_after(error:BaseException) -> Optional[float]:
+    """Seconds to wait according to the Retry-After (or rate-limit reset) headers of the response, None if there are none"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if headers.get("retry-after"):
+        seconds = _parse_duration(headers["retry-after"])
+        if seconds is not None:
+            return seconds
+        try: # HTTP date
+            from email.utils import parsedate_to_datetime
+            return max(0.0, parsedate_to_datetime(headers["retry-after"]).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    resets = [_parse_duration(headers[name]) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens") if headers.get(name)]
+    resets = [seconds for seconds in resets if seconds is not None]
+    return max(resets) if resets else None
+
+def backoff_delay(attempt:int, error:BaseException, settings:RetrySettings) -> float:
+    """Full-jitter exponential backoff, at least as long as the provider asked for"""
+    delay = random.uniform(0, min(settings.max_delay, settings.base_delay * 2 ** attempt))
+    requested = retry_after(error)
+    if requested is not None:
+        delay = max(delay, requested + random.uniform(0, settings.base_delay))
+    return min(delay, settings.max_delay)
+
+class CircuitBreaker:
+    """
+    Shared by every call to one provider and model. After failure_threshold consecutive transient failures
+    the circuit opens and calls fail fast with CircuitOpenError. After reset_timeout one trial call is let
+    through (half-open), its success closes the circuit, its failure opens it again. A trial that ends
+    without telling either (cancelled, fatal or local error) opens the circuit again as well, so the next
+    trial follows after another reset_timeout instead of the circuit staying half-open.
+    """
+
+    def __init__(self, name:str, failure_threshold:int, reset_timeout:float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state:Literal["closed", "open", "half_open"] = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == "closed":
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open" # this call is the trial
+                logger.info(f"Circuit of {self.name} half-open, trying one call")
+                return
+            raise CircuitOpenError(f"{self.name} is unavailable after {self.failures} consecutive failures, "
+                                   f"failing fast for another {max(remaining, 0):.0f} s")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"Circuit of {self.name} closed again")
+            self.state, self.failures = "closed", 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.error(f"Circuit of {self.name} opened after {self.failures} consecutive failures")
+                self.state, self.opened_at = "open", time.monotonic()
+
+    def abandon_trial(self) -> None:
+        with self._lock:
+            if self.state == "half_open":
+                logger.info(f"Trial call of {self.name} ended without a result, circuit open again")
+                self.state, self.opened_at = "open", time.monotonic()
+
+_breakers:Dict[Tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(provider:str, model:str, settings:Optional[RetrySettings] = None) -> CircuitBreaker:
+    with _breakers_lock:
+        if (provider, model) not in _breakers:
+            settings = settings or RetrySettings()
+            _breakers[(provider, model)] = CircuitBreaker(f"{provider}/{model}", settings.failure_threshold, settings.reset_timeout)
+        return _breakers[(provider, model)]
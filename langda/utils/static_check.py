@@ -0,0 +1,243 @@
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from problog.engine import DefaultEngine
+from problog.program import PrologString
+from problog.errors import ProbLogError
+from problog.logic import Clause, AnnotatedDisjunction, Term, Var, Constant, Not, And, Or
+
+import logging
+logger = logging.getLogger(__name__)
+
+# goals whose arguments are goals themselves: functor/arity -> argument positions
+_CONTROL_ARGS:Dict[Tuple[str, int], Tuple[int, ...]] = {
+    ("->", 2): (0, 1),
+    ("*->", 2): (0, 1),
+    ("\\+", 1): (0,),
+    ("not", 1): (0,),
+    ("call", 1): (0,),
+    ("once", 1): (0,),
+    ("forall", 2): (0, 1),
+    ("findall", 3): (1,),
+    ("findall", 4): (1,),
+    ("all", 3): (1,),
+    ("aggregate_all", 3): (1,),
+}
+# facts that are directives for problog, not predicate definitions
+_DIRECTIVES = {("query", 1), ("evidence", 1), ("evidence", 2)}
+
+class ValidationIssue(NamedTuple):
+    severity: str # "error" or "warning"
+    message: str
+    line: Optional[int] = None
+
+    def __str__(self) -> str:
+        where = f"line {self.line}: " if self.line is not None else ""
+        return f"[{self.severity}] {where}{self.message}"
+
+class ValidationReport(NamedTuple):
+    issues: List[ValidationIssue]
+
+    @property
+    def ok(self) -> bool:
+        """True if there is no error, warnings do not stop the inference"""
+        return not any(issue.severity == "error" for issue in self.issues)
+
+    @property
+    def errors(self) -> List[ValidationIssue]:
+        return [issue for issue in self.issues if issue.severity == "error"]
+
+    def format(self, limit:int = 20) -> str:
+        lines = [str(issue) for issue in self.issues[:limit]]
+        if len(self.issues) > limit:
+            lines.append(f" ...<{len(self.issues) - limit} other issues>... ")
+        return "\n".join(lines)
+
+@lru_cache(maxsize=1)
+def _builtin_signatures() -> frozenset:
+    return frozenset(DefaultEngine().get_builtins())
+
+def _signature(term:Term) -> Tuple[str, int]:
+    functor = term.functor
+    if len(functor) > 1 and functor[0] == functor[-1] == "'": # operators like '>' are quoted
+        functor = functor[1:-1]
+    return (functor, term.arity)
+
+def _walk_goals(body, negated:bool = False):
+    """Yield (goal, negated) for every called goal of a clause body, in order"""
+    if isinstance(body, (And, Or)):
+        yield from _walk_goals(body.op1, negated)
+        yield from _walk_goals(body.op2, negated)
+    elif isinstance(body, Not):
+        yield from _walk_goals(body.args[0], True)
+    elif isinstance(body, Term):
+        positions = _CONTROL_ARGS.get(_signature(body))
+        if positions is None:
+            yield body, negated
+            return
+        inner_negated = negated or body.functor in ("\\+", "not")
+        for pos in positions:
+            yield from _walk_goals(body.args[pos], inner_negated)
+
+def _variables(term) -> Set[str]:
+    return {str(var) for var in term.variables() if str(var) != "_"} if isinstance(term, Term) else set()
+
+def _probability_value(probability:Term) -> Optional[float]:
+    """The numeric value of a :: annotation, None for learnable t(_) or variable annotations"""
+    if isinstance(probability, Var) or probability.functor == "t" or probability.variables():
+        return None
+    return float(probability.compute_value())
+
+def _may_unify(goal, head) -> bool:
+    """Whether the goal could unify with the head, structurally and without variable bindings"""
+    if isinstance(goal, Var) or isinstance(head, Var):
+        return True
+    if not isinstance(goal, Term) or not isinstance(head, Term):
+        return goal == head
+    if goal.functor != head.functor or goal.arity != head.arity:
+        return False
+    return all(_may_unify(a, b) for a, b in zip(goal.args, head.args))
+
+def _reachable_goals(seeds:List[Term], rules:List[Tuple[List[Term], List[Term]]]) -> Set[int]:
+    """
+    ids of the goals that a query or evidence can reach: a rule is entered when a reached goal may unify
+    with one of its heads, its body goals are reached then. Bindings are not propagated into the body.
+    """
+    by_signature:Dict[Tuple[str, int], List[int]] = {}
+    for idx, (heads, _) in enumerate(rules):
+        for head in heads:
+            by_signature.setdefault(_signature(head), []).append(idx)
+    reached:Set[int] = set()
+    entered:Set[int] = set()
+    stack = list(seeds)
+    while stack:
+        goal = stack.pop()
+        if id(goal) in reached:
+            continue
+        reached.add(id(goal))
+        for idx in by_signature.get(_signature(goal), ()):
+            if idx not in entered and any(_may_unify(goal, head) for head in rules[idx][0]):
+                entered.add(idx)
+                stack.extend(rules[idx][1])
+    return reached
+
+def _check_clause(clause, lineno, defined:Set[Tuple[str, int]], called:List, seeds:List[Term],
+                  rules:List[Tuple[List[Term], List[Term]]]) -> List[ValidationIssue]:
+    issues:List[ValidationIssue] = []
+    line = lineno(clause)
+    if isinstance(clause, AnnotatedDisjunction):
+        heads, body = list(clause.heads), clause.body
+    elif isinstance(clause, Clause):
+        heads, body = clause.head.to_list() if isinstance(clause.head, Or) else [clause.head], clause.body
+    elif isinstance(clause, Or): # annotated disjunction fact
+        heads, body = clause.to_list(), None
+    else:
+        heads, body = [clause], None
+
+    # probability annotations
+    total = 0.0
+    for head in heads:
+        if head.probability is None:
+            continue
+        try:
+            value = _probability_value(head.probability)
+        except Exception:
+            issues.append(ValidationIssue("error", f"annotation '{head.probability}' of {head} is not a number", line))
+            continue
+        if value is None:
+            continue
+        if not 0.0 <= value <= 1.0:
+            issues.append(ValidationIssue("error", f"probability {value} of {head} is not in [0, 1]", line))
+        total += value
+    if len(heads) > 1 and total > 1.0 + 1e-9:
+        issues.append(ValidationIssue("error", f"probabilities of the annotated disjunction {clause} sum to {total:.4f} > 1", line))
+
+    for head in heads:
+        if _signature(head) not in _DIRECTIVES:
+            defined.add(_signature(head))
+        else:
+            for arg in head.args[:1]:
+                if isinstance(arg, Term) and not isinstance(arg, (Var, Constant)):
+                    called.append((arg, line))
+                    seeds.append(arg)
+
+    goals:List[Term] = []
+    rules.append(([head for head in heads if _signature(head) not in _DIRECTIVES], goals))
+    if body is not None:
+        bound = set().union(*(_variables(head) for head in heads))
+        for goal, negated in _walk_goals(body):
+            if isinstance(goal, Var):
+                continue # call(X) with a variable goal
+            if negated:
+                unbound = _variables(goal) - bound
+                if unbound:
+                    issues.append(ValidationIssue(
+                        "warning", f"unsafe negation \\+{goal}: {', '.join(sorted(unbound))} not bound before", line))
+            else:
+                bound |= _variables(goal)
+            called.append((goal, line))
+            goals.append(goal)
+    return issues
+
+def validate_program(model:str) -> ValidationReport:
+    """
+    Cheap static checks of a problog program before inference, without grounding:
+    syntax, :: annotations (numbers in [0, 1], annotated disjunctions sum to at most 1),
+    calls of undefined predicates or with a wrong arity (also in query/evidence) and unsafe negations.
+    Undefined calls are errors if a query or evidence can reach them, warnings otherwise: problog only
+    fails on the goals it grounds.
+    """
+    program = PrologString(model)
+    def lineno(term) -> Optional[int]:
+        location = getattr(term, "location", None)
+        try:
+            return program.lineno(location)[1] if location is not None else None
+        except Exception:
+            return None
+
+    issues:List[ValidationIssue] = []
+    defined:Set[Tuple[str, int]] = set()
+    called:List[Tuple[Term, Optional[int]]] = []
+    seeds:List[Term] = []
+    rules:List[Tuple[List[Term], List[Term]]] = []
+    try:
+        clauses = list(program)
+    except ProbLogError as e:
+        return ValidationReport([ValidationIssue("error", f"syntax error: {e}", getattr(e, "lineno", None))])
+
+    directives:List[str] = []
+    for clause in clauses:
+        if isinstance(clause, Clause) and clause.head.functor == "_directive": # problog's form of ":- Goal."
+            directives.append(f":- {clause.body}.") # e.g. use_module
+            continue
+        issues.extend(_check_clause(clause, lineno, defined, called, seeds, rules))
+
+    # predicates defined by libraries (use_module) are only known to the engine
+    try:
+        db = DefaultEngine().prepare(PrologString("\n".join(directives)))
+    except Exception as e:
+        issues.append(ValidationIssue("error", f"could not load directives: {e}"))
+        return ValidationReport(issues)
+    builtins = _builtin_signatures()
+    arities:Dict[str, Set[int]] = {}
+    for name, arity in defined:
+        arities.setdefault(name, set()).add(arity)
+
+    reachable = _reachable_goals(seeds, rules)
+    undefined:Dict[Tuple[str, int], Tuple[Optional[int], bool]] = {} # signature -> first line, reachable
+    for goal, line in called:
+        signature = _signature(goal)
+        if signature in defined or f"{signature[0]}/{signature[1]}" in builtins:
+            continue
+        if db.find(Term(goal.functor, *[None] * signature[1])) is not None:
+            continue
+        first_line, reached = undefined.get(signature, (line, False))
+        undefined[signature] = (first_line, reached or id(goal) in reachable)
+    for signature, (line, reached) in undefined.items():
+        severity, note = ("error", "") if reached else ("warning", ", not reachable from a query or evidence")
+        if signature[0] in arities:
+            known = ", ".join(f"{signature[0]}/{arity}" for arity in sorted(arities[signature[0]]))
+            issues.append(ValidationIssue(severity, f"{signature[0]}/{signature[1]} is called but only {known} is defined{note}", line))
+        else:
+            issues.append(ValidationIssue(severity, f"undefined predicate {signature[0]}/{signature[1]}{note}", line))
+    return ValidationReport(issues)
@@ -1,9 +1,16 @@
+import time
 import signal
+import threading
 from problog.program import PrologString
+from problog.logic import Term
 from problog import get_evaluatable, evaluator
-from typing import Any, Type, Tuple, Callable
+from typing import Any, List, Type, Tuple, Callable
 import traceback
+import hashlib
 import multiprocessing as mp
+from .circuit_cache import get_circuit_cache, ground_program
+from .limits import ResourceLimitExceeded, record_sizes, too_expensive_message
+from .problog_result import ProblogResult
 
 import logging
 logger = logging.getLogger(__name__)
@@ -38,29 +45,155 @@ def with_timeout(func, file_basename, timeout=120, *args, **kwargs):
     finally:
         signal.alarm(0)  # Ensure to close the alarm
   
-def _problog_test(model: str) -> Tuple[str,bool]:
-    """Run the Problog evaluation tool."""
+def _program_digest(model: str) -> str:
+    """Digest of the exact program bytes, used to recognize a program that was already evaluated"""
+    return hashlib.blake2b(model.encode("utf-8"), digest_size=16).hexdigest()
+
+def _sample_problog(model: str, samples: int | None = 1000, budget: float | None = None) -> Tuple[dict, int]:
+    """
+    Monte Carlo estimate of the query probabilities, samples that violate the evidence are rejected.
+    args:
+        samples: number of samples, None to sample until the budget is used
+        budget: seconds after which sampling stops
+    returns:
+        estimates per query and the number of accepted samples
+    """
+    from problog.tasks.sample import init_engine, init_db, ground, verify_evidence, SampledFormula
+    engine = init_engine()
+    db, evidence, ev_target = init_db(engine, PrologString(model), False)
+    deadline = time.monotonic() + budget if budget is not None else None
+    estimates:dict = {}
+    accepted = drawn = 0
+    while (samples is None or drawn < samples) and (deadline is None or time.monotonic() < deadline):
+        drawn += 1
+        target = SampledFormula()
+        for ev_fact in evidence:
+            target.add_atom(*ev_fact)
+        sampled = ground(engine, db, target=target)
+        if verify_evidence(engine, db, ev_target, target):
+            accepted += 1
+            for query_key, value in sampled.queries():
+                estimates[query_key] = estimates.get(query_key, 0) + (value == 0) # 0 is the TRUE node
+        engine.previous_result = sampled
+    if not accepted:
+        raise ValueError(f"All {drawn} samples were rejected by the evidence")
+    return {query_key: count / accepted for query_key, count in estimates.items()}, accepted
+
+def _problog_result(model: str, backend: str | None = None, queries: List[Term] | None = None) -> ProblogResult:
+    """
+    Run the Problog evaluation tool and return the complete, structured result.
+    args:
+        backend: problog evaluatable name ("sdd", "sddx", "ddnnf", "bdd", "fsdd", "fbdd", "kbest"),
+                 "sample" for a Monte Carlo estimate, None for the default of problog.
+                 k-best ignores evidence, programs with evidence are sampled instead.
+        queries: ground and evaluate these queries instead of the query/1 facts (not for sampling)
+    """
     logger.info("""Running problog_test_tool...""")
     try:
-        result = []
-        evaluatable:Type[evaluator.Evaluatable] = get_evaluatable().create_from(PrologString(model))
-        results:(dict | Any) = evaluatable.evaluate()
-
-        for query_key, probability in results.items():
-            result_line = f"{query_key} = {probability:.4f}"
-            result.append(result_line)
-            
-        if len(result) > 20:
-            result_lines = "% Problog Inference Result：\n" + "\n".join(result[:20]) + "\n ...<other results>... "
+        if backend == "kbest" and any(True for _ in ground_program(model).evidence()):
+            logger.warning("k-best inference ignores evidence, sampling instead")
+            estimates, accepted = _sample_problog(model)
+            result = ProblogResult.from_estimates(estimates, accepted, "sample estimate, k-best ignores evidence")
+        elif backend == "sample":
+            estimates, accepted = _sample_problog(model)
+            result = ProblogResult.from_estimates(estimates, accepted)
         else:
-            result_lines = "% Problog Inference Result：\n" + "\n".join(result)
-        logger.info("\n# -------------------------- result_lines -------------------------- #\n" + "\n".join(result[:5]))
-        return result_lines
+            compiled, cache_hit = get_circuit_cache().compile(model, backend, queries=queries)
+            if cache_hit:
+                logger.info(f"Reusing compiled circuit of program {compiled.key}")
+            evaluatable:Type[evaluator.Evaluatable] = compiled.circuit
+            result = ProblogResult.from_evaluation(evaluatable.evaluate())
+        logger.info("\n# -------------------------- result_lines -------------------------- #\n" + result.render(limit=5))
+        return result
+    except (MemoryError, RecursionError, ResourceLimitExceeded) as e:
+        error_message = too_expensive_message(e)
     except Exception:
         tb_lines = traceback.format_exc().splitlines()
         last_five = tb_lines[-5:]
         error_message = "Error evaluating Problog model:\n" + "\n".join(last_five)
         logger.error(error_message)
-        return error_message
+        return ProblogResult.failure(error_message)
     finally:
         logger.info("\n# -------------------------- End of problog_test_tool -------------------------- #")
+    # outside of the except block, so the frames of the failed evaluation are freed before logging
+    logger.error(error_message)
+    return ProblogResult.failure(error_message)
+
+def _problog_test(model: str, backend: str | None = None) -> str:
+    """
+    Run the Problog evaluation tool, the result as text with at most 20 queries, see _problog_result.
+    """
+    return _problog_result(model, backend).render()
+
+class _Interrupt:
+    """
+    Raise KeyboardInterrupt in the main thread after `seconds`, problog's k-best evaluator catches it
+    and returns the bounds found so far. Does nothing outside the main thread (no signals there).
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.active = threading.current_thread() is threading.main_thread() and seconds > 0
+        self.fired = False
+
+    def _handler(self, signum, frame):
+        self.fired = True
+        raise KeyboardInterrupt
+
+    def __enter__(self):
+        if self.active:
+            self.previous = signal.signal(signal.SIGALRM, self._handler)
+            signal.setitimer(signal.ITIMER_REAL, self.seconds)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.active:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous)
+        return exc_type is KeyboardInterrupt and self.fired # interrupted outside of the evaluator, keep what we have
+
+def _sampled_result(model: str, budget: float) -> ProblogResult:
+    estimates, accepted = _sample_problog(model, samples=None, budget=max(budget, 0))
+    return ProblogResult.from_estimates(estimates, accepted, f"estimate from {accepted} samples, exact inference timed out")
+
+def _problog_anytime(model: str, budget: float = 60) -> ProblogResult:
+    """
+    Bounded-time inference for programs whose exact evaluation does not finish.
+    Programs without evidence get lower and upper bounds per query from k-best proofs, the time is shared
+    between the queries and a query that runs out of time keeps the bounds found so far. Programs with
+    evidence (which k-best ignores), or whose k-best preparation (cycle breaking, Clark's completion) takes
+    more than half of the budget, get Monte Carlo estimates from as many samples as fit in the rest.
+    """
+    logger.info(f"Running anytime problog evaluation with a budget of {budget:.1f} seconds...")
+    deadline = time.monotonic() + budget
+    try:
+        ground = ground_program(model)
+        record_sizes(ground)
+        if any(True for _ in ground.evidence()):
+            return _sampled_result(model, deadline - time.monotonic())
+        evaluatable = None
+        with _Interrupt((deadline - time.monotonic()) / 2):
+            evaluatable = get_evaluatable("kbest").create_from(ground)
+        if evaluatable is None:
+            logger.warning("k-best preparation ran out of time, sampling instead")
+            return _sampled_result(model, deadline - time.monotonic())
+        evaluator_ = evaluatable.get_evaluator()
+        queries = list(evaluatable.queries())
+        results = {}
+        for idx, (query_key, node) in enumerate(queries):
+            share = (deadline - time.monotonic()) / (len(queries) - idx)
+            bounds = (0.0, 1.0)
+            with _Interrupt(share):
+                bounds = evaluator_.evaluate(node)
+            results[query_key] = bounds
+        result = ProblogResult.from_evaluation(results, "[lower, upper] bounds, exact inference timed out")
+        return result._replace(method="bounds")
+    except (MemoryError, RecursionError, ResourceLimitExceeded) as e:
+        error_message = too_expensive_message(e)
+    except Exception:
+        tb_lines = traceback.format_exc().splitlines()
+        error_message = "Error evaluating Problog model:\n" + "\n".join(tb_lines[-5:])
+        logger.error(error_message)
+        return ProblogResult.failure(error_message)
+    logger.error(error_message)
+    return ProblogResult.failure(error_message)
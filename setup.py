@@ -50,6 +50,7 @@ setuptools.setup(
         "pydantic>=2.11.4",
         "pydantic-settings>=2.9.1",
         "problog",
+        "numpy",
         "langchain>=0.3.25",
         "langchain-community>=0.3.24",
         "langchain-core>=0.3.59",
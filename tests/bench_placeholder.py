@@ -0,0 +1,128 @@
+import time
+import random
+import argparse
+from langda.utils.format_tools import (
+    _tokenize_problog,
+    _merge_problog_preserve,
+    _replace_placeholder,
+    CompiledTemplate,
+)
+
+# ======================================================================== #
+#                Reference implementation (before bounded window)          #
+# ======================================================================== #
+
+def _merge_problog_preserve_reference(s1:str, s2:str) -> str:
+    tokens1 = _tokenize_problog(s1)
+    tokens2 = _tokenize_problog(s2)
+    texts1 = [t for t, _, _ in tokens1]
+    texts2 = [t for t, _, _ in tokens2]
+    max_k = min(len(texts1), len(texts2))
+    for k in range(max_k, 0, -1):
+        if texts1[-k:] == texts2[:k]:
+            j_start = tokens2[k-1][2]
+            return s1 + s2[j_start:]
+    return s1 + s2
+
+def _replace_placeholder_reference(template:str, replacement_list, placeholder="{{LANGDA}}") -> str:
+    segments = template.split(placeholder)
+    result = segments[0]
+    for i, seg in enumerate(segments[1:]):
+        replace_text = replacement_list[i]
+        if replace_text is not None:
+            result = _merge_problog_preserve_reference(result, replace_text.strip("\n"))
+        else:
+            result += placeholder
+        result = _merge_problog_preserve_reference(result, seg)
+    return result
+
+# ======================================================================== #
+#                              Workload builder                            #
+# ======================================================================== #
+
+def build_workload(slots:int, seed:int=0):
+    """
+    Build a template with `slots` {{LANGDA}} placeholders and matching generated codes.
+    Half of the codes repeat the clause head in front of the placeholder (overlap case).
+    """
+    rng = random.Random(seed)
+    template_lines = []
+    codes = []
+    for i in range(slots):
+        template_lines.append(f"fact_{i}(a). fact_{i}(b).\n0.{rng.randint(1, 9)}::coin_{i}.")
+        template_lines.append(f"rule_{i}(X) :- {{{{LANGDA}}}}.")
+        if i % 2:
+            codes.append(f"rule_{i}(X) :- fact_{i}(X), coin_{i}")
+        else:
+            codes.append(f"fact_{i}(X), \\+ coin_{i}")
+    template_lines.append("query(rule_0(_)).")
+    return "\n".join(template_lines), codes
+
+def fuzz(rounds:int, seed:int=0) -> None:
+    """Compare the merge against the reference implementation on random token soup"""
+    rng = random.Random(seed)
+    alphabet = ["a", "b", "X", ":-", ",", ".", "(", ")", " ", "\n", "ab", ":", "-", "0.5", "::"]
+    for _ in range(rounds):
+        s1 = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 200)))
+        s2 = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+        expected = _merge_problog_preserve_reference(s1, s2)
+        actual = _merge_problog_preserve(s1, s2)
+        if expected != actual:
+            raise AssertionError(f"Mismatch for s1={s1!r}, s2={s2!r}: {expected!r} != {actual!r}")
+    print(f"*** fuzz: {rounds} random merges identical to reference ***")
+
+def fuzz_template(rounds:int, seed:int=0) -> None:
+    """Compare full and partial renders of CompiledTemplate against the reference implementation"""
+    rng = random.Random(seed)
+    template, codes = build_workload(30, seed)
+    compiled = CompiledTemplate(template)
+    for _ in range(rounds):
+        values = [rng.choice([code, None, "X", f"rule_{rng.randint(0, 29)}(X) :- "]) for code in codes]
+        if rng.random() < 0.5 or not compiled._values:
+            actual = compiled.render(values)
+        else:
+            values = list(compiled._values)
+            slot = rng.randrange(len(values))
+            values[slot] = rng.choice([codes[slot], None, "."])
+            actual = compiled.update(slot, values[slot])
+        if actual != _replace_placeholder_reference(template, values):
+            raise AssertionError(f"Template mismatch for values={values!r}")
+    print(f"*** fuzz: {rounds} random template renders identical to reference ***")
+
+def bench(slots:int, repeat:int) -> None:
+    template, codes = build_workload(slots)
+    expected = _replace_placeholder_reference(template, codes)
+    actual = CompiledTemplate(template).render(codes)
+    if expected != actual:
+        raise AssertionError(f"Output mismatch for {slots} slots")
+
+    def cold(template, codes):
+        return CompiledTemplate(template).render(codes)
+
+    compiled = CompiledTemplate(template)
+    compiled.render(codes)
+    def partial(template, codes):
+        # one slot in the middle of the template changed since the last round
+        return compiled.update(slots // 2, codes[slots // 2] + ", true")
+
+    timings = {}
+    for name, func in (("reference", _replace_placeholder_reference), ("cold", cold), ("partial", partial)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(template, codes)
+        timings[name] = (time.perf_counter() - start) / repeat
+    print(f"slots={slots:5d} | reference={timings['reference']*1000:9.2f}ms | "
+          f"cold={timings['cold']*1000:8.2f}ms ({timings['reference']/timings['cold']:6.1f}x) | "
+          f"partial={timings['partial']*1000:8.2f}ms ({timings['reference']/timings['partial']:6.1f}x)")
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Benchmark {{LANGDA}} placeholder replacement")
+    argparser.add_argument("--slots", type=int, nargs="+", default=[10, 100, 300, 600])
+    argparser.add_argument("--repeat", type=int, default=3)
+    argparser.add_argument("--fuzz", type=int, default=2000)
+    args = argparser.parse_args()
+
+    fuzz(args.fuzz)
+    fuzz_template(args.fuzz // 10)
+    for slots in args.slots:
+        bench(slots, args.repeat)